@@ -0,0 +1,215 @@
+#!/usr/bin/env python
+"""
+Bid strength estimator.
+
+Expected points of every 7-card hand are precomputed offline (by playing
+the hand as bets winner with greedy strategy against greedy opponents,
+over random deals of the rest of the deck, see estimateHand) and
+stored in a compact binary file: 8 byte header ('BIDS' and the number of
+hands) followed by one little-endian uint16 per hand. Hands are indexed
+by combinatorial number system over card ids, so lookup is a single read.
+Only canonical hands (see canonical.canonicalHand) are estimated, the rest
+of the table is copied from them.
+
+The file is memory mapped on the first lookup, nothing is loaded at
+startup. If the table file is missing, lookups return None (the file is
+looked for only once).
+
+Usage:
+    python bids.py -o bids.dat --samples 16 --workers 4
+"""
+
+from canonical import canonicalHand
+from cards import ThousandCard
+from engine import Game
+import os
+import random
+import struct
+try:
+    import mmap
+except ImportError:
+    mmap = None
+
+HAND = 7
+MAGIC = 'BIDS'
+HEADER = struct.Struct('<4sI')
+BINOMIAL = [[0] * (HAND + 1) for n in range(25)]
+for n in range(25):
+    BINOMIAL[n][0] = 1
+    for k in range(1, min(n, HAND) + 1):
+        BINOMIAL[n][k] = BINOMIAL[n-1][k-1] + BINOMIAL[n-1][k]
+HANDS = BINOMIAL[24][HAND]
+PATH = os.path.join(os.path.dirname(__file__), 'bids.dat')
+
+def handIndex(mask):
+    """
+    Returns index (0..HANDS-1) of the 7-card hand given as card mask.
+    """
+
+    index = 0
+    k = 1
+    for c in range(24):
+        if mask >> c & 1:
+            index += BINOMIAL[c][k]
+            k += 1
+    return index
+
+def handMask(index):
+    """
+    Returns card mask of the hand with given index (reverse of handIndex).
+    """
+
+    mask = 0
+    c = 24
+    for k in range(HAND, 0, -1):
+        c -= 1
+        while BINOMIAL[c][k] > index:
+            c -= 1
+        mask |= 1 << c
+        index -= BINOMIAL[c][k]
+    return mask
+
+def estimateHand(mask, rng, samples=16):
+    """
+    Estimates points the hand collects as bets winner: the rest of the deck
+    is dealt randomly, the hand takes the bank and plays it out with
+    greedy strategy against greedy opponents.
+    """
+
+    from simulator import GreedyStrategy
+    hand = ThousandCard.fromMask(mask)
+    rest = ThousandCard.fromMask(((1 << 24) - 1) & ~mask)
+    strategy = GreedyStrategy(rng)
+    total = 0
+    for i in range(samples):
+        rng.shuffle(rest)
+        game = Game()
+        game.seats[0].cards = list(hand)
+        game.seats[1].cards = rest[0:7]
+        game.seats[2].cards = rest[7:14]
+        game.bank = rest[14:17]
+        game.seats[0].bet = game.bet = 100
+        game.seats[1].passed = game.seats[2].passed = True
+        game.state = 'collect'
+        game.turn = 0
+        game.collectBank(0)
+        for card in strategy.discard(game, 0):
+            game.discardCard(0, card)
+        game.start(0, 100)
+        while game.state == 'inGame':
+            seat = game.turn
+            game.putCard(seat, strategy.play(game, seat))
+        total += game.seats[0].getGamePoints()
+    return int(round(float(total) / samples))
+
+class BidTable(object):
+    """
+    Read-only view of the precomputed table.
+    """
+
+    def __init__(self, path=PATH):
+        self.path = path
+        self.data = None
+        self.missing = False
+
+    def open(self):
+        if self.data is None:
+            if self.missing:
+                return False
+            if not os.path.exists(self.path):
+                self.missing = True
+                return False
+            f = open(self.path, 'rb')
+            try:
+                if mmap:
+                    self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                else:
+                    self.data = f.read()
+            finally:
+                f.close()
+            magic, count = HEADER.unpack_from(self.data, 0)
+            if magic != MAGIC or count != HANDS:
+                self.data = None
+                raise ValueError('%s is not a bids table.' % self.path)
+        return True
+
+    def lookup(self, cards):
+        """
+        Returns expected points of the 7-card hand or None if there is no table.
+        """
+
+        if len(cards) != HAND or not self.open():
+            return None
+        offset = HEADER.size + 2 * handIndex(ThousandCard.mask(cards))
+        return struct.unpack_from('<H', self.data, offset)[0]
+
+    def suggestBet(self, cards):
+        """
+        Returns the highest bet worth making with the hand, or None if
+        there is no table or the hand is not worth the lowest bet of 100.
+        """
+
+        points = self.lookup(cards)
+        if points is None or points < 100:
+            return None
+        return min(300, points - points % 10)
+
+table = BidTable()
+
+def canonicalIndexes():
+    """
+    Returns index of the canonical hand for every hand index.
+    """
+
+    return [handIndex(canonicalHand(handMask(i))[0]) for i in range(HANDS)]
+
+def buildRange(args):
+    indexes, samples, seed = args
+    rng = random.Random(seed)
+    return [estimateHand(handMask(i), rng, samples) for i in indexes]
+
+def build(path, samples=16, workers=1, seed=0, chunk=2000):
+    """
+    Computes the table and writes it to the file.
+    """
+
+    canonical = canonicalIndexes()
+    unique = sorted(set(canonical))
+    args = [(unique[i:i + chunk], samples, seed * 1000003 + i) for i in range(0, len(unique), chunk)]
+    if workers > 1:
+        import multiprocessing
+        pool = multiprocessing.Pool(workers)
+        try:
+            results = pool.map(buildRange, args)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = [buildRange(a) for a in args]
+    estimates = {}
+    for a, values in zip(args, results):
+        estimates.update(zip(a[0], values))
+    values = [estimates[i] for i in canonical]
+    f = open(path + '.tmp', 'wb')
+    try:
+        f.write(HEADER.pack(MAGIC, HANDS))
+        f.write(struct.pack('<%dH' % HANDS, *values))
+    finally:
+        f.close()
+    os.rename(path + '.tmp', path)
+
+def main():
+    # Offline tools only, the application runtime has no multiprocessing.
+    from optparse import OptionParser
+    import multiprocessing
+    parser = OptionParser(usage='%prog [options]')
+    parser.add_option('-o', '--output', default=PATH, help='table file to write')
+    parser.add_option('--samples', type='int', default=16, help='random deals per hand')
+    parser.add_option('-w', '--workers', type='int', default=multiprocessing.cpu_count(),
+                      help='number of worker processes')
+    parser.add_option('--seed', type='int', default=0, help='random seed')
+    options, args = parser.parse_args()
+    build(options.output, options.samples, options.workers, options.seed)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,204 @@
+"""
+Versioned write-through cache.
+
+Values are stored under an id together with their version (increasing
+with every write of the entity). Writers put the new value after every
+change, readers get the cached value and fall back to the datastore when
+there is none.
+
+The backend is App Engine memcache. Where it is not available (tests,
+offline tools) LocalCache, an in-process stand-in with the same interface,
+is used instead.
+"""
+
+import cPickle as pickle
+import time
+try:
+    from google.appengine.api import memcache
+except ImportError:
+    memcache = None
+
+class LocalCache(object):
+    """
+    In-process stand-in of memcache client: get, gets, set, add, cas,
+    delete, incr, get_multi, set_multi and delete_multi. Values are pickled
+    like in memcache, so callers get copies.
+    """
+
+    def __init__(self, clock=time.time):
+        self.data = {}
+        self.clock = clock
+        self.stamps = {}
+        self.cas_ids = {}
+        self.stamp = 0
+
+    def lookup(self, key):
+        item = self.data.get(key)
+        if item is None:
+            return None
+        value, expires = item
+        if expires and expires <= self.clock():
+            del self.data[key]
+            return None
+        return item
+
+    def get(self, key):
+        item = self.lookup(key)
+        if item is None:
+            return None
+        return pickle.loads(item[0])
+
+    def gets(self, key):
+        item = self.lookup(key)
+        if item is None:
+            return None
+        self.cas_ids[key] = self.stamps[key]
+        return pickle.loads(item[0])
+
+    def set(self, key, value, time=0):
+        self.data[key] = (pickle.dumps(value, 2), time and self.clock() + time)
+        self.stamp += 1
+        self.stamps[key] = self.stamp
+        return True
+
+    def cas(self, key, value, time=0):
+        cas_id = self.cas_ids.pop(key, None)
+        if cas_id is None or self.lookup(key) is None or self.stamps[key] != cas_id:
+            return False
+        return self.set(key, value, time)
+
+    def add(self, key, value, time=0):
+        if self.lookup(key) is not None:
+            return False
+        return self.set(key, value, time)
+
+    def delete(self, key):
+        if self.lookup(key) is None:
+            return 1
+        del self.data[key]
+        return 2
+
+    def delete_multi(self, keys):
+        for key in keys:
+            self.delete(key)
+        return True
+
+    def incr(self, key, delta=1, initial_value=None):
+        item = self.lookup(key)
+        if item is None:
+            if initial_value is None:
+                return None
+            value, expires = initial_value, 0
+        else:
+            value, expires = pickle.loads(item[0]), item[1]
+        value = max(0, value + delta)
+        self.data[key] = (pickle.dumps(value, 2), expires)
+        self.stamp += 1
+        self.stamps[key] = self.stamp
+        return value
+
+    def get_multi(self, keys):
+        result = {}
+        for key in keys:
+            value = self.get(key)
+            if value is not None:
+                result[key] = value
+        return result
+
+    def set_multi(self, mapping, time=0):
+        for key, value in mapping.items():
+            self.set(key, value, time)
+        return []
+
+def createBackend():
+    """
+    Returns memcache client, or LocalCache if memcache is not available.
+    """
+
+    if memcache is None:
+        return LocalCache()
+    return memcache.Client()
+
+CAS_RETRIES = 5
+
+class VersionedCache(object):
+    """
+    Cache of versioned values. A value is never replaced by an older version:
+    writes are compare-and-set, so concurrent writers cannot interleave.
+    """
+
+    def __init__(self, namespace, backend=None, time=3600):
+        self.namespace = namespace
+        self.backend = backend or createBackend()
+        self.time = time
+
+    def key(self, id):
+        return '%s:%s' % (self.namespace, id)
+
+    def get(self, id, version=None):
+        """
+        Returns (version, value) cached for the id, or None. If version is
+        given, older cached values are not returned either.
+        """
+
+        item = self.backend.get(self.key(id))
+        if item is None or (version is not None and item[0] < version):
+            return None
+        return item
+
+    def getVersion(self, id):
+        """
+        Returns the cached version of the id, or None.
+        """
+
+        item = self.backend.get(self.key(id))
+        return item and item[0]
+
+    def put(self, id, version, value):
+        """
+        Stores the value of given version. Returns False if the cache
+        already holds a newer one.
+        """
+
+        key = self.key(id)
+        for attempt in range(CAS_RETRIES):
+            item = self.backend.gets(key)
+            if item is None:
+                if self.backend.add(key, (version, value), time=self.time):
+                    return True
+            elif item[0] > version:
+                return False
+            elif self.backend.cas(key, (version, value), time=self.time):
+                return True
+        # Lost every race; drop the entry rather than risk keeping an old one.
+        self.backend.delete(key)
+        return False
+
+    def delete(self, id):
+        self.backend.delete(self.key(id))
+
+counters = None
+
+def getCounters():
+    """
+    Returns the backend keeping metric counters (created on first use).
+    """
+
+    global counters
+    if counters is None:
+        counters = createBackend()
+    return counters
+
+def incrCounter(name, delta=1):
+    """
+    Increases the named metric counter.
+    """
+
+    return getCounters().incr('counter:' + name, delta, initial_value=0)
+
+def getCounter(name):
+    """
+    Returns the value of the named metric counter.
+    """
+
+    return int(getCounters().get('counter:' + name) or 0)
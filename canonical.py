@@ -0,0 +1,98 @@
+"""
+Suit-isomorphism canonicalization of hands and positions.
+
+Suits of 1000 are not fully symmetric: marriages are worth 40, 60, 80 or
+100 points depending on the kind, and the trump is a particular kind. So
+only the suits which can not be called are interchangeable. Those are
+permuted into canonical order (sorted by the cards every hand holds in
+them), the others keep their place.
+
+Hands are card masks (see ThousandCard.mask). A permutation is a list
+perm where perm[k] is the new kind index of kind index k.
+"""
+
+from cards import ThousandCard
+
+SUIT = 0x3F
+QUEEN_KING = 0xC
+
+def permuteMask(mask, perm):
+    """
+    Moves the cards of every kind k of the mask to kind perm[k].
+    """
+
+    result = 0
+    for k in range(4):
+        result |= (mask >> 6*k & SUIT) << 6*perm[k]
+    return result
+
+def inversePermutation(perm):
+    """
+    Returns the permutation which undoes given one.
+    """
+
+    inverse = [0] * 4
+    for k in range(4):
+        inverse[perm[k]] = k
+    return inverse
+
+def permuteKind(kind, perm):
+    """
+    Returns the kind code which given kind code becomes (None stays None).
+    """
+
+    if kind is None:
+        return None
+    return ThousandCard.kind_order[perm[ThousandCard.trump_index[kind]]]
+
+def canonicalize(hands, pinned=0):
+    """
+    Canonicalizes the hands (tuple of masks) keeping kinds of the pinned
+    4-bit kind mask in their place. Returns canonical hands and permutation.
+    """
+
+    free = [k for k in range(4) if not pinned >> k & 1]
+    patterns = [(tuple([h >> 6*k & SUIT for h in hands]), k) for k in free]
+    patterns.sort(reverse=True)
+    perm = range(4)
+    for slot, (pattern, k) in zip(free, patterns):
+        perm[k] = slot
+    return tuple([permuteMask(h, perm) for h in hands]), perm
+
+def canonicalPosition(hands, trump=None):
+    """
+    Canonicalizes a position where all cards are known (e.g. for the
+    solver). Kinds in which some hand has both king and queen, and the
+    trump, can make a difference and keep their place, so positions with
+    the same key have exactly the same value.
+
+    Returns (key, perm): key is the tuple of canonical hands and the trump
+    kind code.
+    """
+
+    pinned = 0
+    for k in range(4):
+        for h in hands:
+            if h >> 6*k & QUEEN_KING == QUEEN_KING:
+                pinned |= 1 << k
+    if trump is not None:
+        pinned |= 1 << ThousandCard.trump_index[trump]
+    hands, perm = canonicalize(hands, pinned)
+    return hands + (permuteKind(trump, perm),), perm
+
+def canonicalHand(mask):
+    """
+    Canonicalizes a single hand (e.g. for bid estimation). Kinds in which
+    the hand has king or queen may give the marriage with the bank, so they
+    keep their place; the rest are interchangeable. Only a marriage coming
+    whole from the bank is not told apart by the key.
+
+    Returns (canonical mask, perm).
+    """
+
+    pinned = 0
+    for k in range(4):
+        if mask >> 6*k & QUEEN_KING:
+            pinned |= 1 << k
+    hands, perm = canonicalize((mask,), pinned)
+    return hands[0], perm
@@ -1,4 +1,4 @@
-class Card:
+class Card(object):
     """
     Represents a card.
 
@@ -24,12 +24,18 @@ class Card:
         Seven of spades -> S7
     """
 
+    __slots__ = ('code',)
+
     def __init__(self, code):
-        if not code[0] in self.kinds.keys():
+        self.validate(code)
+        self.code = code
+
+    @classmethod
+    def validate(cls, code):
+        if not code[:1] in cls.kinds:
             raise ValueError('Invalid kind code given for the card.')
-        if not code[1:] in self.values.keys():
+        if not code[1:] in cls.values:
             raise ValueError('Invalid value code given for the card.')
-        self.code = code
 
     def __str__(self):
         return self.code
@@ -86,12 +92,171 @@ class ThousandCard(Card):
     Ace, 10, King, Queen, Jack, and 9.
     
     Also implemented point counting.
+
+    Every card also has an integer id in range 0..23. The id is the position
+    of the card in the sorted deck (kind_order first, then value_order), so
+    comparing, sorting and point counting are lookups in the tables below.
+
+    There is only one immutable instance for every card code: the constructor
+    returns the cached instance, so cards are compared by identity.
     """
 
+    __slots__ = ('id',)
+
+    def __new__(cls, code):
+        try:
+            return cls.instances[code]
+        except KeyError:
+            cls.validate(code)
+            card = object.__new__(cls)
+            object.__setattr__(card, 'code', code)
+            object.__setattr__(card, 'id', cls.ids[code])
+            cls.instances[code] = card
+            return card
+
+    def __init__(self, code):
+        pass
+
+    def __setattr__(self, name, value):
+        raise AttributeError('Cards are immutable.')
+
+    def __reduce__(self):
+        return (ThousandCard, (self.code,))
+
+    def __eq__(self, other):
+        return self is other
+
+    def __ne__(self, other):
+        return self is not other
+
+    def __hash__(self):
+        return self.id
+
+    def __cmp__(self, other):
+        return cmp(self.id, other.id)
+
     def points(self):
-        return self.weight[self.value()]
+        return self.point_table[self.id]
+
+    def rank(self):
+        return self.rank_table[self.id]
+
+    @classmethod
+    def generateDeck(cls):
+        return list(cls.deck)
+
+    @classmethod
+    def mask(cls, cards):
+        """
+        Encodes the list of cards into 24-bit mask (bit number is card id).
+        """
+
+        mask = 0
+        for c in cards:
+            mask |= 1 << c.id
+        return mask
+
+    @classmethod
+    def fromMask(cls, mask):
+        """
+        Decodes the mask into sorted list of cards.
+        """
+
+        return [cls.deck[i] for i in range(24) if mask >> i & 1]
+
+    @classmethod
+    def maskPoints(cls, mask):
+        """
+        Sums the points of all cards in the mask.
+        """
+
+        t = cls.mask_point_table
+        return t[0][mask & 0xFF] + t[1][mask >> 8 & 0xFF] + t[2][mask >> 16 & 0xFF]
+
+    @classmethod
+    def maskCount(cls, mask):
+        """
+        Counts the cards in the mask.
+        """
+
+        t = cls.bit_count_table
+        return t[mask & 0xFF] + t[mask >> 8 & 0xFF] + t[mask >> 16 & 0xFF]
+
+    @classmethod
+    def pack(cls, cards):
+        """
+        Encodes the list of cards into string of bytes (one card id per byte).
+        """
+
+        return ''.join([chr(c.id) for c in cards])
+
+    @classmethod
+    def unpack(cls, data):
+        """
+        Decodes the list of cards from the string made by pack.
+        """
+
+        deck = cls.deck
+        return [deck[ord(b)] for b in data]
+
+    @classmethod
+    def packMask(cls, cards):
+        """
+        Encodes unordered cards into 3 bytes (little-endian card mask).
+        """
+
+        mask = cls.mask(cards)
+        return chr(mask & 0xFF) + chr(mask >> 8 & 0xFF) + chr(mask >> 16 & 0xFF)
+
+    @classmethod
+    def unpackMask(cls, data):
+        """
+        Decodes the sorted list of cards from the string made by packMask.
+        """
+
+        return cls.fromMask(ord(data[0]) | ord(data[1]) << 8 | ord(data[2]) << 16)
 
     pairs = {'S': 40, 'C': 60, 'D': 80, 'H': 100}
     weight = {'A': 11, '10': 10, 'K': 4, 'Q': 3, 'J': 2, '9': 0}
     values = {'A': 'Ace', 'K': 'King', 'Q': 'Queen', 'J': 'Jack', '10': 'Ten', '9': 'Nine'}
     value_order = ['9', 'J', 'Q', 'K', '10', 'A']
+
+# Integer representation of the 1000 deck: id = kind index * 6 + rank.
+ThousandCard.codes = [k + v for k in ThousandCard.kind_order for v in ThousandCard.value_order]
+ThousandCard.ids = dict([(c, i) for i, c in enumerate(ThousandCard.codes)])
+ThousandCard.instances = {}
+ThousandCard.deck = [ThousandCard(c) for c in ThousandCard.codes]
+ThousandCard.kind_table = [i // 6 for i in range(24)]
+ThousandCard.rank_table = [i % 6 for i in range(24)]
+ThousandCard.point_table = [ThousandCard.weight[c[1:]] for c in ThousandCard.codes]
+
+# Masks of all cards of each kind and of the king and queen (pair) of each kind.
+ThousandCard.kind_masks = dict([(k, 0x3F << 6*i) for i, k in enumerate(ThousandCard.kind_order)])
+ThousandCard.pair_masks = dict([(k, 0xC << 6*i) for i, k in enumerate(ThousandCard.kind_order)])
+ThousandCard.bit_count_table = [sum([b >> i & 1 for i in range(8)]) for b in range(256)]
+ThousandCard.mask_point_table = [[sum([ThousandCard.point_table[8*j + i] for i in range(8) if b >> i & 1])
+                                  for b in range(256)] for j in range(3)]
+
+# beats_table[trump][best][card] tells if the card takes the trick from the
+# best card so far. Trump index is kind index, or 4 when there is no trump.
+ThousandCard.trump_index = dict([(k, i) for i, k in enumerate(ThousandCard.kind_order)])
+ThousandCard.beats_table = [[[(a // 6 == b // 6 and b > a) or (a // 6 != b // 6 and b // 6 == t) for b in range(24)]
+                             for a in range(24)] for t in range(5)]
+
+
+def resolveTrick(first, cards, trump=None):
+    """
+    Returns the seat (0..2) which takes the trick.
+
+    Cards are given in the order they were put, starting from the seat first.
+    Trump is the kind code of current trump or None.
+    """
+
+    beats = ThousandCard.beats_table[ThousandCard.trump_index.get(trump, 4)]
+    best = cards[0].id
+    seat = 0
+    for i in range(1, len(cards)):
+        if beats[best][cards[i].id]:
+            best = cards[i].id
+            seat = i
+    return (first + seat) % 3
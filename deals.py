@@ -0,0 +1,65 @@
+"""
+Batch deal generator and hand features for offline analysis.
+
+Deals are NumPy arrays of card ids (see ThousandCard.codes), one row per
+deal, laid out like Session.deal: 7 cards for every player followed by
+3 cards of the bank. Requires NumPy, which is not needed by the game itself.
+"""
+
+from cards import ThousandCard
+import numpy
+
+POINTS = numpy.array(ThousandCard.point_table, dtype=numpy.int16)
+PAIRS = numpy.array([ThousandCard.pairs[k] for k in ThousandCard.kind_order], dtype=numpy.int16)
+ACE = ThousandCard.value_order.index('A')
+TEN = ThousandCard.value_order.index('10')
+QUEEN = ThousandCard.value_order.index('Q')
+KING = ThousandCard.value_order.index('K')
+
+def generateDeals(count, seed=None):
+    """
+    Returns count shuffled decks as (count, 24) int8 array.
+    """
+
+    rng = numpy.random.RandomState(seed)
+    return numpy.argsort(rng.random_sample((count, 24)), axis=1).astype(numpy.int8)
+
+def iterDeals(count, seed=None, chunk=1000000):
+    """
+    Yields count deals in chunks, so large batches fit in memory.
+    """
+
+    rng = numpy.random.RandomState(seed)
+    while count > 0:
+        size = min(count, chunk)
+        yield numpy.argsort(rng.random_sample((size, 24)), axis=1).astype(numpy.int8)
+        count -= size
+
+def splitDeals(deals):
+    """
+    Splits deals into hands, (count, 3, 7) array, and banks, (count, 3) array.
+    """
+
+    return deals[:, :21].reshape(-1, 3, 7), deals[:, 21:24]
+
+def handFeatures(hands):
+    """
+    Computes the features of hands given as array of card ids (the last
+    axis holds the cards of one hand). Returns dictionary of arrays:
+        lengths - number of cards of every kind, shape (..., 4)
+        marriages - if the hand has king and queen of the kind, shape (..., 4)
+        aces, tens - number of aces and tens
+        points - card points of the hand
+        pairs - value of all marriages in the hand
+    """
+
+    cards = numpy.zeros(hands.shape[:-1] + (24,), dtype=numpy.bool_)
+    numpy.put_along_axis(cards, hands.astype(numpy.intp), True, axis=-1)
+    suits = cards.reshape(hands.shape[:-1] + (4, 6))
+    marriages = suits[..., QUEEN] & suits[..., KING]
+    return {'lengths': suits.sum(axis=-1, dtype=numpy.int8),
+            'marriages': marriages,
+            'aces': suits[..., ACE].sum(axis=-1, dtype=numpy.int8),
+            'tens': suits[..., TEN].sum(axis=-1, dtype=numpy.int8),
+            'points': cards.dot(POINTS).astype(numpy.int16),
+            'pairs': marriages.dot(PAIRS).astype(numpy.int16)}
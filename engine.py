@@ -0,0 +1,721 @@
+from cards import ThousandCard, resolveTrick
+from random import shuffle
+
+MASK64 = (1 << 64) - 1
+DECK_CACHE_SIZE = 1024
+deckCache = {}
+
+def seededDeck(seed, number):
+    """
+    Returns the deck shuffled for the game number of the session with
+    given seed. The shuffle is Fisher-Yates driven by splitmix64 stream,
+    so the same seed and number always give the same deal. Recent decks
+    are cached.
+    """
+
+    key = (seed, number)
+    deck = deckCache.get(key)
+    if deck is None:
+        state = (seed ^ (number * 0x9E3779B97F4A7C15)) & MASK64
+        deck = list(ThousandCard.deck)
+        for i in range(23, 0, -1):
+            state = (state + 0x9E3779B97F4A7C15) & MASK64
+            z = ((state ^ (state >> 30)) * 0xBF58476D1CE4E5B9) & MASK64
+            z = ((z ^ (z >> 27)) * 0x94D049BB133111EB) & MASK64
+            z ^= z >> 31
+            j = ((z >> 32) * (i + 1)) >> 32
+            deck[i], deck[j] = deck[j], deck[i]
+        if len(deckCache) >= DECK_CACHE_SIZE:
+            deckCache.clear()
+        deck = deckCache[key] = tuple(deck)
+    return list(deck)
+
+class GameError(Exception):
+    pass
+
+class PlayerRules(object):
+    """
+    Rules of the single player hand, shared by in-memory seats and
+    datastore players. Expects cards, tricks and calls attributes.
+    """
+
+    def getMask(self, field):
+        """
+        Returns the cards of the field (cards or tricks) as 24-bit mask.
+        The mask is kept until the list is replaced, or until cardsChanged
+        is called after the list was changed in place.
+        """
+
+        cards = getattr(self, field)
+        masks = getattr(self, 'masks', None)
+        if masks is None:
+            masks = self.masks = {}
+        kept = masks.get(field)
+        if kept is None or kept[0] is not cards:
+            kept = masks[field] = (cards, ThousandCard.mask(cards))
+        return kept[1]
+
+    def cardsChanged(self):
+        """
+        Drops the kept masks of the player's cards and tricks.
+        """
+
+        self.masks = {}
+
+    def cardsMask(self):
+        """
+        Returns player's cards as 24-bit mask.
+        """
+
+        return self.getMask('cards')
+
+    def hasCard(self, card):
+        """
+        Checks if player has given card.
+        """
+
+        return self.cardsMask() >> card.id & 1 == 1
+
+    def hasPair(self, card):
+        """
+        Checks if player have a pair for given card.
+        """
+
+        pair = ThousandCard.pair_masks[card.kind()]
+        if not pair & (1 << card.id):
+            return False
+        return self.cardsMask() & pair & ~(1 << card.id) != 0
+
+    def hasKind(self, kind):
+        """
+        Checks if player has card for given kind.
+        """
+
+        return self.cardsMask() & ThousandCard.kind_masks[kind] != 0
+
+    def legalMask(self, kind=None):
+        """
+        Returns the mask of cards player is allowed to put when the trick
+        was started with given kind (any card if the kind is not matched).
+        """
+
+        mask = self.cardsMask()
+        if kind is not None and mask & ThousandCard.kind_masks[kind]:
+            mask &= ThousandCard.kind_masks[kind]
+        return mask
+
+    def legalCards(self, kind=None):
+        """
+        Returns the cards player is allowed to put (see legalMask).
+        """
+
+        return ThousandCard.fromMask(self.legalMask(kind))
+
+    def getGamePoints(self):
+        """
+        Calculates and returns points collected in current game.
+        """
+
+        points = 0
+        for c in self.calls:
+            points += ThousandCard.pairs[c]
+        return points + ThousandCard.maskPoints(self.getMask('tricks'))
+
+class Seat(PlayerRules):
+    """
+    In-memory state of one player in the game.
+    """
+
+    fields = ('points', 'cards', 'bank', 'thrown', 'tricks', 'blind',
+              'bet', 'passed', 'plus', 'calls', 'barrel')
+
+    def __init__(self, name=''):
+        self.name = name
+        self.points = 0
+        self.cards = []
+        self.bank = []
+        self.thrown = []
+        self.tricks = []
+        self.blind = None
+        self.bet = None
+        self.passed = False
+        self.plus = False
+        self.calls = ''
+        self.barrel = 0
+
+class Game(object):
+    """
+    The rules of 1000 as in-memory state machine, without any storage.
+
+    If the game has a seed, the cards are dealt by seededDeck(seed, deals),
+    so every deal can be derived again from the seed and its number.
+    Otherwise they are shuffled with shuffle function.
+
+    Players are referred by their seat number (0..2). Every finished game
+    appends the points of all three seats to history. Every successful
+    action appends its move (code, seat, argument) to moves, so the game
+    can be restored from a snapshot and the moves played after it (see
+    apply, snapshot and fromSnapshot).
+
+    States:
+        ready - waiting for the dealer to deal the cards
+        bettings - players raise bets or pass
+        collect - bets winner collects the bank
+        finalBet - bets winner discards 3 cards and makes final bet
+        inGame - players put cards
+        endGame - game is over, waiting for the next deal
+        finish - somebody reached 1000 points
+    """
+
+    fields = ('dealer', 'turn', 'bet', 'state', 'blind', 'bank', 'memo', 'trump', 'info',
+              'seed', 'deals')
+
+    def __init__(self, names=('', '', ''), shuffle=shuffle):
+        self.seats = [Seat(name) for name in names]
+        self.dealer = 0
+        self.turn = None
+        self.bet = None
+        self.state = 'ready'
+        self.blind = False
+        self.bank = []
+        self.memo = []
+        self.trump = None
+        self.info = None
+        self.seed = None
+        self.deals = 0
+        self.history = []
+        self.moves = []
+        self.shuffle = shuffle
+
+    def getNextSeat(self, seat):
+        """
+        Returns who is the next after the current seat.
+        """
+
+        return (seat + 1) % 3
+
+    def goBlind(self, seat):
+        """
+        Chooses to play blind.
+
+        Fails if:
+            - Choise was already open.
+        """
+
+        if self.seats[seat].blind is False:
+            raise GameError('The choise was already made to be open.')
+
+        self.seats[seat].blind = True
+        self.moves.append(('B', seat, None))
+
+    def goOpen(self, seat):
+        """
+        Chooses to play open.
+        """
+
+        self.seats[seat].blind = False
+        self.moves.append(('O', seat, None))
+
+    def deal(self, seat):
+        """
+        New game is started. The game can only be started by dealer.
+        Dealer deals the cards. The turn is given to player after dealer.
+
+        Fails if:
+            - Current game have not been finished.
+            - Current seat is not a dealer.
+        """
+
+        if not self.state in ('ready', 'endGame'):
+            raise GameError('Current game have not been finished or session is not full.')
+        if seat != self.dealer:
+            raise GameError('Only the dealer can start the game.')
+
+        if self.seed is None:
+            cards = ThousandCard.generateDeck()
+            self.shuffle(cards)
+            self.moves.append(('D', seat, tuple([c.id for c in cards])))
+        else:
+            cards = seededDeck(self.seed, self.deals)
+            self.moves.append(('E', seat, self.deals))
+        self.deals += 1
+        for i, player in enumerate(self.seats):
+            player.cards = cards[i*7:(i+1)*7]
+            player.passed = False
+            player.bet = None
+            player.blind = None
+            player.bank = []
+            player.thrown = []
+            player.tricks = []
+            player.calls = ''
+        self.bank = cards[21:24]
+        self.memo = []
+        self.turn = self.dealer = self.getNextSeat(self.dealer)
+        self.bet = 90
+        self.state = 'bettings'
+        self.blind = False
+        self.trump = None
+        self.info = None
+
+    def raiseBet(self, seat, bet):
+        """
+        Tries to raise the bet up to given value.
+
+        Fails if:
+            - Bets are already finished
+            - The turn is not for the given seat
+            - Value is bettween 100 and 300
+            - Value is not divisible by 10
+            - Value is smaller than the current bet
+
+        First to reach 300 finished bettings.
+        """
+
+        if self.state != 'bettings':
+            raise GameError('Bettings are already finished.')
+        if self.turn != seat:
+            raise GameError('It\'s not your turn to bet.')
+        if bet < 100 or bet > 300:
+            raise GameError('Bet must be between 100 and 300.')
+        if bet % 10 != 0:
+            raise GameError('Bets must be divisible by 10.')
+        if bet <= self.bet:
+            raise GameError('Your bet must be higher than current bet.')
+
+        self.moves.append(('R', seat, bet))
+        player = self.seats[seat]
+        player.bet = bet
+        self.bet = bet
+        self.info = '%s raises up to %d' % (player.name, bet)
+        if bet == 300:
+            self.finishBets()
+            return
+        next = self.getNextSeat(seat)
+        if self.seats[next].passed:
+            next = self.getNextSeat(next)
+        if self.seats[next].passed:
+            self.finishBets()
+            return
+        self.turn = next
+
+    def makePass(self, seat):
+        """
+        Passes the bettings in current game. The player can only pass once in a game.
+
+        Fails if:
+            - Bets are already finished
+            - The turn is not for the given seat
+            - Player has already passed
+            - Player can not pass if he is the first one
+        """
+
+        if self.state != 'bettings':
+            raise GameError('Bettings are already finished.')
+        if self.turn != seat:
+            raise GameError('It\'s not your turn to pass.')
+        if self.seats[seat].passed:
+            raise GameError('This player has already passed.')
+        if self.isFirstMove():
+            raise GameError('The first player cannot pass the first time.')
+
+        self.moves.append(('P', seat, None))
+        player = self.seats[seat]
+        player.passed = True
+        self.info = '%s passes' % player.name
+        next = self.getNextSeat(seat)
+        if self.seats[next].passed:
+            next = self.getNextSeat(next)
+        self.turn = next
+        if self.betsOver():
+            self.finishBets()
+
+    def isFirstMove(self):
+        """
+        Checks if it is the first move in the game.
+        """
+
+        return (self.bet == 90) and (self.dealer == self.turn)
+
+    def betsOver(self):
+        """
+        Checks if bettings are over.
+
+        Bet are over when:
+            - Two of the three player passes
+            - 300 points bet is reached
+        """
+
+        passed = len([p for p in self.seats if p.passed])
+        return passed == 2 or self.bet == 300
+
+    def betsWinner(self):
+        """"
+        Returns bets winner seat (last betting player) which can collect the bank.
+        """
+
+        for seat, player in enumerate(self.seats):
+            if player.bet == 300:
+                return seat
+        for seat, player in enumerate(self.seats):
+            if not player.passed:
+                return seat
+        raise GameError('Unexpected error: all players passed')
+
+    def finishBets(self):
+        """
+        After bets are over, set game variables and goes to bank collect state.
+        """
+
+        seat = self.betsWinner()
+        self.bet = self.seats[seat].bet
+        self.blind = self.seats[seat].blind
+        self.state = 'collect'
+        self.turn = seat
+
+    def collectBank(self, seat):
+        """
+        Collect the bank.
+
+        Fails if:
+            - Game state is not for collect.
+            - The given seat is not the winner of bettings.
+        """
+
+        if self.state != 'collect':
+            raise GameError('Bank can not be collected at this game state.')
+        if self.betsWinner() != seat:
+            raise GameError('Only the bets winner can collect the bank.')
+
+        self.moves.append(('C', seat, None))
+        player = self.seats[seat]
+        player.cards += self.bank
+        player.cardsChanged()
+        self.info = '%s takes the bank' % player.name
+        self.memo += self.bank
+        self.bank = []
+        self.state = 'finalBet'
+
+    def discardCard(self, seat, card):
+        """
+        Discards card to the bank.
+
+        Fails if:
+            - The turn is not for the given seat.
+            - There is already 3 cards in bank.
+            - Player does not have given card.
+            - Game state is not for discarding cards.
+        """
+
+        if self.state != 'finalBet':
+            raise GameError('You can not put cards in this game state.')
+        if self.turn != seat:
+            raise GameError('It\'s not your turn to go.')
+        if len(self.bank) == 3:
+            raise GameError('There is already 3 cards in bank.')
+        if not self.seats[seat].hasCard(card):
+            raise GameError('Player does not have given card.')
+
+        self.moves.append(('X', seat, card.id))
+        self.seats[seat].cards.remove(card)
+        self.seats[seat].cardsChanged()
+        self.bank.append(card)
+
+    def retrieveCard(self, seat, card):
+        """
+        Retrieves card from the bank in final bet state (in case of mistake).
+
+        Fails if:
+            - Game state is not final bet.
+            - The turn is not for the given seat.
+            - Bank does not contain given card.
+        """
+
+        if self.state != 'finalBet':
+            raise GameError('Retrieving cards is possible only in final bet state.')
+        if self.turn != seat:
+            raise GameError('It\'s not your turn to go.')
+        if not card in self.bank:
+            raise GameError('Bank does not contain given card.')
+
+        self.moves.append(('T', seat, card.id))
+        self.bank.remove(card)
+        self.seats[seat].cards.append(card)
+        self.seats[seat].cardsChanged()
+
+    def takePlus(self, seat):
+        """
+        Takes a plus (passes the game after bettings) for a player.
+
+        Fails if:
+            - Game state is not final bet.
+            - The turn is not for the given seat.
+            - Player already has a plus. (It is only possible to pass once after bettings.)
+        """
+
+        if self.state != 'finalBet':
+            raise GameError('Taking a plus is possible only in final bet state.')
+        if self.turn != seat:
+            raise GameError('It\'s not your turn to go.')
+        if self.seats[seat].plus:
+            raise GameError('Player already has a plus.')
+
+        self.moves.append(('U', seat, None))
+        player = self.seats[seat]
+        player.plus = True
+        player.bet = 0
+        self.state = 'endGame'
+        nextdealer = self.getNextSeat(self.getNextSeat(self.dealer))
+        self.dealer = nextdealer
+        self.turn = nextdealer
+        self.info = '%s passes the game' % player.name
+        opponent1 = self.getNextSeat(seat)
+        opponent2 = self.getNextSeat(opponent1)
+        for op in (self.seats[opponent1], self.seats[opponent2]):
+            pts = 60
+            if self.blind:
+                pts *= 2
+            if op.points >= 880:
+                pts = 0
+            op.points += pts
+            op.bet = pts
+        self.history.append(tuple([p.points for p in self.seats]))
+
+    def start(self, seat, finalBet):
+        """
+        Called after bank collection and final bet. Start the main game.
+
+        Fails if:
+            - The turn is not for the given seat.
+            - Game state is not final bet.
+            - 3 cards have not been discarded.
+            - Final bet is not bettween 100 and 300
+            - Final bet is not divisible by 10
+            - Final bet is smaller than current bet.
+        """
+
+        if self.turn != seat:
+            raise GameError('It\'s not your turn.')
+        if self.state != 'finalBet':
+            raise GameError('Game can be begun only in final bet state.')
+        if len(self.bank) != 3:
+            raise GameError('3 cards must be discarded before begining the game.')
+        if finalBet < 100 or finalBet > 300:
+            raise GameError('Bet must be between 100 and 300.')
+        if finalBet % 10 != 0:
+            raise GameError('Bet must be divisible by 10.')
+        if finalBet < self.bet:
+            raise GameError('Your bet must be higher or equal than current bet.')
+        if self.blind and (finalBet != self.bet) and (finalBet < self.bet * 2):
+            raise GameError('When blind, your final bet must be double than current bet or equal.')
+
+        self.moves.append(('S', seat, finalBet))
+        player = self.seats[seat]
+        if self.blind and (finalBet > self.bet * 2):
+            self.blind = False
+            player.blind = False
+        self.bet = finalBet
+        player.bet = finalBet
+        self.state = 'inGame'
+        self.info = '%s plays %d' % (player.name, finalBet)
+        player.tricks = self.bank
+        self.bank = []
+
+    def putCard(self, seat, card):
+        """
+        Puts card to the bank.
+
+        Fails if:
+            - The turn is not for the given seat.
+            - Player does not have given card.
+            - Game state is not for putting cards.
+            - Given card doesn't match bank kind.
+        """
+
+        if self.state != 'inGame':
+            raise GameError('You can not put cards in this game state.')
+        if self.turn != seat:
+            raise GameError('It\'s not your turn to go.')
+        player = self.seats[seat]
+        if not player.hasCard(card):
+            raise GameError('Player does not have given card.')
+        if len(self.bank) > 0 and not player.legalMask(self.bank[0].kind()) >> card.id & 1:
+            raise GameError('You must put the card with matching kind.')
+
+        self.moves.append(('L', seat, card.id))
+        player.cards.remove(card)
+        player.cardsChanged()
+        player.thrown.append(card)
+        self.bank.append(card)
+        player.bank = [card]
+        self.info = ''
+        if (len(self.bank) == 1) and player.hasPair(card):
+            player.calls += card.kind()
+            self.trump = card.kind()
+            self.info = '%s calls %d (%s)' % (player.name,
+                        ThousandCard.pairs[self.trump], ThousandCard.kinds[self.trump])
+        if len(self.bank) < 3:
+            self.turn = self.getNextSeat(seat)
+            return
+
+        winner = resolveTrick(self.getNextSeat(seat), self.bank, self.trump)
+        self.seats[winner].tricks += self.bank
+        self.seats[winner].cardsChanged()
+        self.bank = []
+        self.turn = winner
+        self.info = self.seats[winner].name + ' takes the trick'
+        if len(player.cards) == 0:
+            self.finishGame()
+
+    def apply(self, move):
+        """
+        Plays the recorded move again (see moves).
+        """
+
+        code, seat, arg = move
+        if code == 'D':
+            shuffle = self.shuffle
+            def deck(cards):
+                cards[:] = [ThousandCard.deck[i] for i in arg]
+            self.shuffle = deck
+            try:
+                self.deal(seat)
+            finally:
+                self.shuffle = shuffle
+        elif code == 'E':
+            self.deals = arg
+            self.deal(seat)
+        elif code in ('R', 'S'):
+            getattr(self, MOVES[code])(seat, arg)
+        elif code in ('X', 'T', 'L'):
+            getattr(self, MOVES[code])(seat, ThousandCard.deck[arg])
+        else:
+            getattr(self, MOVES[code])(seat)
+
+    def snapshot(self):
+        """
+        Returns the whole state of the game as dictionary of plain values
+        (cards are given by their ids).
+        """
+
+        def plain(value):
+            if isinstance(value, list):
+                return [c.id for c in value]
+            return value
+        data = dict([(field, plain(getattr(self, field))) for field in self.fields])
+        data['seats'] = [dict([(field, plain(getattr(p, field))) for field in Seat.fields + ('name',)])
+                         for p in self.seats]
+        return data
+
+    @classmethod
+    def fromSnapshot(cls, data, shuffle=shuffle):
+        """
+        Creates the game from the state returned by snapshot.
+        """
+
+        def restore(target, values, fields):
+            for field in fields:
+                if not field in values:
+                    continue
+                value = values[field]
+                if isinstance(value, list):
+                    value = [ThousandCard.deck[i] for i in value]
+                setattr(target, field, value)
+        game = cls([p['name'] for p in data['seats']], shuffle)
+        restore(game, data, cls.fields)
+        for seat, values in zip(game.seats, data['seats']):
+            restore(seat, values, Seat.fields)
+        return game
+
+    def finishGame(self):
+        """
+        Counts the points after the last trick.
+        """
+
+        w = self.betsWinner()
+        for seat, p in enumerate(self.seats):
+            pts = p.getGamePoints()
+            if seat == w:
+                if pts >= self.bet:
+                    pts = self.bet
+                    self.info = "%s succeeds playing %d" % (p.name, self.bet)
+                else:
+                    pts = -self.bet
+                    self.info = "%s fails playing %d" % (p.name, self.bet)
+                if self.blind:
+                    self.info += " (Blind)"
+                    pts *= 2
+                p.points += pts
+                if p.points < 880:
+                    p.barrel = 0
+            else:
+                if self.blind:
+                    pts *= 2
+                pts = int(round(pts, -1))
+                if p.points >= 880:
+                    pts = 0
+                p.points += pts
+            if p.points >= 1000:
+                self.state = 'finish'
+                self.info = '%s has won the game!' % p.name
+            elif p.points >= 880:
+                p.barrel += 1
+                if p.barrel > 3:
+                    p.barrel = 0
+                    p.points -= 120
+            p.bet = pts
+        self.history.append(tuple([p.points for p in self.seats]))
+        if self.state != 'finish':
+            self.state = 'endGame'
+
+# Moves recorded by Game: code -> method. The argument is the bet for R
+# and S, card id for X, T and L, the dealt deck (card ids) for D and the
+# deal number for E (seeded deal).
+MOVES = {'B': 'goBlind', 'O': 'goOpen', 'D': 'deal', 'E': 'deal', 'R': 'raiseBet', 'P': 'makePass',
+         'C': 'collectBank', 'X': 'discardCard', 'T': 'retrieveCard', 'U': 'takePlus',
+         'S': 'start', 'L': 'putCard'}
+
+def packMove(move):
+    """
+    Encodes the move into few bytes: code, seat and the argument (bet in
+    tens, card id, 2-byte deal number or 24 card ids of the deck).
+    """
+
+    code, seat, arg = move
+    if code == 'D':
+        arg = ''.join([chr(i) for i in arg])
+    elif code == 'E':
+        arg = chr(arg >> 8) + chr(arg & 0xFF)
+    elif code in ('R', 'S'):
+        arg = chr(arg // 10)
+    elif arg is not None:
+        arg = chr(arg)
+    else:
+        arg = ''
+    return code + chr(seat) + arg
+
+def unpackMoves(data):
+    """
+    Decodes the list of moves from concatenated packMove strings.
+    """
+
+    moves = []
+    i = 0
+    while i < len(data):
+        code, seat = data[i], ord(data[i+1])
+        i += 2
+        if code == 'D':
+            arg = tuple([ord(b) for b in data[i:i+24]])
+            i += 24
+        elif code == 'E':
+            arg = ord(data[i]) << 8 | ord(data[i+1])
+            i += 2
+        elif code in ('R', 'S'):
+            arg = ord(data[i]) * 10
+            i += 1
+        elif code in ('X', 'T', 'L'):
+            arg = ord(data[i])
+            i += 1
+        else:
+            arg = None
+        moves.append((code, seat, arg))
+    return moves
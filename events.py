@@ -0,0 +1,107 @@
+"""
+Publishing of session events to the push server (see push/sse.py).
+
+Events are (channel, data) pairs. Seat channels carry the state of the
+session as seen from one seat (see views.buildState), chat channels the
+new chat messages of the session. The push server sends subscribers of
+a seat channel only the changed keys of its state.
+
+The push server is configured by SSE_URL and SSE_SECRET environment
+variables of the application process; the secret must be the one the
+push server runs with. If SSE_URL is set, events are posted there with
+App Engine urlfetch. Otherwise events go to LocalPublisher, an in-process
+stand-in with the same interface, which delivers them to local
+subscribers (tests, offline tools) and drops them if there are none.
+"""
+
+import hmac
+import hashlib
+import os
+try:
+    import simplejson as json
+except ImportError:
+    import json
+try:
+    from google.appengine.api import urlfetch
+except ImportError:
+    urlfetch = None
+
+SSE_URL = os.environ.get('SSE_URL')
+SSE_SECRET = os.environ.get('SSE_SECRET', '')
+
+def seatChannel(id, seat):
+    return 'seat:%d:%d' % (id, seat)
+
+def chatChannel(id):
+    return 'chat:%d' % id
+
+def channelToken(channel, secret=None):
+    """
+    Returns the token allowing to subscribe to the channel.
+    """
+
+    if secret is None:
+        secret = SSE_SECRET
+    if not secret:
+        raise ValueError('SSE_SECRET is not configured.')
+    return hmac.new(secret.encode('utf-8'), channel.encode('utf-8'), hashlib.sha1).hexdigest()
+
+class LocalPublisher(object):
+    """
+    In-process stand-in of the push server: callbacks subscribed to a
+    channel are called with the data of every event published to it.
+    """
+
+    def __init__(self):
+        self.subscribers = {}
+
+    def subscribe(self, channel, callback):
+        self.subscribers.setdefault(channel, []).append(callback)
+
+    def unsubscribe(self, channel, callback):
+        self.subscribers.get(channel, []).remove(callback)
+
+    def isSubscribed(self, channel):
+        return bool(self.subscribers.get(channel))
+
+    def publish(self, events):
+        for channel, data in events:
+            for callback in list(self.subscribers.get(channel, [])):
+                callback(data)
+
+class HttpPublisher(object):
+    """
+    Posts events to the push server without waiting for the answer.
+    Pushing is best effort: clients still poll /update now and then, so
+    lost events are caught up.
+    """
+
+    def __init__(self, url, secret):
+        if not secret:
+            raise ValueError('SSE_SECRET is not configured.')
+        self.url = url
+        self.secret = secret
+
+    def publish(self, events):
+        if not events:
+            return
+        rpc = urlfetch.create_rpc(deadline=2)
+        urlfetch.make_fetch_call(rpc, self.url + '/publish', method=urlfetch.POST,
+                                 payload=json.dumps(events, separators=(',',':')),
+                                 headers={'Content-Type': 'application/json',
+                                          'X-Secret': self.secret})
+
+publisher = None
+
+def getPublisher():
+    """
+    Returns the publisher of events (created on first use).
+    """
+
+    global publisher
+    if publisher is None:
+        if SSE_URL and urlfetch is not None:
+            publisher = HttpPublisher(SSE_URL, SSE_SECRET)
+        else:
+            publisher = LocalPublisher()
+    return publisher
@@ -13,10 +13,14 @@ function getParam(name) {
 var message = document.getElementById("chat_message");
 var chat = document.getElementById("chat_messages");
 var session_id = document.getElementById("session_id").value;
+var sse_url = document.getElementById("sse_url").value;
 
 var dict;
 var last = '';
-var last_chat = '';
+var chat_seq = 0;
+var version = -1;
+var sse_open = false;
+var poller = createXmlHttpRequestObject();
 var last_turn;
 var last_state;
 
@@ -33,113 +37,13 @@ function sendMessage(url) {
 }
 
 function update() {
-  var url = '/update?id=' + session_id + '&last=' + last + '&last_chat=' + last_chat;
+  var url = '/update?id=' + session_id + '&last=' + last + '&chat_seq=' + chat_seq;
   
   if (xmlHttp) {
     try {
       xmlHttp.onreadystatechange = function() {
         if ((xmlHttp.readyState == 4) && (xmlHttp.status == 200)) {
-          var response = xmlHttp.responseText;
-          eval('dict = ' + response);
-          last = dict.last;
-          if (dict.last_chat) {
-            last_chat = dict.last_chat;
-          }
-          for (var c in dict.chat) {
-            chat.innerHTML += ('<span class="date">['+dict.chat[c].datetime+']</span> <span class="player">'+dict.chat[c].player+': </span> '+dict.chat[c].message+'<br/>');
-          }
-          if (dict.chat.length > 0) {
-            chat.scrollTop = chat.scrollHeight - chat.clientHeight;
-          }
-          document.getElementById('info_header').innerHTML = dict.info_header;
-          var myturn = dict.player_turn;
-          var turn = dict.player_turn ? 1 : (dict.opponent1_turn ? 2 : 3);
-          var players = ['player', 'opponent1', 'opponent2'];
-          var properties = ['username', 'points', 'info'];
-          for (var i in players) {
-            for (var j in properties) {
-              document.getElementById(players[i]+'_'+properties[j]).innerHTML = 
-                eval('dict.'+players[i]+'_'+properties[j]);
-            }
-            if (eval('dict.'+players[i]+'_plus')) {
-              document.getElementById(players[i]+'_username').innerHTML += ' +';
-            }
-            var barrel = eval('dict.'+players[i]+'_barrel');
-            if (barrel > 0) {
-              document.getElementById(players[i]+'_username').innerHTML += ' (' + barrel + ')';
-            }
-            var e = document.getElementById(players[i]+'_turn');
-            e.style.display = eval('dict.'+players[i]+'_turn') ? 'block' : 'none';
-          }
-          if ((last_turn != turn) || (last_state != dict.state)) {
-            last_turn = turn;
-            last_state = dict.state;
-            document.title = myturn ? '1000 Online - Game (Your turn)' : '1000 Online - Game';
-            document.getElementById('trump').innerHTML = '';
-            document.getElementById('taken').innerHTML = '';
-            var controls = ['deal', 'open', 'blind', 'bettings', 'bet', 'pass', 'plus', 'collect', 'last'];
-            for (var i in controls) {
-              hide(controls[i]);
-            }
-            
-            switch (dict.state) {
-              case 'hosted':
-                break;
-              case 'ready':
-                if (myturn) {
-                  show('deal');
-                }
-                break;
-              case 'open_or_blind':
-                show('open');
-                show('blind');
-                break;
-              case 'go_blind':
-                show('open');
-              case 'go_open':
-                if (myturn && !dict.passed) {
-                  show('bettings');
-                  show('bet');
-                  if (!dict.first) {
-                    show('pass');
-                  }
-                  add_bets(dict.bettings);
-                }
-                break;
-              case 'collect':
-                if (myturn) {
-                  show('collect');
-                }
-                break;
-              case 'finalBet':
-                if (myturn) {
-                  show('bettings');
-                  show('bet');
-                  add_bets(dict.bettings);
-                  if (!dict.player_plus) {
-                    show('plus');
-                  }
-                }
-                break;
-              case 'inGame':
-                show('last');
-                document.getElementById('trump').innerHTML = dict.trump;
-                document.getElementById('taken').innerHTML = dict.taken;
-                break;
-              case 'finish':
-                break;
-            }
-          }
-          for (var i=1; i<=3; i++) {
-            eval("var e=document.getElementById('bank"+i+"'); var v=dict.bank["+(i-1)+"]; "+
-                 "if (v) {e.src='/images/cards/'+v+'.gif'; e.style.display='inline';}" + 
-                 "else {e.style.display='none'}");
-          }
-          for (var i=1; i<=10; i++) {
-            eval("var e=document.getElementById('card"+i+"'); var v=dict.cards["+(i-1)+"]; "+
-                 "if (v) {e.src='/images/cards/'+v+'.gif'; e.style.display='inline';}" + 
-                 "else {e.style.display='none'}");
-          }
+          showState(xmlHttp.responseText);
         }
       }
       xmlHttp.open("GET", url, true);
@@ -151,9 +55,199 @@ function update() {
   }
 }
 
+function poll() {
+  var url = '/update?id=' + session_id + '&last=' + last + '&chat_seq=' + chat_seq +
+            '&version=' + version + '&wait=1';
+
+  if (poller) {
+    try {
+      poller.onreadystatechange = function() {
+        if (poller.readyState == 4) {
+          var delay = 3000;
+          try {
+            if (poller.status == 200) {
+              delay = showState(poller.responseText) || delay;
+            }
+          }
+          finally {
+            // With the push stream open, polls only catch up lost events.
+            window.setTimeout(poll, sse_open ? Math.max(delay, 30000) : delay);
+          }
+        }
+      }
+      poller.open("GET", url, true);
+      poller.send(null);
+    }
+    catch(e) {
+      window.setTimeout(poll, 3000);
+    }
+  }
+}
+
+function listen() {
+  var source = new EventSource(sse_url);
+  source.addEventListener('state', function(e) {
+    var diff = JSON.parse(e.data);
+    if (!('base' in diff)) {
+      applyState(diff);
+      return;
+    }
+    if (diff.base != version) {
+      // The change does not apply to the shown state, load the current one.
+      update();
+      return;
+    }
+    var state = {};
+    for (var key in dict) {
+      state[key] = dict[key];
+    }
+    for (var key in diff) {
+      if (key != 'base') {
+        state[key] = diff[key];
+      }
+    }
+    applyState(state);
+  }, false);
+  source.addEventListener('chat', function(e) {
+    showChat(JSON.parse(e.data));
+  }, false);
+  source.onopen = function() {
+    // Events sent while disconnected are lost, load the current state.
+    sse_open = true;
+    update();
+  }
+  source.onerror = function() {
+    sse_open = false;
+  }
+}
+
+function showState(response) {
+  var state;
+  eval('state = ' + response);
+  if (!state.unchanged) {
+    showChat(state);
+    applyState(state);
+  }
+  return state.poll;
+}
+
+function showChat(state) {
+  var fresh = state.chat.slice(Math.max(0, state.chat.length - (state.chat_seq - chat_seq)));
+  chat_seq = Math.max(chat_seq, state.chat_seq);
+  for (var c in fresh) {
+    chat.innerHTML += ('<span class="date">['+fresh[c].datetime+']</span> <span class="player">'+fresh[c].player+': </span> '+fresh[c].message+'<br/>');
+  }
+  if (fresh.length > 0) {
+    chat.scrollTop = chat.scrollHeight - chat.clientHeight;
+  }
+}
+
+function applyState(state) {
+  if (state.version < version) {
+    return;
+  }
+  dict = state;
+  version = dict.version;
+  if (dict.last) {
+    last = dict.last;
+  }
+  document.getElementById('info_header').innerHTML = dict.info_header;
+  var myturn = dict.player_turn;
+  var turn = dict.player_turn ? 1 : (dict.opponent1_turn ? 2 : 3);
+  var players = ['player', 'opponent1', 'opponent2'];
+  var properties = ['username', 'points', 'info'];
+  for (var i in players) {
+    for (var j in properties) {
+      document.getElementById(players[i]+'_'+properties[j]).innerHTML = 
+        eval('dict.'+players[i]+'_'+properties[j]);
+    }
+    if (eval('dict.'+players[i]+'_plus')) {
+      document.getElementById(players[i]+'_username').innerHTML += ' +';
+    }
+    var barrel = eval('dict.'+players[i]+'_barrel');
+    if (barrel > 0) {
+      document.getElementById(players[i]+'_username').innerHTML += ' (' + barrel + ')';
+    }
+    var e = document.getElementById(players[i]+'_turn');
+    e.style.display = eval('dict.'+players[i]+'_turn') ? 'block' : 'none';
+  }
+  if ((last_turn != turn) || (last_state != dict.state)) {
+    last_turn = turn;
+    last_state = dict.state;
+    document.title = myturn ? '1000 Online - Game (Your turn)' : '1000 Online - Game';
+    document.getElementById('trump').innerHTML = '';
+    document.getElementById('taken').innerHTML = '';
+    var controls = ['deal', 'open', 'blind', 'bettings', 'bet', 'pass', 'plus', 'collect', 'last'];
+    for (var i in controls) {
+      hide(controls[i]);
+    }
+    
+    switch (dict.state) {
+      case 'hosted':
+        break;
+      case 'ready':
+        if (myturn) {
+          show('deal');
+        }
+        break;
+      case 'open_or_blind':
+        show('open');
+        show('blind');
+        break;
+      case 'go_blind':
+        show('open');
+      case 'go_open':
+        if (myturn && !dict.passed) {
+          show('bettings');
+          show('bet');
+          if (!dict.first) {
+            show('pass');
+          }
+          add_bets(dict.bettings, dict.hint);
+        }
+        break;
+      case 'collect':
+        if (myturn) {
+          show('collect');
+        }
+        break;
+      case 'finalBet':
+        if (myturn) {
+          show('bettings');
+          show('bet');
+          add_bets(dict.bettings, dict.hint);
+          if (!dict.player_plus) {
+            show('plus');
+          }
+        }
+        break;
+      case 'inGame':
+        show('last');
+        document.getElementById('trump').innerHTML = dict.trump;
+        document.getElementById('taken').innerHTML = dict.taken;
+        break;
+      case 'finish':
+        break;
+    }
+  }
+  for (var i=1; i<=3; i++) {
+    eval("var e=document.getElementById('bank"+i+"'); var v=dict.bank["+(i-1)+"]; "+
+         "if (v) {e.src='/images/cards/'+v+'.gif'; e.style.display='inline';}" + 
+         "else {e.style.display='none'}");
+  }
+  for (var i=1; i<=10; i++) {
+    eval("var e=document.getElementById('card"+i+"'); var v=dict.cards["+(i-1)+"]; "+
+         "if (v) {e.src='/images/cards/'+v+'.gif'; e.style.display='inline';}" + 
+         "else {e.style.display='none'}");
+  }
+}
+
 function updater() {
   update();
-  window.setTimeout(updater, 3000);
+  if (sse_url && window.EventSource) {
+    listen();
+  }
+  poll();
 }
 
 function show(element) {
@@ -164,7 +258,7 @@ function hide(element) {
   document.getElementById(element).style.display = 'none';
 }
 
-function add_bets(bets) {
+function add_bets(bets, hint) {
   if (bets) {
     var bettings = document.getElementById('bettings');
     while (bettings.childNodes.length > 0) {
@@ -174,6 +268,10 @@ function add_bets(bets) {
       option = document.createElement('option');
       option.setAttribute('value', bets[i])
       option.innerHTML = bets[i];
+      if (bets[i] == hint) {
+        option.innerHTML += ' (hint)';
+        option.setAttribute('selected', 'selected');
+      }
       bettings.appendChild(option);
     }
   }
@@ -0,0 +1,35 @@
+var ticket = document.getElementById("ticket").value;
+var bucket = document.getElementById("bucket").value;
+
+function poll() {
+  var xmlHttp = createXmlHttpRequestObject();
+  var url = '/match?ticket=' + ticket + '&bucket=' + bucket;
+
+  if (xmlHttp) {
+    try {
+      xmlHttp.onreadystatechange = function() {
+        if (xmlHttp.readyState == 4) {
+          var dict;
+          if (xmlHttp.status == 200) {
+            eval('dict = ' + xmlHttp.responseText);
+          }
+          if (xmlHttp.status == 403) {
+            location.href = '/lobby';
+          }
+          else if (dict && dict.session) {
+            location.href = '/play?id=' + dict.session;
+          }
+          else {
+            if (dict) {
+              ticket = dict.ticket;
+            }
+            setTimeout('poll()', 2000);
+          }
+        }
+      }
+      xmlHttp.open("GET", url, true);
+      xmlHttp.send(null);
+    }
+    catch(e) {}
+  }
+}
@@ -34,6 +34,10 @@ def main():
     ('/login', Login),
     ('/logout', Logout),
     ('/sessions', Sessions),
+    ('/lobby', Lobby),
+    ('/admin/migrate', Migrate),
+    ('/admin/counters', Counters),
+    ('/match', Match),
     ('/stats', Stats),
     ('/host', Host),
     ('/play', Play),
@@ -1,54 +1,203 @@
+from __future__ import with_statement
 from google.appengine.ext import db
 from google.appengine.api import users
 from cards import ThousandCard
-from random import shuffle
+from engine import Game, Seat, PlayerRules, GameError, packMove, unpackMoves, seededDeck
+from cache import VersionedCache, createBackend
+from scores import TRIPLE, packScores, unpackColumns, unpackScores
+import simplejson as json
+import datetime
+import random
+import threading
+import time
+
+class EncodedCards(object):
+    """
+    Card list as read from the datastore, decoded on the first access.
+    """
 
-class GameError(Exception):
-    pass
+    __slots__ = ('data', 'property')
+
+    def __init__(self, data, property):
+        self.data = data
+        self.property = property
+
+    def __len__(self):
+        return len(self.decode())
+
+    def isPacked(self):
+        return isinstance(self.data, db.Blob)
+
+    def decode(self):
+        if self.isPacked():
+            return self.property.unpack(self.data)
+        if self.data == '':
+            return []
+        return [ThousandCard(x) for x in self.data.split(' ')]
+
+class PackedCardProperty(db.Property):
+    """
+    List of cards stored as bytes, one card id per byte (see ThousandCard.pack).
+
+    The value is decoded on the first access, so lists which are not used
+    by the request are never decoded nor encoded again. Old space separated
+    strings ("HQ S10 DA") are read as well and packed on the next put.
+    """
 
-class ThousandCardProperty(db.Property):
     data_type = list
-    
+    pack = staticmethod(ThousandCard.pack)
+    unpack = staticmethod(ThousandCard.unpack)
+
     def default_value(self):
         return []
-    
-    def get_value_for_datastore(self, value):
-        value = super(ThousandCardProperty, self).get_value_for_datastore(value)
-        return ' '.join([str(x) for x in value])
+
+    def __get__(self, model_instance, model_class):
+        if model_instance is None:
+            return self
+        value = super(PackedCardProperty, self).__get__(model_instance, model_class)
+        if isinstance(value, EncodedCards):
+            value = value.decode()
+            setattr(model_instance, self._attr_name(), value)
+        return value
+
+    def get_value_for_datastore(self, model_instance):
+        value = getattr(model_instance, self._attr_name(), None)
+        if isinstance(value, EncodedCards) and value.isPacked():
+            return value.data
+        value = self.__get__(model_instance, model_instance.__class__)
+        if value is None:
+            return None
+        return db.Blob(self.pack(value))
 
     def make_value_from_datastore(self, value):
         if value is None:
             return None
-        if value == '':
-            return []
-        return [ThousandCard(x) for x in value.split(' ')]
+        return EncodedCards(value, self)
 
     def validate(self, value):
-        if value is not None and not isinstance(value, list):
+        if value is not None and not isinstance(value, (list, EncodedCards)):
             raise db.BadValueError('Property %s must be convertible '
                                 'to a list instance (%s)' % (self.name, value))
-        return super(ThousandCardProperty, self).validate(value)
+        return super(PackedCardProperty, self).validate(value)
 
     def empty(self, value):
         return len(value) == 0
 
-class Player(db.Model):
-    user = db.UserProperty(required=True)
-    points = db.IntegerProperty(default=0)
-    cards = ThousandCardProperty()
-    bank = ThousandCardProperty()
-    thrown = ThousandCardProperty()
-    tricks = ThousandCardProperty()
-    blind = db.BooleanProperty()
-    bet = db.IntegerProperty()
-    passed = db.BooleanProperty(default=False)
-    plus = db.BooleanProperty(default=False)
-    calls = db.StringProperty()
-    barrel = db.IntegerProperty(default=0)
-    
-    def __cmp__(self, other):
-        return self.key().id().__cmp__(other.key().id())
-    
+class CardMaskProperty(PackedCardProperty):
+    """
+    Unordered pile of cards (e.g. taken tricks) stored as 3-byte card mask
+    (see ThousandCard.packMask). Cards are read back sorted.
+    """
+
+    pack = staticmethod(ThousandCard.packMask)
+    unpack = staticmethod(ThousandCard.unpackMask)
+
+class ConcurrentModification(Exception):
+    """
+    Raised when the entity was changed by somebody else since it was read.
+    """
+
+    pass
+
+class UnitOfWork(object):
+    """
+    Collects the entities changed during one action and writes them all
+    with one batched put when the action is over:
+
+        with UnitOfWork():
+            session.putCard(player, card)
+
+    Units may be nested, then only the outermost one writes. If the action
+    fails, nothing is written. Entities may define beforeFlush and
+    afterFlush methods, which are called around the write (beforeFlush may
+    return more entities to be written with it), and checkVersion
+    method, which is called in the write transaction and may raise
+    ConcurrentModification to cancel the write.
+    """
+
+    local = threading.local()
+
+    def __init__(self):
+        self.entities = []
+
+    @classmethod
+    def current(cls):
+        """
+        Returns the innermost unit of work of this thread or None.
+        """
+
+        stack = getattr(cls.local, 'stack', None)
+        return stack and stack[-1] or None
+
+    def add(self, *entities):
+        """
+        Marks the entities to be written (each entity is written once).
+        """
+
+        for entity in entities:
+            for e in self.entities:
+                if e is entity:
+                    break
+            else:
+                self.entities.append(entity)
+
+    def flush(self):
+        """
+        Writes the collected entities with one datastore call.
+        """
+
+        if self.entities:
+            entities, self.entities = self.entities, []
+            for entity in list(entities):
+                if hasattr(entity, 'beforeFlush'):
+                    entities += entity.beforeFlush() or []
+            options = db.create_transaction_options(xg=True)
+            db.run_in_transaction_options(options, self.commit, entities)
+            for entity in entities:
+                if hasattr(entity, 'afterFlush'):
+                    entity.afterFlush()
+
+    def commit(self, entities):
+        for entity in entities:
+            if hasattr(entity, 'checkVersion'):
+                entity.checkVersion()
+        db.put(entities)
+
+    def __enter__(self):
+        if not hasattr(self.local, 'stack'):
+            self.local.stack = []
+        self.local.stack.append(self)
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.local.stack.pop()
+        if type is None:
+            outer = UnitOfWork.current()
+            if outer is None:
+                self.flush()
+            else:
+                outer.add(*self.entities)
+        return False
+
+def save(*entities):
+    """
+    Writes the entities with current unit of work, or at once if there is none.
+    """
+
+    work = UnitOfWork.current()
+    if work is None:
+        work = UnitOfWork()
+        work.add(*entities)
+        work.flush()
+    else:
+        work.add(*entities)
+
+class PlayerChoices(object):
+    """
+    Choices a player makes outside of the game turns. Expects getEntity
+    method, which returns the entity holding the player.
+    """
+
     def goBlind(self):
         """
         Chooses to play blind.
@@ -61,7 +210,7 @@ class Player(db.Model):
             raise GameError('The choise was already made to be open.')
         
         self.blind = True
-        self.put()
+        save(self.getEntity())
     
     def goOpen(self):
         """
@@ -71,47 +220,100 @@ class Player(db.Model):
         """
         
         self.blind = False
-        self.put()
-    
-    def hasPair(self, card):
-        """
-        Checks if player have a pair for given card.
-        """
-        
-        v = card.value()
-        k = card.kind()
-        if v == 'K':
-            c = ThousandCard(k+'Q')
-            return c in self.cards
-        elif v == 'Q':
-            c = ThousandCard(k+'K')
-            return c in self.cards
-        else:
-            return False
-    
-    def hasKind(self, kind):
-        """
-        Checks if player has card for given kind.
-        """
-        
-        for card in self.cards:
-            if card.kind() == kind:
-                return True
-        return False
+        save(self.getEntity())
+
+class Player(db.Model, PlayerRules, PlayerChoices):
+    user = db.UserProperty(required=True)
+    points = db.IntegerProperty(default=0)
+    cards = PackedCardProperty()
+    bank = PackedCardProperty()
+    thrown = PackedCardProperty()
+    tricks = CardMaskProperty()
+    blind = db.BooleanProperty()
+    bet = db.IntegerProperty()
+    passed = db.BooleanProperty(default=False)
+    plus = db.BooleanProperty(default=False)
+    calls = db.StringProperty()
+    barrel = db.IntegerProperty(default=0)
     
-    def getGamePoints(self):
-        """
-        Calculates and returns points collected in current game.
-        """
-        
-        points = 0
-        for c in self.calls:
-            points += ThousandCard.pairs[c]
-        for c in self.tricks:
-            points += c.points()
-        return points
+    def __cmp__(self, other):
+        return self.key().id().__cmp__(other.key().id())
+
+    def getEntity(self):
+        return self
+
+class SeatPlayer(Seat, PlayerChoices):
+    """
+    Player kept inside the embedded session (see Session.embedded).
+    Session and user are set by Session.getPlayers.
+    """
+
+    session = None
+    user = None
+
+    def getEntity(self):
+        return self.session
+
+class SeatsProperty(db.Property):
+    """
+    Seats of the embedded session stored as JSON text: one dictionary of
+    Seat.fields per seat, cards are given by their ids.
+    """
+
+    data_type = list
+
+    def default_value(self):
+        return []
+
+    def get_value_for_datastore(self, model_instance):
+        seats = super(SeatsProperty, self).get_value_for_datastore(model_instance)
+        if seats is None:
+            return None
+        data = []
+        for seat in seats:
+            values = {}
+            for field in Seat.fields:
+                value = getattr(seat, field)
+                if isinstance(value, list):
+                    value = [c.id for c in value]
+                values[field] = value
+            data.append(values)
+        return db.Text(json.dumps(data, separators=(',',':')))
+
+    def make_value_from_datastore(self, value):
+        if value is None:
+            return []
+        seats = []
+        for values in json.loads(value):
+            seat = SeatPlayer()
+            for field in Seat.fields:
+                value = values[field]
+                if isinstance(value, list):
+                    value = [ThousandCard.deck[i] for i in value]
+                setattr(seat, field, value)
+            seats.append(seat)
+        return seats
 
 class Session(db.Model):
+    """
+    Game session of three players.
+
+    Players are stored either as separate Player entities referenced by
+    player_1, player_2, player_3, dealer and turn, or, if the session is
+    embedded, inside the session itself: users and seats lists indexed by
+    the seat number, dealer_seat and turn_seat. Embedded session is read
+    and written as a single entity.
+
+    Every player has a SessionIndex entry of the session (the line in
+    their lobby), rewritten whenever the state, the players or the turn
+    change (see listing).
+
+    Moves are logged for replay (see replayGame): the packed moves since
+    the last snapshot are appended to moveLog, so a move adds only a few
+    bytes to the session write. Every SNAPSHOT_MOVES moves the finished
+    segment goes to a Move entity and a new Snapshot is written.
+    """
+
     player_1 = db.ReferenceProperty(Player, collection_name='sessions_as1')
     player_2 = db.ReferenceProperty(Player, collection_name='sessions_as2')
     player_3 = db.ReferenceProperty(Player, collection_name='sessions_as3')
@@ -123,10 +325,24 @@ class Session(db.Model):
     bet = db.IntegerProperty()
     state = db.StringProperty()
     blind = db.BooleanProperty(default=False)
-    bank = ThousandCardProperty()
-    memo = ThousandCardProperty()
+    bank = PackedCardProperty()
+    memo = PackedCardProperty()
     trump = db.StringProperty()
     info = db.StringProperty()
+    embedded = db.BooleanProperty(default=False)
+    users = db.ListProperty(users.User)
+    seats = SeatsProperty()
+    dealer_seat = db.IntegerProperty()
+    turn_seat = db.IntegerProperty()
+    version = db.IntegerProperty(default=0)
+    moves = db.IntegerProperty(default=0)
+    moveLog = db.BlobProperty()
+    logStart = db.IntegerProperty(default=0)
+    seed = db.IntegerProperty()
+    deals = db.IntegerProperty(default=0)
+    scores = db.BlobProperty()
+    scoreChunks = db.IntegerProperty(default=0)
+    listing = db.StringProperty()
 
     def __cmp__(self, other):
         return self.key().id().__cmp__(other.key().id())
@@ -136,12 +352,20 @@ class Session(db.Model):
         One user start the session as host.
         """
         
+        self.seed = random.getrandbits(63)
+        if self.embedded:
+            self.users = [user]
+            self.seats = [SeatPlayer()]
+            self.dealer_seat = 0
+            self.state = 'hosted'
+            save(self)
+            return self.getPlayers()[0]
         player = Player(user=user)
         player.put()
         self.player_1 = player
         self.dealer = player
         self.state = 'hosted'
-        self.put()
+        save(self)
         return player
 
     def join(self, user):
@@ -149,476 +373,576 @@ class Session(db.Model):
         Another user joins this session and becomes its player.
         """
 
+        if self.embedded:
+            if self.isFull():
+                raise GameError('This session is already full.')
+            self.users.append(user)
+            self.seats.append(SeatPlayer())
+            if self.isFull():
+                self.state = 'ready'
+            save(self)
+            return self.getPlayers()[len(self.users) - 1]
         if self.player_2 is None:
             player = Player(user=user)
             player.put()
             self.player_2 = player
-            self.put()
+            save(self)
             return player
         elif self.player_3 is None:
             player = Player(user=user)
             player.put()
             self.player_3 = player
             self.state = 'ready'
-            self.put()
+            save(self)
             return player
         else:
             raise GameError('This session is already full.')
         
+    def seat(self, users):
+        """
+        Three users start the session at once (see pollMatch); the session
+        is embedded and ready to be dealt.
+
+        Fails if:
+            - The same user is given more than once.
+        """
+
+        if len(set([user.email() for user in users])) < len(users):
+            raise GameError('The same user cannot take more seats.')
+
+        self.seed = random.getrandbits(63)
+        self.embedded = True
+        self.users = list(users)
+        self.seats = [SeatPlayer() for user in users]
+        self.dealer_seat = 0
+        self.state = 'ready'
+        save(self)
+        return self.getPlayers()
+
     def isFull(self):
         """
         Checks if all three player joined.
         """
 
+        if self.embedded:
+            return len(self.users) == 3
         return (self.player_1 is not None) and \
                (self.player_2 is not None) and \
                (self.player_3 is not None)
 
+    references = ('player_1', 'player_2', 'player_3', 'dealer', 'turn')
+
+    def getReferencedKeys(self):
+        """
+        Returns the keys of all players referenced by the session.
+        """
+
+        if self.embedded:
+            return []
+        keys = []
+        for name in self.references:
+            key = getattr(Session, name).get_value_for_datastore(self)
+            if key is not None and not key in keys:
+                keys.append(key)
+        return keys
+
+    def attachPlayers(self, players):
+        """
+        Sets the references to given player entities, so they are not
+        fetched again. References to the same player share one entity.
+        """
+
+        entities = dict([(p.key(), p) for p in players if p is not None])
+        for name in self.references:
+            key = getattr(Session, name).get_value_for_datastore(self)
+            if key in entities:
+                setattr(self, name, entities[key])
+
+    def prefetch(self):
+        """
+        Resolves all player references (players, dealer and turn) with one
+        batch get.
+        """
+
+        keys = self.getReferencedKeys()
+        if keys:
+            self.attachPlayers(db.get(keys))
+
+    def beforeFlush(self):
+        self.version = (self.version or 0) + 1
+        listing = self.getListing()
+        self.indexPending = listing != self.listing
+        self.lobbyChanged = self.indexPending and \
+            'hosted' in (self.state, (self.listing or '').split('|')[0])
+        self.listing = listing
+        if self.indexPending and self.has_key():
+            self.indexPending = False
+            return self.getIndexEntries()
+
+    def checkVersion(self):
+        """
+        Compare-and-set check of the write: the stored session must still
+        have the version this one was read with.
+        """
+
+        if not self.is_saved():
+            return
+        current = Session.get(self.key())
+        if current is not None and (current.version or 0) != self.version - 1:
+            raise ConcurrentModification('Session %d was changed meanwhile.' % self.key().id())
+
+    def afterFlush(self):
+        if getattr(self, 'indexPending', False):
+            self.indexPending = False
+            db.put(self.getIndexEntries())
+        if getattr(self, 'lobbyChanged', False):
+            self.lobbyChanged = False
+            lobbyCache.delete(LOBBY_KEY)
+        self.cache()
+
+    def getLobbyTurn(self):
+        """
+        Returns nickname of the player the lobby shows on turn: the dealer
+        before the game is dealt, the turn player afterwards.
+        """
+
+        if self.state in ('hosted', 'ready'):
+            turn = self.getDealer()
+        else:
+            turn = self.getTurn()
+        return turn and turn.user.nickname()
+
+    def getListing(self):
+        """
+        Returns the state, the number of players and whose turn it is, as
+        shown in the lobby. The index is rewritten when it changes.
+        """
+
+        players = [p for p in self.getPlayers() if p is not None]
+        return '%s|%d|%s' % (self.state, len(players), self.getLobbyTurn() or '')
+
+    def getIndexEntries(self):
+        """
+        Returns the SessionIndex entries of all players of the session.
+        """
+
+        players = [p for p in self.getPlayers() if p is not None]
+        if not players:
+            return []
+        turn = self.getLobbyTurn()
+        now = datetime.datetime.now()
+        return [SessionIndex(parent=self, key_name=p.user.email(),
+                             user=p.user,
+                             session_id=self.key().id(),
+                             hostedby=players[0].user.nickname(),
+                             started=self.started or now,
+                             modified=now,
+                             state=self.state,
+                             turn=turn) for p in players]
+
+    def cache(self):
+        """
+        Puts the session and its players to the session cache.
+        """
+
+        entities = [self]
+        if not self.embedded:
+            entities += [p for p in self.getPlayers() if p is not None]
+        data = [db.model_to_protobuf(e).Encode() for e in entities]
+        sessionCache.put(self.key().id(), self.version, data)
+
+    @classmethod
+    def load(cls, id, prefetch=True):
+        """
+        Returns the session with given id (or None) with resolved players.
+        The session cache is used if it holds the session, otherwise it is
+        read from the datastore and cached.
+        """
+
+        cached = sessionCache.get(id)
+        if cached is not None:
+            entities = [db.model_from_protobuf(e) for e in cached[1]]
+            session = entities[0]
+            session.attachPlayers(entities[1:])
+            return session
+        session = cls.get_by_id(id)
+        if session is not None and prefetch:
+            session.prefetch()
+            session.cache()
+        return session
+
     def getPlayerByUser(self, user):
         """
         Return the player associated with given user in this session.
         """
         
-        if self.player_1 and self.player_1.user == user: return self.player_1
-        elif self.player_2 and self.player_2.user == user: return self.player_2
-        elif self.player_3 and self.player_3.user == user: return self.player_3
-        else: return None
+        for p in self.getPlayers():
+            if p is not None and p.user == user:
+                return p
+        return None
+
+    def getPlayers(self):
+        """
+        Returns the list of session players in seat order (None for
+        the seats nobody joined yet).
+        """
+
+        if self.embedded:
+            for seat, user in zip(self.seats, self.users):
+                seat.session = self
+                seat.user = user
+                seat.name = user.nickname()
+            return self.seats + [None] * (3 - len(self.seats))
+        return [self.player_1, self.player_2, self.player_3]
 
     def getNextPlayer(self, current):
         """
         Returns who is the next after the current player.
         """
 
-        if current == self.player_1:
-            return self.player_2
-        elif current == self.player_2:
-            return self.player_3
-        elif current == self.player_3:
-            return self.player_1
+        seat = self.getSeat(current)
+        if seat is None:
+            return None
+        return self.getPlayers()[(seat + 1) % 3]
+
+    def getDealer(self):
+        """
+        Returns the dealer of current game.
+        """
+
+        if self.embedded:
+            return self.getPlayerAt(self.dealer_seat)
+        return self.dealer
+
+    def getTurn(self):
+        """
+        Returns the player whose turn it is (or None).
+        """
+
+        if self.embedded:
+            return self.getPlayerAt(self.turn_seat)
+        return self.turn
+
+    def getPlayerAt(self, seat):
+        """
+        Returns the player sitting at given seat (None for no seat).
+        """
+
+        if seat is None:
+            return None
+        return self.getPlayers()[seat]
+
+    def getSeat(self, player):
+        """
+        Returns the seat number (0..2) of given player or None.
+        """
+
+        if player is None:
+            return None
+        for seat, p in enumerate(self.getPlayers()):
+            if p is not None and p == player:
+                return seat
+        return None
+
+    def getGame(self):
+        """
+        Loads the session and its players into in-memory game.
+        """
+
+        if not self.isFull():
+            raise GameError('This session is not full.')
+        players = self.getPlayers()
+        game = Game([p.user.nickname() for p in players])
+        for seat, p in zip(game.seats, players):
+            for field in Seat.fields:
+                value = getattr(p, field)
+                if isinstance(value, list):
+                    value = list(value)
+                setattr(seat, field, value)
+        game.dealer = self.getSeat(self.getDealer())
+        game.turn = self.getSeat(self.getTurn())
+        for field in ('bet', 'state', 'blind', 'trump', 'info', 'seed', 'deals'):
+            setattr(game, field, getattr(self, field))
+        game.deals = game.deals or 0
+        game.bank = list(self.bank)
+        game.memo = list(self.memo)
+        return game
+
+    def beginMove(self):
+        """
+        Returns the in-memory game for an action (see putGame). The state
+        before the action is kept for the move log if a snapshot is due.
+        """
+
+        game = self.getGame()
+        if (self.moves or 0) % SNAPSHOT_MOVES == 0:
+            self.logBase = game.snapshot()
+        return game
+
+    def putGame(self, game):
+        """
+        Stores the in-memory game back into the session and its players.
+        Session, players and new history entries are written in one batch.
+        """
+
+        players = self.getPlayers()
+        for seat, p in zip(game.seats, players):
+            for field in Seat.fields:
+                setattr(p, field, getattr(seat, field))
+        if self.embedded:
+            self.dealer_seat = game.dealer
+            self.turn_seat = game.turn
+            entities = [self]
+        else:
+            self.dealer = players[game.dealer]
+            if game.turn is None:
+                self.turn = None
+            else:
+                self.turn = players[game.turn]
+            entities = [self] + players
+        for field in ('bet', 'state', 'blind', 'bank', 'memo', 'trump', 'info', 'deals'):
+            setattr(self, field, getattr(game, field))
+        with UnitOfWork():
+            save(*entities)
+            save(*self.appendScores(game.history))
+            save(*self.logMoves(game.moves))
+
+    def appendScores(self, points):
+        """
+        Appends the point triples to the score history. Returns the score
+        chunks which got full.
+        """
+
+        data = (self.scores or '') + packScores(points)
+        size = SCORE_CHUNK * TRIPLE
+        chunks = []
+        while len(data) >= size:
+            number = self.scoreChunks or 0
+            chunks.append(ScoreChunk(parent=self, key_name=logName(number), data=db.Blob(data[:size])))
+            self.scoreChunks = number + 1
+            data = data[size:]
+        self.scores = db.Blob(data)
+        return chunks
+
+    def getScoreData(self):
+        """
+        Returns the whole packed score history.
+        """
+
+        data = ''
+        if self.scoreChunks:
+            names = [logName(n) for n in range(self.scoreChunks)]
+            data = ''.join([c.data for c in ScoreChunk.get_by_key_name(names, parent=self)])
+        return data + (self.scores or '')
+
+    def getScores(self):
+        """
+        Returns the score history as three arrays, points of every player
+        after every game.
+        """
+
+        return unpackColumns(self.getScoreData())
+
+    def logMoves(self, moves):
+        """
+        Appends the moves to the move log. Returns new log entities when a
+        snapshot is due: the finished segment of moves and the snapshot of
+        the state before the new ones.
+        """
+
+        entities = []
+        number = self.moves or 0
+        start = self.logStart or 0
+        base = getattr(self, 'logBase', None)
+        self.logBase = None
+        if moves and base is not None and number % SNAPSHOT_MOVES == 0:
+            if number > start:
+                entities.append(Move(parent=self, key_name=logName(start), number=start,
+                                     data=db.Blob(self.moveLog or '')))
+            entities.append(Snapshot(parent=self, key_name=logName(number), number=number,
+                                     data=db.Text(json.dumps(base, separators=(',',':')))))
+            self.logStart = number
+            self.moveLog = ''
+        if moves:
+            self.moveLog = db.Blob((self.moveLog or '') + ''.join([packMove(m) for m in moves]))
+        self.moves = number + len(moves)
+        return entities
+
+    def replayGame(self, number=None):
+        """
+        Restores the game as it was after given number of moves (all
+        moves by default) from the last snapshot and the moves after it.
+        """
+
+        if number is None:
+            number = self.moves or 0
+        names = [logName(n) for n in range(number - number % SNAPSHOT_MOVES, -1, -SNAPSHOT_MOVES)]
+        for snapshot in Snapshot.get_by_key_name(names, parent=self):
+            if snapshot is not None:
+                break
+        else:
+            raise GameError('There is no snapshot of this session.')
+        game = Game.fromSnapshot(json.loads(snapshot.data))
+        game.seed = self.seed
+        if snapshot.number == (self.logStart or 0):
+            data = self.moveLog or ''
+        else:
+            segment = Move.get_by_key_name(logName(snapshot.number), parent=self)
+            data = segment and segment.data
+        moves = unpackMoves(data or '')
+        if len(moves) < number - snapshot.number:
+            raise GameError('The move log of this session is not complete.')
+        for move in moves[:number - snapshot.number]:
+            game.apply(move)
+        return game
+
+    def getDeal(self, number):
+        """
+        Returns the hands of the three seats and the bank of given deal,
+        derived from the seed of the session.
+        """
+
+        if self.seed is None:
+            raise GameError('The deals of this session are not seeded.')
+        cards = seededDeck(self.seed, number)
+        return [cards[0:7], cards[7:14], cards[14:21]], cards[21:24]
+
+    def goBlind(self, player):
+        """
+        Given player chooses to play blind (see Game.goBlind).
+        """
+
+        game = self.beginMove()
+        game.goBlind(self.getSeat(player))
+        self.putGame(game)
+
+    def goOpen(self, player):
+        """
+        Given player chooses to play open (see Game.goOpen).
+        """
+
+        game = self.beginMove()
+        game.goOpen(self.getSeat(player))
+        self.putGame(game)
 
     def deal(self, player):
         """
-        New game is started in given session.
-        The game can only be started by dealer.
-        Dealer deals the cards.
-        The turn is given to player after dealer.
+        New game is started in given session by the dealer (see Game.deal).
+        """
 
-        Fails if:
-            - Current game have not been finished.
-            - Session is not full.
-            - Current user is not a dealer.
-        """
-
-        if not self.state in ('ready', 'endGame'):
-            raise GameError('Current game have not been finished or session is not full.')
-        if player != self.dealer:
-            raise GameError('Only the dealer can start the game.')
-
-        cards = ThousandCard.generateDeck()
-        shuffle(cards)
-        for i, player in enumerate([self.player_1, self.player_2, self.player_3]):
-            player.cards = cards[i*7:(i+1)*7]
-            player.passed = False
-            player.bet = None
-            player.blind = None
-            player.bank = []
-            player.thrown = []
-            player.tricks = []
-            player.calls = ''
-            player.put()
-        self.info = '%s deals the cards' % player.user.nickname()
-        self.bank = cards[21:24]
-        self.memo = []
-        self.turn = self.dealer = self.getNextPlayer(self.dealer)
-        self.bet = 90
-        self.state = 'bettings'
-        self.blind = False
-        self.trump = None
-        self.info = None
-        self.put()
+        game = self.beginMove()
+        game.deal(self.getSeat(player))
+        self.putGame(game)
 
     def raiseBet(self, player, bet):
         """
-        Tries to raise the bet up to given value.
+        Tries to raise the bet up to given value (see Game.raiseBet).
+        """
 
-        Fails if:
-            - Bets are already finished
-            - The turn is not for the given user
-            - Value is bettween 100 and 300
-            - Value is not divisible by 10
-            - Value is smaller than the current bet
-
-        First to reach 300 finished bettings.
-        """
-
-        if self.state != 'bettings':
-            raise GameError('Bettings are already finished.')
-        if self.turn != player:
-            raise GameError('It\'s not your turn to bet.')
-        if bet < 100 or bet > 300:
-            raise GameError('Bet must be between 100 and 300.')
-        if bet % 10 != 0:
-            raise GameError('Bets must be divisible by 10.')
-        if bet <= self.bet:
-            raise GameError('Your bet must be higher than current bet.')
-
-        player.bet = bet
-        player.put()
-        self.bet = bet
-        self.info = '%s raises up to %d' % (player.user.nickname(), bet)
-        self.put()
-        if bet == 300:
-            self.finishBets()
-            return
-        next = self.getNextPlayer(player)
-        if next.passed:
-            next = self.getNextPlayer(next)
-        if next.passed:
-            self.finishBets()
-            return
-        self.turn = next
-        self.put()
+        game = self.beginMove()
+        game.raiseBet(self.getSeat(player), bet)
+        self.putGame(game)
 
     def makePass(self, player):
         """
-        Passes the bettings in current game. The player can only pass once in a game.
+        Passes the bettings in current game (see Game.makePass).
+        """
 
-        Fails if:
-            - Bets are already finished
-            - The turn is not for the given player
-            - Player has already passed
-            - Player can not pass if he is the first one
-        """
-
-        if self.state != 'bettings':
-            raise GameError('Bettings are already finished.')
-        if self.turn != player:
-            raise GameError('It\'s not your turn to pass.')
-        if player.passed:
-            raise GameError('This player has already passed.')
-        if self.isFirstMove():
-            raise GameError('The first player cannot pass the first time.')
-
-        player.passed = True
-        player.put()
-        self.info = '%s passes' % player.user.nickname()
-        self.put()
-        next = self.getNextPlayer(player)
-        if next.passed:
-            next = self.getNextPlayer(next)
-        self.turn = next
-        self.put()
-        if self.betsOver():
-            self.finishBets()
+        game = self.beginMove()
+        game.makePass(self.getSeat(player))
+        self.putGame(game)
 
     def isFirstMove(self):
         """
         Checks if it is the first move in the game.
         """
 
-        return (self.bet == 90) and (self.dealer == self.turn)
+        return (self.bet == 90) and (self.getDealer() == self.getTurn())
 
     def betsOver(self):
         """
-        Checks if bettings are over.
-
-        Bet are over when:
-            - Two of the three player passes
-            - 300 points bet is reached
+        Checks if bettings are over (see Game.betsOver).
         """
 
-        passed = 0
-        if self.player_1.passed: passed += 1
-        if self.player_2.passed: passed += 1
-        if self.player_3.passed: passed += 1
-
-        if passed == 2:
-            return True
-        if self.bet == 300:
-            return True
-        return False
+        passed = len([p for p in self.getPlayers() if p.passed])
+        return passed == 2 or self.bet == 300
 
     def betsWinner(self):
         """"
         Returns bets winner (last betting player) which can collect the bank.
         """
 
-        if self.player_1.bet == 300: return self.player_1
-        if self.player_2.bet == 300: return self.player_2
-        if self.player_3.bet == 300: return self.player_3
-
-        if not self.player_1.passed: return self.player_1
-        elif not self.player_2.passed: return self.player_2
-        elif not self.player_3.passed: return self.player_3
-        else: raise GameError('Unexpected error: all players passed')
+        players = self.getPlayers()
+        for player in players:
+            if player.bet == 300:
+                return player
+        for player in players:
+            if not player.passed:
+                return player
+        raise GameError('Unexpected error: all players passed')
 
     def finishBets(self):
         """
         After bets are over, set game variables and goes to bank collect state.
         """
 
-        player = self.betsWinner()
-        self.bet = player.bet
-        self.blind = player.blind
-        self.state = 'collect'
-        self.turn = player
-        self.put()
-        
+        game = self.beginMove()
+        game.finishBets()
+        self.putGame(game)
+
     def collectBank(self, player):
         """
-        Collect the bank.
-
-        Fails if:
-            - Game state is not for collect.
-            - The given player is the winner of bettings.
+        Collect the bank (see Game.collectBank).
         """
 
-        if self.state != 'collect':
-            raise GameError('Bank can not be collected at this game state.')
-        if self.betsWinner() != player:
-            raise GameError('Only the bets winner can collect the bank.')
-
-        player.cards += self.bank
-        player.put()
-        self.info = '%s takes the bank' % player.user.nickname()
-        self.memo += self.bank
-        self.bank = []
-        self.state = 'finalBet'
-        self.put()
+        game = self.beginMove()
+        game.collectBank(self.getSeat(player))
+        self.putGame(game)
 
     def discardCard(self, player, card):
         """
-        Discards card to the bank.
+        Discards card to the bank (see Game.discardCard).
+        """
 
-        Fails if:
-            - The turn is not for the given player.
-            - There is already 3 cards in bank.
-            - Player does not have given card.
-            - Game state is not for discarding cards.
-        """
-
-        if self.state != 'finalBet':
-            raise GameError('You can not put cards in this game state.')
-        if self.turn != player:
-            raise GameError('It\'s not your turn to go.')
-        if len(self.bank) == 3:
-            raise GameError('There is already 3 cards in bank.')
-        if not card in player.cards:
-            raise GameError('Player does not have given card.')
-
-        player.cards.remove(card)
-        self.bank.append(card)
-        player.put()
-        self.put()
+        game = self.beginMove()
+        game.discardCard(self.getSeat(player), card)
+        self.putGame(game)
 
     def retrieveCard(self, player, card):
         """
-        Retrieves card from the bank in final bet state (in case of mistake).
-
-        Fails if:
-            - Game state is not final bet.
-            - The turn is not for the given player.
-            - Bank does not contain given card.
+        Retrieves card from the bank in final bet state (see Game.retrieveCard).
         """
 
-        if self.state != 'finalBet':
-            raise GameError('Retrieving cards is possible only in final bet state.')
-        if self.turn != player:
-            raise GameError('It\'s not your turn to go.')
-        if not card in self.bank:
-            raise GameError('Bank does not contain given card.')
-
-        self.bank.remove(card)
-        self.put()
-        player.cards.append(card)
-        player.put()
+        game = self.beginMove()
+        game.retrieveCard(self.getSeat(player), card)
+        self.putGame(game)
 
     def takePlus(self, player):
         """
-        Takes a plus (passes the game after bettings) for a player.
-        
-        Fails if:
-            - Game state is not final bet.
-            - The turn is not for the given player.
-            - Player already has a plus. (It is only possible to pass once after bettings.)
+        Takes a plus (passes the game after bettings) for a player (see Game.takePlus).
         """
-        
-        if self.state != 'finalBet':
-            raise GameError('Taking a plus is possible only in final bet state.')
-        if self.turn != player:
-            raise GameError('It\'s not your turn to go.')
-        if player.plus:
-            raise GameError('Player already has a plus.')
-        
-        player.plus = True
-        player.bet = 0
-        player.put()
-        self.state = 'endGame'
-        nextdealer = self.getNextPlayer(self.getNextPlayer(self.dealer))
-        self.dealer = nextdealer
-        self.turn = nextdealer
-        self.info = '%s passes the game' % player.user.nickname()
-        self.put()
-        opponent1 = self.getNextPlayer(player)
-        opponent2 = self.getNextPlayer(opponent1)
-        for op in (opponent1, opponent2):
-            pts = 60
-            if self.blind:
-                pts *= 2
-            if op.points >= 880:
-                pts = 0                
-            op.points += pts
-            op.bet = pts
-            op.put()
-        h = History(session=self,
-                    player_1=self.player_1.points,
-                    player_2=self.player_2.points,
-                    player_3=self.player_3.points)
-        h.put()
+
+        game = self.beginMove()
+        game.takePlus(self.getSeat(player))
+        self.putGame(game)
 
     def start(self, player, finalBet):
         """
-        Called after bank collection and final bet. Start the main game.
+        Called after bank collection and final bet. Start the main game (see Game.start).
+        """
+
+        game = self.beginMove()
+        game.start(self.getSeat(player), finalBet)
+        self.putGame(game)
 
-        Fails if:
-            - The turn is not for the given player.
-            - Game state is not final bet.
-            - 3 cards have not been discarded.
-            - Final bet is not bettween 100 and 300
-            - Final bet is not divisible by 10
-            - Final bet is smaller than current bet.
-        """
-
-        if self.turn != player:
-            raise GameError('It\'s not your turn.')
-        if self.state != 'finalBet':
-            raise GameError('Game can be begun only in final bet state.')
-        if len(self.bank) != 3:
-            raise GameError('3 cards must be discarded before begining the game.')
-        if finalBet < 100 or finalBet > 300:
-            raise GameError('Bet must be between 100 and 300.')
-        if finalBet % 10 != 0:
-            raise GameError('Bet must be divisible by 10.')
-        if finalBet < self.bet:
-            raise GameError('Your bet must be higher or equal than current bet.')
-        if self.blind and (finalBet != self.bet) and (finalBet < self.bet * 2):
-            raise GameError('When blind, your final bet must be double than current bet or equal.')
-
-        if self.blind and (finalBet > self.bet * 2):
-            self.blind = False
-            player.blind = False
-        self.bet = finalBet
-        player.bet = finalBet
-        self.state = 'inGame'
-        self.info = '%s plays %d' % (player.user.nickname(), finalBet)
-        player.tricks = self.bank
-        self.bank = []
-        player.put()
-        self.put()
-    
     def putCard(self, player, card):
         """
-        Puts card to the bank.
+        Puts card to the bank (see Game.putCard).
+        """
 
-        Fails if:
-            - The turn is not for the given player.
-            - Player does not have given card.
-            - Game state is not for putting cards.
-            - Given card doesn't match bank kind.
-        """
-
-        if self.state != 'inGame':
-            raise GameError('You can not put cards in this game state.')
-        if self.turn != player:
-            raise GameError('It\'s not your turn to go.')
-        if not card in player.cards:
-            raise GameError('Player does not have given card.')
-
-        if len(self.bank) > 0:
-            first = self.bank[0]
-            if (first.kind() == card.kind()) or (not player.hasKind(first.kind())):
-                player.cards.remove(card)
-                player.thrown.append(card)
-                self.bank.append(card)
-            else:
-                raise GameError('You must put the card with matching kind.')
-        else:
-            player.cards.remove(card)
-            player.thrown.append(card)
-            self.bank.append(card)
-
-        player.bank = [card]
-        self.info = ''
-        if (len(self.bank) == 1) and player.hasPair(card):
-            player.calls += card.kind()
-            self.trump = card.kind()
-            self.info = '%s calls %d (%s)' % (player.user.nickname(), 
-                        ThousandCard.pairs[self.trump], ThousandCard.kinds[self.trump])
-        if len(self.bank) == 3:
-            self.bank[0].player = self.getNextPlayer(player)
-            self.bank[1].player = self.getNextPlayer(self.bank[0].player)
-            self.bank[2].player = player
-            anyTrumps = ([c.kind() for c in self.bank].count(self.trump) > 0)
-            for c in self.bank:
-                if anyTrumps:
-                    c.isTrump = (c.kind() == self.trump)
-                else:
-                    c.isTrump = (c.kind() == self.bank[0].kind())
-            bestCard = sorted(self.bank, cmp=cardCompare)[-1]
-            bestCard.player.tricks += self.bank
-            bestCard.player.put()
-            self.bank = []
-            self.turn = bestCard.player
-            self.info = bestCard.player.user.nickname() + ' takes the trick'
-            if len(player.cards) == 0:
-                w = self.betsWinner()
-                for p in (self.player_1, self.player_2, self.player_3):
-                    pts = p.getGamePoints()
-                    if p == w:
-                        if pts >= self.bet:
-                            pts = self.bet
-                            self.info = "%s succeeds playing %d" % (p.user.nickname(), self.bet)
-                        else:
-                            pts = -self.bet
-                            self.info = "%s fails playing %d" % (p.user.nickname(), self.bet)
-                        if self.blind:
-                            self.info += " (Blind)"
-                            pts *= 2
-                        p.points += pts
-                        if p.points < 880:
-                            p.barrel = 0
-                    else:
-                        if self.blind:
-                            pts *= 2
-                        pts = int(round(pts, -1))
-                        if p.points >= 880:
-                            pts = 0
-                        p.points += pts
-                    if p.points >= 1000:
-                        self.state = 'finish'
-                        self.info = '%s has won the game!' % p.user.nickname()
-                        #TODO: add finish date
-                        self.put()
-                    elif p.points >= 880:
-                        p.barrel += 1
-                        if p.barrel > 3:
-                            p.barrel = 0
-                            p.points -= 120
-                    p.bet = pts
-                    p.put()
-                h = History(session=self,
-                            player_1=self.player_1.points,
-                            player_2=self.player_2.points,
-                            player_3=self.player_3.points)
-                h.put()
-                if self.state != 'finish':
-                    self.state = 'endGame'
-                self.put()
-                return
-        else:
-            self.turn = self.getNextPlayer(player)
-        player.put()
-        self.put()
+        game = self.beginMove()
+        game.putCard(self.getSeat(player), card)
+        self.putGame(game)
 
     def getPlayerOffset(self, player):
         """
@@ -636,6 +960,306 @@ class Session(db.Model):
             else: return 2
 
 
+sessionCache = VersionedCache('session')
+chatCache = VersionedCache('chat')
+lobbyCache = createBackend()
+
+LOBBY_KEY = 'lobby:open'
+LOBBY_SIZE = 50
+LOBBY_TIME = 10
+
+def getOpenSessions():
+    """
+    Returns the newest hosted sessions (the ones with free seats) as the
+    lobby lists them. The listing is cached for LOBBY_TIME seconds and
+    dropped whenever a session is hosted or joined (see Session.afterFlush).
+    """
+
+    lines = lobbyCache.get(LOBBY_KEY)
+    if lines is not None:
+        return lines
+    sessions = Session.all().filter('state =', 'hosted').order('-started').fetch(LOBBY_SIZE)
+    keys = [Session.player_1.get_value_for_datastore(s) for s in sessions if not s.embedded]
+    hosts = dict(zip(keys, db.get(keys)))
+    lines = []
+    for s in sessions:
+        if s.embedded:
+            host, count = s.users[0], len(s.users)
+        else:
+            host = hosts[Session.player_1.get_value_for_datastore(s)].user
+            count = 1 + (Session.player_2.get_value_for_datastore(s) is not None)
+        line = {}
+        line['id'] = s.key().id()
+        line['hostedby'] = host.nickname()
+        line['started'] = s.started
+        line['free'] = 3 - count
+        lines.append(line)
+    lobbyCache.set(LOBBY_KEY, lines, time=LOBBY_TIME)
+    return lines
+
+SNAPSHOT_MOVES = 20
+
+def logName(number):
+    return '%08d' % number
+
+
+matchCache = createBackend()
+
+MATCH_TIME = 600
+MATCH_ALIVE = 30
+MATCH_GRACE = 5
+
+def matchKey(bucket, name):
+    return 'match:%s:%s' % (bucket, name)
+
+def enqueueMatch(user, bucket='any'):
+    """
+    Puts the user to the matchmaking queue of the bucket and returns
+    their ticket. The queue is a memcache counter and every three
+    consecutive tickets make one table. A user already waiting gets the
+    old ticket back.
+    """
+
+    ticket = matchCache.get(matchKey(bucket, 'user:' + user.email()))
+    if ticket is not None:
+        return ticket
+    tail = matchKey(bucket, 'tail')
+    ticket = matchCache.incr(tail)
+    if ticket is None:
+        # First use, or the counter was evicted: tickets continue from a
+        # random base (divisible by 3), so tables of the old tickets are
+        # never found again.
+        matchCache.add(tail, int(random.getrandbits(40) * 3))
+        ticket = matchCache.incr(tail)
+    waitMatch(user, ticket, bucket)
+    return ticket
+
+def waitMatch(user, ticket, bucket):
+    """
+    Marks the user as still waiting with the ticket. Tickets which are not
+    refreshed for MATCH_ALIVE seconds are abandoned.
+    """
+
+    matchCache.set_multi({matchKey(bucket, ticket): user,
+                          matchKey(bucket, 'user:' + user.email()): ticket},
+                         time=MATCH_ALIVE)
+
+def pollMatch(user, ticket, bucket='any'):
+    """
+    Returns (ticket, session id) of the waiting user; the id is None while
+    the table is not full. Whoever polls first when all three tickets of
+    the table are waiting creates the session, together with the index of
+    its players, in one write; the others find its id under the table key.
+    If a ticket of the table is missing for MATCH_GRACE seconds (it was
+    abandoned), the table is locked and the user gets a new ticket.
+
+    Fails if:
+        - The ticket is not the user's one.
+    """
+
+    table = (ticket - 1) // 3
+    seated = matchCache.get(matchKey(bucket, 'table:%d' % table))
+    if seated is not None and user.email() in seated[1]:
+        return ticket, seated[0]
+    if matchCache.get(matchKey(bucket, 'user:' + user.email())) != ticket:
+        raise GameError('This ticket is not yours.')
+    waitMatch(user, ticket, bucket)
+    tickets = range(3 * table + 1, 3 * table + 4)
+    keys = [matchKey(bucket, t) for t in tickets]
+    waiting = matchCache.get_multi(keys)
+    lock = matchKey(bucket, 'lock:%d' % table)
+    if len(waiting) == 3:
+        if not matchCache.add(lock, 1, time=MATCH_TIME):
+            return ticket, None
+        first, last = db.allocate_ids(db.Key.from_path('Session', 1), 1)
+        session = Session(key=db.Key.from_path('Session', first))
+        session.seat([waiting[key] for key in keys])
+        id = session.key().id()
+        emails = [waiting[key].email() for key in keys]
+        matchCache.set(matchKey(bucket, 'table:%d' % table), (id, emails), time=MATCH_TIME)
+        matchCache.delete_multi([matchKey(bucket, 'user:' + email) for email in emails])
+        return ticket, id
+    issued = matchCache.get(matchKey(bucket, 'tail'))
+    if issued is None or issued < tickets[-1]:
+        return ticket, None
+    # A ticket just issued may not be marked as waiting yet, so it counts
+    # as abandoned only if it stays missing for MATCH_GRACE seconds.
+    gone = matchKey(bucket, 'gone:%d' % table)
+    matchCache.add(gone, time.time(), time=MATCH_TIME)
+    if time.time() - matchCache.get(gone) < MATCH_GRACE:
+        return ticket, None
+    matchCache.add(lock, 1, time=MATCH_TIME)
+    matchCache.delete_multi([matchKey(bucket, ticket), matchKey(bucket, 'user:' + user.email())])
+    return enqueueMatch(user, bucket), None
+
+
+class SessionIndex(db.Model):
+    """
+    Line of the session in the lobby of one of its players, child of the
+    session keyed by the user's email (see Session.getIndexEntries).
+    """
+
+    user = db.UserProperty()
+    session_id = db.IntegerProperty()
+    hostedby = db.StringProperty()
+    started = db.DateTimeProperty()
+    modified = db.DateTimeProperty()
+    state = db.StringProperty()
+    turn = db.StringProperty()
+
+
+def reindexSessions(batch=50, cursor=None):
+    """
+    Writes SessionIndex entries of all sessions (for the sessions which
+    did not change since the index was introduced). Yields the query
+    cursor after every batch.
+    """
+
+    query = Session.all()
+    while True:
+        if cursor:
+            query.with_cursor(cursor)
+        sessions = query.fetch(batch)
+        if not sessions:
+            break
+        entries = []
+        for session in sessions:
+            session.prefetch()
+            entries += session.getIndexEntries()
+        db.put(entries)
+        cursor = query.cursor()
+        yield cursor
+
+MIGRATE_RETRIES = 3
+
+def migrateSession(session, change, retries=MIGRATE_RETRIES):
+    """
+    Writes the entities returned by change(session) with the session in a
+    unit of work, so the version is checked and caches are refreshed like
+    after an action. If the session was changed meanwhile, it is reloaded
+    and changed again (up to retries times).
+    """
+
+    for attempt in range(retries + 1):
+        try:
+            with UnitOfWork():
+                save(session, *change(session))
+            return
+        except ConcurrentModification:
+            if attempt == retries:
+                raise
+            session = Session.get(session.key())
+
+def packPlayers(session):
+    session.prefetch()
+    return [p for p in session.getPlayers() if p is not None]
+
+def migrateCards(batch=50, cursor=None):
+    """
+    Rewrites the players of all sessions, so card lists still stored in the
+    old string format get packed (see migrateSession). Sessions are streamed
+    in batches and the query cursor is yielded after every batch, so the
+    migration can be stopped and resumed from the last cursor.
+    """
+
+    query = Session.all()
+    while True:
+        if cursor:
+            query.with_cursor(cursor)
+        sessions = query.fetch(batch)
+        if not sessions:
+            break
+        for session in sessions:
+            if not session.embedded:
+                migrateSession(session, packPlayers)
+        cursor = query.cursor()
+        yield cursor
+
+
+class Move(db.Model):
+    """
+    Moves of the session game from a snapshot to the next one (concatenated
+    engine.packMove strings), child of the session keyed by the number of
+    the first move.
+    """
+
+    number = db.IntegerProperty()
+    data = db.BlobProperty()
+
+
+class Snapshot(db.Model):
+    """
+    State of the session game before the move number (see Game.snapshot).
+    """
+
+    number = db.IntegerProperty()
+    data = db.TextProperty()
+
+
+SCORE_CHUNK = 64
+
+
+class ScoreChunk(db.Model):
+    """
+    Full chunk of the packed score history (SCORE_CHUNK games), child of the session.
+    """
+
+    data = db.BlobProperty()
+
+
+HISTORY_PAGE = 500
+
+def historyRows(session):
+    """
+    Returns all History rows of the session in the order of games, read
+    page by page with the query cursor.
+    """
+
+    query = History.all().filter('session =', session).order('datetime')
+    rows = []
+    while True:
+        page = query.fetch(HISTORY_PAGE)
+        rows += page
+        if len(page) < HISTORY_PAGE:
+            return rows
+        query.with_cursor(query.cursor())
+
+def migrateHistory(batch=20, cursor=None):
+    """
+    Converts the History rows of all sessions into packed score history
+    and deletes them. Every session is written through migrateSession and
+    its rows are deleted only after that write was committed; if it was
+    committed before but the rows were not deleted, they are not added
+    twice. Sessions are streamed in batches and the query cursor is
+    yielded after every batch, so the conversion can be resumed.
+    """
+
+    query = Session.all()
+    while True:
+        if cursor:
+            query.with_cursor(cursor)
+        sessions = query.fetch(batch)
+        if not sessions:
+            break
+        for session in sessions:
+            rows = historyRows(session)
+            if not rows:
+                continue
+            points = [(r.player_1, r.player_2, r.player_3) for r in rows]
+            def change(session):
+                scores = unpackScores(session.getScoreData())
+                if scores[:len(points)] != points:
+                    scores = points + scores
+                session.scores = None
+                session.scoreChunks = 0
+                return session.appendScores(scores)
+            migrateSession(session, change)
+            for i in range(0, len(rows), HISTORY_PAGE):
+                db.delete(rows[i:i + HISTORY_PAGE])
+        cursor = query.cursor()
+        yield cursor
+
+
 class History(db.Model):
     session = db.ReferenceProperty(Session)
     datetime = db.DateTimeProperty(auto_now_add=True)
@@ -644,30 +1268,83 @@ class History(db.Model):
     player_3 = db.IntegerProperty()
 
 
-class Chat(db.Model):
-    session = db.ReferenceProperty(Session)
-    player = db.ReferenceProperty(Player)
-    datetime = db.DateTimeProperty(auto_now_add=True)
-    message = db.StringProperty()
+CHAT_SIZE = 100
+CHAT_MESSAGE = 500
+
+def chatMessages(seq, slots, since=0):
+    """
+    Returns the messages of the ring buffer (see ChatLog) numbered from
+    since to seq, except the ones already overwritten.
+    """
+
+    return [slots[n % CHAT_SIZE] for n in range(max(since, seq - CHAT_SIZE, 0), seq)]
 
 
-def cardCompare(self, other):
+class ChatLog(db.Model):
     """
-    Compares to cards with respect to trump.
+    Last CHAT_SIZE chat messages of the session, keyed by the session id.
+    The log is a root entity, so chat posts do not contend with the game
+    transactions on the session's entity group.
+
+    Messages are numbered by increasing seq and message number n is kept
+    in slot n % CHAT_SIZE, so the log never grows. The log is cached, so
+    polls without new messages are answered from the cached seq.
     """
-    
-    t1 = self.isTrump
-    t2 = other.isTrump
-    if (t1 == False) and (t2 == True):
-        return -1
-    elif (t1 == True) and (t2 == False):
-        return 1
-    else:
-        v1 = self.value()
-        v2 = other.value()
-        if self.value_order.index(v1) < self.value_order.index(v2):
-            return -1
-        elif self.value_order.index(v1) > self.value_order.index(v2):
-            return 1
-        else:
-            return 0
+
+    seq = db.IntegerProperty(default=0)
+    slots = db.TextProperty()
+
+    @staticmethod
+    def keyName(session):
+        return 'session:%d' % session.key().id()
+
+    @classmethod
+    def post(cls, session, user, message):
+        """
+        Appends the message of the user, cut to CHAT_MESSAGE characters
+        (so the whole log stays far below the entity size limit). Returns
+        its number.
+        """
+
+        message = message[:CHAT_MESSAGE]
+
+        def append():
+            log = cls.get_by_key_name(cls.keyName(session))
+            if log is None:
+                log = cls(key_name=cls.keyName(session))
+            slots = json.loads(log.slots or '[]')
+            entry = {'datetime': datetime.datetime.now().strftime('%Y.%m.%d %H:%M:%S'),
+                     'player': user.nickname(),
+                     'message': message}
+            if len(slots) < CHAT_SIZE:
+                slots.append(entry)
+            else:
+                slots[log.seq % CHAT_SIZE] = entry
+            log.slots = db.Text(json.dumps(slots, separators=(',',':')))
+            log.seq += 1
+            log.put()
+            return log
+        log = db.run_in_transaction(append)
+        chatCache.put(session.key().id(), log.seq, log.slots)
+        return log.seq - 1
+
+    @classmethod
+    def read(cls, session, since=0):
+        """
+        Returns the number of the next message and the list of messages
+        numbered since given number.
+        """
+
+        id = session.key().id()
+        cached = chatCache.get(id)
+        if cached is None:
+            log = cls.get_by_key_name(cls.keyName(session))
+            if log is None:
+                cached = (0, '[]')
+            else:
+                cached = (log.seq, log.slots)
+            chatCache.put(id, cached[0], cached[1])
+        seq, slots = cached
+        if seq <= since:
+            return seq, []
+        return seq, chatMessages(seq, json.loads(slots), since)
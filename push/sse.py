@@ -0,0 +1,203 @@
+"""
+Push server: Server-Sent Events of session state and chat (Python 3).
+
+Runs as a separate process next to the App Engine application:
+
+    SSE_SECRET=... python3 push/sse.py [port]
+
+The application posts events to /publish (see events.HttpPublisher). Each
+seat of a session subscribes once to
+
+    /events?session=<id>&seat=<seat>&token=<token>
+
+and receives 'state' events with the changed keys of its state (or the
+full state, without 'base', on subscription) and 'chat'
+events with new messages of the session. Every connection is a coroutine
+waiting on its queue, so one process holds many idle connections.
+"""
+
+import asyncio
+import hmac
+import json
+import os
+import sys
+from urllib.parse import urlsplit, parse_qs
+
+# events.py of the application is shared with the push server.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from events import seatChannel, chatChannel, channelToken
+
+HEARTBEAT = 15
+QUEUE_SIZE = 64
+
+def diffState(old, new):
+    """
+    Returns the keys of the new state which differ from the old one.
+    Removed keys are returned as None.
+    """
+
+    if old is None:
+        return dict(new)
+    diff = dict((key, value) for key, value in new.items()
+                if key not in old or old[key] != value)
+    for key in old:
+        if key not in new:
+            diff[key] = None
+    return diff
+
+class Broker(object):
+    """
+    In-process pub/sub of event queues. The last state of every seat
+    channel with subscribers is kept, so only its changes are sent and
+    new subscribers start with the full state. A change carries the
+    version of the state it applies to as 'base'; states not newer than
+    the kept one are dropped. When the last subscriber
+    leaves, the state is dropped (it is not updated without subscribers):
+    the next one gets the full state with the next event, and clients
+    load the current state from /update whenever they (re)connect.
+    """
+
+    def __init__(self):
+        self.queues = {}
+        self.states = {}
+
+    def subscribe(self, channel, queue=None):
+        if queue is None:
+            queue = asyncio.Queue(QUEUE_SIZE)
+        self.queues.setdefault(channel, set()).add(queue)
+        if channel in self.states:
+            queue.put_nowait(('state', self.states[channel]))
+        return queue
+
+    def unsubscribe(self, channel, queue):
+        queues = self.queues.get(channel, set())
+        queues.discard(queue)
+        if not queues:
+            self.queues.pop(channel, None)
+            self.states.pop(channel, None)
+
+    def publish(self, events):
+        for channel, data in events:
+            queues = self.queues.get(channel)
+            if not queues:
+                continue
+            if channel.startswith('seat:'):
+                state = self.states.get(channel)
+                if state is not None and data['version'] <= state['version']:
+                    # Posts may arrive out of order; the newer state is kept.
+                    continue
+                self.states[channel] = data
+                data = diffState(state, data)
+                if state is not None:
+                    data['base'] = state['version']
+                name = 'state'
+            else:
+                name = 'chat'
+            for queue in list(queues):
+                try:
+                    queue.put_nowait((name, data))
+                except asyncio.QueueFull:
+                    # Slow subscriber is disconnected; it gets the full
+                    # state again when it reconnects.
+                    while not queue.empty():
+                        queue.get_nowait()
+                    queue.put_nowait(None)
+
+class Server(object):
+    """
+    Minimal HTTP server of the event streams and the publish endpoint.
+    """
+
+    def __init__(self, secret, broker=None):
+        if not secret:
+            raise ValueError('SSE_SECRET is not configured.')
+        self.secret = secret
+        self.broker = broker or Broker()
+
+    async def handle(self, reader, writer):
+        try:
+            line = await reader.readline()
+            method, target = line.decode('latin-1').split()[:2]
+            headers = {}
+            while True:
+                line = (await reader.readline()).decode('latin-1').strip()
+                if not line:
+                    break
+                name, value = line.split(':', 1)
+                headers[name.strip().lower()] = value.strip()
+            url = urlsplit(target)
+            params = dict((k, v[0]) for k, v in parse_qs(url.query).items())
+            if method == 'GET' and url.path == '/events':
+                await self.stream(reader, writer, params)
+            elif method == 'POST' and url.path == '/publish':
+                body = await reader.readexactly(int(headers.get('content-length', 0)))
+                await self.publish(writer, headers, body)
+            else:
+                await self.respond(writer, '404 Not Found')
+        except (ValueError, TypeError, ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def respond(self, writer, status):
+        writer.write(('HTTP/1.1 %s\r\nContent-Length: 0\r\n\r\n' % status).encode('latin-1'))
+        await writer.drain()
+
+    async def publish(self, writer, headers, body):
+        if not hmac.compare_digest(headers.get('x-secret', ''), self.secret):
+            return await self.respond(writer, '403 Forbidden')
+        self.broker.publish([tuple(event) for event in json.loads(body.decode('utf-8'))])
+        await self.respond(writer, '204 No Content')
+
+    async def stream(self, reader, writer, params):
+        id, seat = int(params.get('session')), int(params.get('seat'))
+        seat_channel = seatChannel(id, seat)
+        token = channelToken(seat_channel, self.secret)
+        if not hmac.compare_digest(params.get('token', ''), token):
+            return await self.respond(writer, '403 Forbidden')
+        writer.write(b'HTTP/1.1 200 OK\r\n'
+                     b'Content-Type: text/event-stream\r\n'
+                     b'Cache-Control: no-cache\r\n'
+                     b'Access-Control-Allow-Origin: *\r\n\r\n')
+        channels = (seat_channel, chatChannel(id))
+        queue = asyncio.Queue(QUEUE_SIZE)
+        for channel in channels:
+            self.broker.subscribe(channel, queue)
+        # The client sends nothing more, so the read ends when it leaves.
+        closed = asyncio.ensure_future(reader.read())
+        get = None
+        try:
+            while True:
+                if get is None:
+                    get = asyncio.ensure_future(queue.get())
+                await asyncio.wait((get, closed), timeout=HEARTBEAT,
+                                   return_when=asyncio.FIRST_COMPLETED)
+                if closed.done():
+                    break
+                if not get.done():
+                    writer.write(b': ping\n\n')
+                else:
+                    event, get = get.result(), None
+                    if event is None:
+                        break
+                    name, data = event
+                    writer.write(('event: %s\ndata: %s\n\n' %
+                                  (name, json.dumps(data, separators=(',',':')))).encode('utf-8'))
+                await writer.drain()
+        finally:
+            for future in (get, closed):
+                if future is not None:
+                    future.cancel()
+            for channel in channels:
+                self.broker.unsubscribe(channel, queue)
+
+    async def serve(self, host='0.0.0.0', port=8080):
+        return await asyncio.start_server(self.handle, host, port)
+
+async def main(port):
+    server = await Server(os.environ.get('SSE_SECRET', '')).serve(port=port)
+    async with server:
+        await server.serve_forever()
+
+if __name__ == '__main__':
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 8080))
@@ -0,0 +1,136 @@
+"""
+Tests of the push server; they need Python 3 (like sse.py itself).
+"""
+
+import asyncio
+import json
+import unittest
+from sse import Broker, Server, diffState
+from events import seatChannel, chatChannel, channelToken
+
+SECRET = 'secret'
+
+class TestBroker(unittest.TestCase):
+    def test_diffState(self):
+        self.assertEqual(diffState(None, {'a': 1}), {'a': 1})
+        self.assertEqual(diffState({'a': 1, 'b': 2}, {'a': 1, 'b': 3}), {'b': 3})
+        self.assertEqual(diffState({'a': 1, 'b': 2}, {'a': 1}), {'b': None})
+        self.assertEqual(diffState({'a': [1]}, {'a': [1]}), {})
+
+    def test_publish(self):
+        async def run():
+            broker = Broker()
+            queue = broker.subscribe(seatChannel(1, 0))
+            broker.publish([(seatChannel(1, 0), {'a': 1, 'b': 2, 'version': 1}),
+                            (seatChannel(1, 1), {'a': 5, 'version': 1}),
+                            (seatChannel(1, 0), {'a': 1, 'b': 3, 'version': 2}),
+                            (seatChannel(1, 0), {'a': 1, 'b': 3, 'version': 2})])
+            self.assertEqual(queue.get_nowait(), ('state', {'a': 1, 'b': 2, 'version': 1}))
+            self.assertEqual(queue.get_nowait(), ('state', {'b': 3, 'version': 2, 'base': 1}))
+            self.assertTrue(queue.empty())
+            late = broker.subscribe(seatChannel(1, 0))
+            self.assertEqual(late.get_nowait(), ('state', {'a': 1, 'b': 3, 'version': 2}))
+            broker.unsubscribe(seatChannel(1, 0), queue)
+            broker.unsubscribe(seatChannel(1, 0), late)
+            self.assertEqual(broker.states, {})
+        asyncio.run(run())
+
+    def test_outOfOrder(self):
+        async def run():
+            broker = Broker()
+            queue = broker.subscribe(seatChannel(1, 0))
+            broker.publish([(seatChannel(1, 0), {'a': 1, 'version': 1}),
+                            (seatChannel(1, 0), {'a': 3, 'version': 3}),
+                            (seatChannel(1, 0), {'a': 2, 'version': 2})])
+            self.assertEqual(queue.get_nowait(), ('state', {'a': 1, 'version': 1}))
+            self.assertEqual(queue.get_nowait(), ('state', {'a': 3, 'version': 3, 'base': 1}))
+            self.assertTrue(queue.empty())
+            self.assertEqual(broker.states[seatChannel(1, 0)], {'a': 3, 'version': 3})
+        asyncio.run(run())
+
+    def test_resubscribe(self):
+        async def run():
+            broker = Broker()
+            queue = broker.subscribe(seatChannel(1, 0))
+            broker.publish([(seatChannel(1, 0), {'a': 1, 'b': 2, 'version': 1})])
+            broker.unsubscribe(seatChannel(1, 0), queue)
+            broker.publish([(seatChannel(1, 0), {'a': 1, 'b': 3, 'version': 2})])
+            queue = broker.subscribe(seatChannel(1, 0))
+            self.assertTrue(queue.empty())
+            broker.publish([(seatChannel(1, 0), {'a': 1, 'b': 4, 'version': 3})])
+            self.assertEqual(queue.get_nowait(), ('state', {'a': 1, 'b': 4, 'version': 3}))
+        asyncio.run(run())
+
+    def test_slowSubscriber(self):
+        async def run():
+            broker = Broker()
+            queue = broker.subscribe(chatChannel(1))
+            for i in range(queue.maxsize + 1):
+                broker.publish([(chatChannel(1), i)])
+            self.assertEqual(queue.get_nowait(), None)
+        asyncio.run(run())
+
+class TestServer(unittest.TestCase):
+    def test_secret(self):
+        self.assertRaises(ValueError, Server, '')
+
+    async def request(self, port, data):
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        writer.write(data)
+        await writer.drain()
+        return reader, writer
+
+    async def publish(self, port, events, secret=SECRET):
+        body = json.dumps(events).encode('utf-8')
+        reader, writer = await self.request(port, b'POST /publish HTTP/1.1\r\n'
+            b'X-Secret: ' + secret.encode('utf-8') + b'\r\n'
+            b'Content-Length: ' + str(len(body)).encode('utf-8') + b'\r\n\r\n' + body)
+        status = await reader.readline()
+        writer.close()
+        return status
+
+    async def readEvent(self, reader):
+        lines = []
+        while True:
+            line = await reader.readline()
+            if line == b'\n':
+                return lines
+            lines.append(line.decode('utf-8').rstrip('\n'))
+
+    def test_stream(self):
+        async def run():
+            server = Server(SECRET)
+            listener = await server.serve('127.0.0.1', 0)
+            port = listener.sockets[0].getsockname()[1]
+            token = channelToken(seatChannel(7, 1), SECRET)
+            path = '/events?session=7&seat=1&token=%s' % token
+            reader, writer = await self.request(port, ('GET %s HTTP/1.1\r\n\r\n' % path).encode('latin-1'))
+            self.assertTrue((await reader.readline()).startswith(b'HTTP/1.1 200'))
+            while (await reader.readline()) != b'\r\n':
+                pass
+            while seatChannel(7, 1) not in server.broker.queues:
+                await asyncio.sleep(0.01)
+            status = await self.publish(port, [[seatChannel(7, 1), {'state': 'ready', 'version': 3}],
+                                               [seatChannel(7, 2), {'state': 'ready'}]])
+            self.assertTrue(status.startswith(b'HTTP/1.1 204'))
+            self.assertEqual(await self.readEvent(reader),
+                             ['event: state', 'data: {"state":"ready","version":3}'])
+            await self.publish(port, [[seatChannel(7, 1), {'state': 'ready', 'version': 4}],
+                                      [chatChannel(7), {'chat_seq': 1, 'chat': []}]])
+            self.assertEqual(await self.readEvent(reader), ['event: state', 'data: {"version":4,"base":3}'])
+            self.assertEqual(await self.readEvent(reader),
+                             ['event: chat', 'data: {"chat_seq":1,"chat":[]}'])
+            status = await self.publish(port, [[chatChannel(7), {}]], 'wrong')
+            self.assertTrue(status.startswith(b'HTTP/1.1 403'))
+            writer.close()
+            while seatChannel(7, 1) in server.broker.queues:
+                await asyncio.sleep(0.01)
+            forbidden, other = await self.request(port, b'GET /events?session=7&seat=2&token=%s HTTP/1.1\r\n\r\n' % token.encode('latin-1'))
+            self.assertTrue((await forbidden.readline()).startswith(b'HTTP/1.1 403'))
+            other.close()
+            listener.close()
+            await listener.wait_closed()
+        asyncio.run(asyncio.wait_for(run(), 10))
+
+if __name__ == '__main__':
+    unittest.main()
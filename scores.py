@@ -0,0 +1,40 @@
+"""
+Packed score history.
+
+Points of the three players after every game are stored as little-endian
+int16 triples appended to one string, so the whole history of a session
+is read at once and decoded straight into arrays.
+"""
+
+import array
+import sys
+
+TRIPLE = 6
+
+def packScores(points):
+    """
+    Encodes the list of point triples.
+    """
+
+    values = array.array('h', [p for triple in points for p in triple])
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values.tostring()
+
+def unpackColumns(data):
+    """
+    Decodes packed history into three arrays, points of every player.
+    """
+
+    values = array.array('h')
+    values.fromstring(data)
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values[0::3], values[1::3], values[2::3]
+
+def unpackScores(data):
+    """
+    Decodes packed history into the list of point triples.
+    """
+
+    return zip(*unpackColumns(data))
@@ -0,0 +1,238 @@
+#!/usr/bin/env python
+"""
+Self-play simulator of 1000.
+
+Plays full games (until somebody reaches 1000 points) with the rules of
+engine.Game and pluggable strategies. Games are sharded across worker
+processes, every worker has its own seeded random generator, so the same
+seed always gives the same results.
+
+Usage:
+    python simulator.py -n 10000 -w 4 -s greedy,greedy,random
+"""
+
+from engine import Game
+from cards import ThousandCard, resolveTrick
+from optparse import OptionParser
+import bids
+import multiprocessing
+import random
+import time
+
+class RandomStrategy(object):
+    """
+    Bids up to random limit and puts random legal cards.
+    """
+
+    def __init__(self, rng):
+        self.rng = rng
+
+    def goBlind(self, game, seat):
+        return False
+
+    def bidLimit(self, game, seat):
+        return self.rng.choice((100, 100, 110, 120, 130, 150))
+
+    def discard(self, game, seat):
+        return self.rng.sample(game.seats[seat].cards, 3)
+
+    def finalBet(self, game, seat):
+        return game.bet
+
+    def play(self, game, seat):
+        return self.rng.choice(self.legalCards(game, seat))
+
+    def legalCards(self, game, seat):
+        if game.bank:
+            return game.seats[seat].legalCards(game.bank[0].kind())
+        return game.seats[seat].legalCards()
+
+class GreedyStrategy(RandomStrategy):
+    """
+    Bids by the points of the hand and its marriages, discards the weakest
+    cards and takes tricks with the highest card when it can.
+    """
+
+    margin = 30
+
+    def handValue(self, cards):
+        mask = ThousandCard.mask(cards)
+        value = ThousandCard.maskPoints(mask)
+        for kind, pair in ThousandCard.pair_masks.items():
+            if mask & pair == pair:
+                value += ThousandCard.pairs[kind]
+        return value
+
+    def bidLimit(self, game, seat):
+        limit = self.handValue(game.seats[seat].cards) + self.margin
+        return min(300, limit - limit % 10)
+
+    def discard(self, game, seat):
+        cards = game.seats[seat].cards
+        mask = ThousandCard.mask(cards)
+        pairs = 0
+        for pair in ThousandCard.pair_masks.values():
+            if mask & pair == pair:
+                pairs |= pair
+        order = lambda c: (pairs >> c.id & 1, c.points(), c.rank())
+        return sorted(cards, key=order)[:3]
+
+    def finalBet(self, game, seat):
+        value = self.handValue(game.seats[seat].cards + game.bank)
+        if value + self.margin < game.bet and not game.seats[seat].plus:
+            return None
+        return game.bet
+
+    def play(self, game, seat):
+        cards = sorted(self.legalCards(game, seat), key=lambda c: (c.rank(), c.id))
+        if not game.bank:
+            return cards[-1]
+        for c in cards:
+            if resolveTrick(0, game.bank + [c], game.trump) == len(game.bank):
+                return c
+        return cards[0]
+
+class TableStrategy(GreedyStrategy):
+    """
+    Greedy strategy bidding by the precomputed bids table (see bids.py).
+    """
+
+    def bidLimit(self, game, seat):
+        cards = game.seats[seat].cards
+        if bids.table.lookup(cards) is None:
+            return GreedyStrategy.bidLimit(self, game, seat)
+        return bids.table.suggestBet(cards) or 0
+
+strategies = {'random': RandomStrategy, 'greedy': GreedyStrategy, 'table': TableStrategy}
+
+def playHand(game, players):
+    """
+    Plays one dealt hand till the end with given strategies.
+    """
+
+    for seat, strategy in enumerate(players):
+        if strategy.goBlind(game, seat):
+            game.goBlind(seat)
+        else:
+            game.goOpen(seat)
+    while game.state == 'bettings':
+        seat = game.turn
+        if game.isFirstMove():
+            game.raiseBet(seat, 100)
+        elif game.bet + 10 <= players[seat].bidLimit(game, seat):
+            game.raiseBet(seat, game.bet + 10)
+        else:
+            game.makePass(seat)
+    seat = game.turn
+    game.collectBank(seat)
+    for card in players[seat].discard(game, seat):
+        game.discardCard(seat, card)
+    bet = players[seat].finalBet(game, seat)
+    if bet is None and not game.seats[seat].plus:
+        game.takePlus(seat)
+        return
+    game.start(seat, bet or game.bet)
+    while game.state == 'inGame':
+        seat = game.turn
+        game.putCard(seat, players[seat].play(game, seat))
+
+def playGame(names, rng, maxHands=1000):
+    """
+    Plays one game until somebody wins (or maxHands are played).
+    Returns the game and number of played hands.
+    """
+
+    game = Game(('player 1', 'player 2', 'player 3'), shuffle=rng.shuffle)
+    players = [strategies[name](rng) for name in names]
+    hands = 0
+    while game.state != 'finish' and hands < maxHands:
+        game.deal(game.dealer)
+        playHand(game, players)
+        hands += 1
+    return game, hands
+
+def runShard(args):
+    """
+    Worker entry: plays count games with its own seeded generator.
+    """
+
+    names, count, seed = args
+    rng = random.Random(seed)
+    result = {'games': 0, 'hands': 0, 'wins': [0, 0, 0], 'points': []}
+    for i in range(count):
+        game, hands = playGame(names, rng)
+        points = [p.points for p in game.seats]
+        result['games'] += 1
+        result['hands'] += hands
+        result['points'].append(points)
+        if game.state == 'finish':
+            result['wins'][points.index(max(points))] += 1
+    return result
+
+def simulate(names, games, workers=1, seed=0):
+    """
+    Runs games split into shards across worker processes and merges the results.
+    """
+
+    shards = max(1, workers) * 4
+    sizes = [games // shards + (i < games % shards) for i in range(shards)]
+    args = [(names, size, seed * 1000003 + i) for i, size in enumerate(sizes) if size]
+    if workers > 1:
+        pool = multiprocessing.Pool(workers)
+        try:
+            results = pool.map(runShard, args)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = [runShard(a) for a in args]
+    total = {'games': 0, 'hands': 0, 'wins': [0, 0, 0], 'points': []}
+    for r in results:
+        total['games'] += r['games']
+        total['hands'] += r['hands']
+        total['wins'] = [a + b for a, b in zip(total['wins'], r['wins'])]
+        total['points'] += r['points']
+    return total
+
+def report(names, total, elapsed):
+    """
+    Formats the throughput and score distribution report.
+    """
+
+    lines = ['%d games, %d hands in %.2f s' % (total['games'], total['hands'], elapsed),
+             '%.1f games/s, %.1f hands/s' % (total['games'] / elapsed, total['hands'] / elapsed),
+             '%.1f hands per game' % (float(total['hands']) / max(1, total['games']))]
+    for seat, name in enumerate(names):
+        points = sorted([p[seat] for p in total['points']])
+        if not points:
+            continue
+        lines.append('seat %d (%s): wins %d, points mean %.1f, min %d, median %d, max %d' % (
+                     seat + 1, name, total['wins'][seat], float(sum(points)) / len(points),
+                     points[0], points[len(points) // 2], points[-1]))
+    buckets = {}
+    for p in total['points']:
+        for x in p:
+            b = x - x % 100
+            buckets[b] = buckets.get(b, 0) + 1
+    for b in sorted(buckets):
+        lines.append('%5d..%5d: %d' % (b, b + 99, buckets[b]))
+    return '\n'.join(lines)
+
+def main():
+    parser = OptionParser(usage='%prog [options]')
+    parser.add_option('-n', '--games', type='int', default=1000, help='number of games to play')
+    parser.add_option('-w', '--workers', type='int', default=multiprocessing.cpu_count(),
+                      help='number of worker processes')
+    parser.add_option('-s', '--strategies', default='greedy,greedy,greedy',
+                      help='comma separated strategies of the seats (%s)' % ', '.join(sorted(strategies)))
+    parser.add_option('--seed', type='int', default=0, help='random seed')
+    options, args = parser.parse_args()
+    names = options.strategies.split(',')
+    if len(names) != 3 or [n for n in names if not n in strategies]:
+        parser.error('three strategies are required: %s' % ', '.join(sorted(strategies)))
+    started = time.time()
+    total = simulate(names, options.games, options.workers, options.seed)
+    print report(names, total, max(time.time() - started, 1e-6))
+
+if __name__ == '__main__':
+    main()
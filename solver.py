@@ -0,0 +1,225 @@
+"""
+Double-dummy solver of the trick playing phase.
+
+Once the game is in 'inGame' state every card is known, so the rest of the
+game can be solved exactly: the bets winner (declarer) maximizes his points,
+both opponents play together to minimize them. Points are the card points
+of the taken tricks plus the calls (pairs) made during the play.
+
+The search is alpha-beta over card masks with a transposition table. The
+positions at trick boundaries are hashed with Zobrist keys and stored with
+their bounds; the table has a bounded size and evicts least recently used
+entries.
+"""
+
+from cards import ThousandCard
+from collections import OrderedDict
+import random
+
+KIND = ThousandCard.kind_table
+RANK = ThousandCard.rank_table
+POINTS = ThousandCard.point_table
+BEATS = ThousandCard.beats_table
+KIND_MASKS = [ThousandCard.kind_masks[k] for k in ThousandCard.kind_order]
+PAIR_MASKS = [ThousandCard.pair_masks[k] for k in ThousandCard.kind_order]
+PAIRS = [ThousandCard.pairs[k] for k in ThousandCard.kind_order]
+NO_TRUMP = 4
+INFINITY = 10000
+
+class Solver(object):
+    """
+    Alpha-beta solver with bounded LRU transposition table.
+    """
+
+    def __init__(self, maxEntries=200000, seed=0):
+        rng = random.Random(seed)
+        self.cardKeys = [[rng.getrandbits(64) for c in range(24)] for s in range(3)]
+        self.leaderKeys = [rng.getrandbits(64) for s in range(3)]
+        self.trumpKeys = [rng.getrandbits(64) for t in range(5)]
+        self.declarerKeys = [rng.getrandbits(64) for s in range(3)]
+        self.maxEntries = maxEntries
+        self.table = OrderedDict()
+        self.nodes = 0
+
+    def hashCards(self, hands):
+        """
+        Returns Zobrist key of the cards in hands.
+        """
+
+        key = 0
+        for seat in range(3):
+            for c in range(24):
+                if hands[seat] >> c & 1:
+                    key ^= self.cardKeys[seat][c]
+        return key
+
+    def moves(self, hand, trick, trump):
+        """
+        Returns legal cards of the hand ordered for the search (trumps and
+        high ranks first).
+        """
+
+        if trick:
+            followed = hand & KIND_MASKS[KIND[trick[0]]]
+            if followed:
+                hand = followed
+        cards = [c for c in range(24) if hand >> c & 1]
+        cards.sort(key=lambda c: (KIND[c] == trump, RANK[c]), reverse=True)
+        return cards
+
+    def play(self, hands, leader, trick, trump, seat, card):
+        """
+        Plays the card. Returns new hands, leader, trick, trump and the
+        points gained by every seat (for the call or the taken trick).
+        """
+
+        hands = list(hands)
+        hands[seat] &= ~(1 << card)
+        gained = [0, 0, 0]
+        if not trick and hands[seat] & PAIR_MASKS[KIND[card]] and PAIR_MASKS[KIND[card]] >> card & 1:
+            trump = KIND[card]
+            gained[seat] += PAIRS[trump]
+        trick = trick + (card,)
+        if len(trick) == 3:
+            beats = BEATS[trump]
+            best = 0
+            for i in (1, 2):
+                if beats[trick[best]][trick[i]]:
+                    best = i
+            leader = (leader + best) % 3
+            gained[leader] += POINTS[trick[0]] + POINTS[trick[1]] + POINTS[trick[2]]
+            trick = ()
+        return hands, leader, trick, trump, gained
+
+    def search(self, hands, leader, trick, trump, declarer, key, alpha, beta):
+        """
+        Returns the points declarer gets from this position with the best play.
+        The key is Zobrist key of the cards in hands (see hashCards).
+        """
+
+        self.nodes += 1
+        if not trick:
+            if not (hands[0] | hands[1] | hands[2]):
+                return 0
+            if beta <= 0:
+                return 0
+            upper = self.upperBound(hands, declarer)
+            if upper <= alpha:
+                return upper
+            position = key ^ self.leaderKeys[leader] ^ self.trumpKeys[trump] ^ self.declarerKeys[declarer]
+            entry = self.table.get(position)
+            if entry is not None:
+                del self.table[position]
+                self.table[position] = entry
+                lower, upper = entry
+                if lower >= beta:
+                    return lower
+                if upper <= alpha:
+                    return upper
+                if lower == upper:
+                    return lower
+                alpha = max(alpha, lower)
+                beta = min(beta, upper)
+        seat = (leader + len(trick)) % 3
+        maximize = (seat == declarer)
+        window = (alpha, beta)
+        best = maximize and -INFINITY or INFINITY
+        cardKeys = self.cardKeys[seat]
+        for card in self.moves(hands[seat], trick, trump):
+            after = self.play(hands, leader, trick, trump, seat, card)
+            gained = after[4][declarer]
+            value = gained + self.search(after[0], after[1], after[2], after[3], declarer,
+                                         key ^ cardKeys[card], alpha - gained, beta - gained)
+            if maximize:
+                if value > best:
+                    best = value
+                    if best > alpha:
+                        alpha = best
+            else:
+                if value < best:
+                    best = value
+                    if best < beta:
+                        beta = best
+            if alpha >= beta:
+                break
+        if not trick:
+            self.store(position, window, best)
+        return best
+
+    def upperBound(self, hands, declarer):
+        """
+        Returns the most declarer can get at the trick boundary: all the
+        points left plus the pairs he still holds.
+        """
+
+        upper = ThousandCard.maskPoints(hands[0] | hands[1] | hands[2])
+        for kind, pair in enumerate(PAIR_MASKS):
+            if hands[declarer] & pair == pair:
+                upper += PAIRS[kind]
+        return upper
+
+    def store(self, key, window, value):
+        lower, upper = self.table.pop(key, (-INFINITY, INFINITY))
+        if value <= window[0]:
+            upper = value
+        elif value >= window[1]:
+            lower = value
+        else:
+            lower = upper = value
+        self.table[key] = (lower, upper)
+        while len(self.table) > self.maxEntries:
+            self.table.popitem(last=False)
+
+    def solve(self, hands, leader, declarer, trump=None, trick=()):
+        """
+        Solves the position. Hands are card masks of the seats, leader is the
+        seat who started the current trick, trick holds ids of the cards
+        already put to it and trump is the kind code or None.
+
+        Returns a dictionary:
+            value - points declarer gets from the rest of the game
+            points - points every seat gets along the best play
+            moves - the best play (list of cards)
+        """
+
+        trump = ThousandCard.trump_index.get(trump, NO_TRUMP)
+        trick = tuple(trick)
+        key = self.hashCards(hands)
+        value = self.search(hands, leader, trick, trump, declarer, key, -INFINITY, INFINITY)
+        points = [0, 0, 0]
+        moves = []
+        rest = value
+        while trick or hands[0] | hands[1] | hands[2]:
+            seat = (leader + len(trick)) % 3
+            for card in self.moves(hands[seat], trick, trump):
+                after = self.play(hands, leader, trick, trump, seat, card)
+                target = rest - after[4][declarer]
+                if self.search(after[0], after[1], after[2], after[3], declarer,
+                               key ^ self.cardKeys[seat][card], target - 1, target + 1) == target:
+                    break
+            hands, leader, trick, trump, gained = after
+            key ^= self.cardKeys[seat][card]
+            rest -= gained[declarer]
+            points = [a + b for a, b in zip(points, gained)]
+            moves.append(ThousandCard.deck[card])
+        return {'value': value, 'points': points, 'moves': moves}
+
+def solveGame(game, solver=None):
+    """
+    Solves the trick playing of the game in 'inGame' state.
+
+    Points include the points already collected in current game, so the
+    result is what every seat would count at the end with the best play.
+    """
+
+    if game.state != 'inGame':
+        raise ValueError('Only the games in inGame state can be solved.')
+    solver = solver or Solver()
+    hands = [ThousandCard.mask(p.cards) for p in game.seats]
+    leader = (game.turn - len(game.bank)) % 3
+    trick = [c.id for c in game.bank]
+    result = solver.solve(hands, leader, game.betsWinner(), game.trump, trick)
+    collected = [p.getGamePoints() for p in game.seats]
+    result['value'] += collected[game.betsWinner()]
+    result['points'] = [a + b for a, b in zip(result['points'], collected)]
+    return result
@@ -0,0 +1,67 @@
+import unittest
+import os
+import random
+import struct
+import tempfile
+from cards import ThousandCard
+from bids import BidTable, HANDS, HEADER, MAGIC, handIndex, handMask, estimateHand
+
+class TestBids(unittest.TestCase):
+    def test_handIndex(self):
+        self.assertEqual(HANDS, 346104)
+        self.assertEqual(handIndex(0x7F), 0)
+        self.assertEqual(handIndex(0x7F << 17), HANDS - 1)
+        rng = random.Random(1)
+        deck = ThousandCard.generateDeck()
+        for i in range(500):
+            mask = ThousandCard.mask(rng.sample(deck, 7))
+            index = handIndex(mask)
+            self.assertTrue(0 <= index < HANDS)
+            self.assertEqual(handMask(index), mask)
+
+    def test_estimateHand(self):
+        strong = ThousandCard.mask([ThousandCard(x) for x in ('HA', 'H10', 'HK', 'HQ', 'DA', 'SA', 'CA')])
+        weak = ThousandCard.mask([ThousandCard(x) for x in ('H9', 'HJ', 'D9', 'DJ', 'S9', 'SJ', 'C9')])
+        rng = random.Random(1)
+        self.assertTrue(estimateHand(strong, rng, 8) > estimateHand(weak, rng, 8))
+
+    def writeTable(self, values):
+        fd, path = tempfile.mkstemp()
+        f = os.fdopen(fd, 'wb')
+        f.write(HEADER.pack(MAGIC, HANDS))
+        f.write(struct.pack('<%dH' % HANDS, *values))
+        f.close()
+        return path
+
+    def test_lookup(self):
+        path = self.writeTable([i % 300 for i in range(HANDS)])
+        try:
+            table = BidTable(path)
+            cards = [ThousandCard(x) for x in ('HA', 'H10', 'HK', 'HQ', 'DA', 'SA', 'CA')]
+            index = handIndex(ThousandCard.mask(cards))
+            self.assertTrue(index % 300 >= 100)
+            self.assertEqual(table.lookup(cards), index % 300)
+            self.assertEqual(table.suggestBet(cards), index % 300 - index % 10)
+            self.assertEqual(table.lookup(cards[:6]), None)
+        finally:
+            os.remove(path)
+
+    def test_weakHand(self):
+        path = self.writeTable([95] * HANDS)
+        try:
+            table = BidTable(path)
+            cards = ThousandCard.generateDeck()[:7]
+            self.assertEqual(table.lookup(cards), 95)
+            self.assertEqual(table.suggestBet(cards), None)
+        finally:
+            os.remove(path)
+
+    def test_missingTable(self):
+        table = BidTable('/nonexistent/bids.dat')
+        self.assertEqual(table.lookup(ThousandCard.generateDeck()[:7]), None)
+        self.assertTrue(table.missing)
+        table.path = None
+        self.assertEqual(table.suggestBet(ThousandCard.generateDeck()[:7]), None)
+
+if __name__ == '__main__':
+    unittest.main()
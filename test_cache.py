@@ -0,0 +1,95 @@
+import unittest
+from cache import LocalCache, VersionedCache, incrCounter, getCounter
+
+class Clock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+class TestLocalCache(unittest.TestCase):
+    def setUp(self):
+        self.clock = Clock()
+        self.cache = LocalCache(self.clock)
+
+    def test_getSet(self):
+        self.assertEqual(self.cache.get('a'), None)
+        value = [1, 2]
+        self.cache.set('a', value)
+        value.append(3)
+        self.assertEqual(self.cache.get('a'), [1, 2])
+        self.assertFalse(self.cache.add('a', 1))
+        self.assertTrue(self.cache.add('b', 1))
+        self.assertEqual(self.cache.get_multi(['a', 'b', 'c']), {'a': [1, 2], 'b': 1})
+        self.cache.delete('a')
+        self.assertEqual(self.cache.get('a'), None)
+        self.cache.delete_multi(['b', 'c'])
+        self.assertEqual(self.cache.get_multi(['a', 'b', 'c']), {})
+
+    def test_expire(self):
+        self.cache.set('a', 1, time=10)
+        self.clock.now += 9
+        self.assertEqual(self.cache.get('a'), 1)
+        self.clock.now += 1
+        self.assertEqual(self.cache.get('a'), None)
+        self.assertTrue(self.cache.add('a', 2))
+
+    def test_cas(self):
+        self.assertFalse(self.cache.cas('a', 1))
+        self.cache.set('a', 1)
+        self.assertEqual(self.cache.gets('a'), 1)
+        self.assertTrue(self.cache.cas('a', 2))
+        self.assertFalse(self.cache.cas('a', 3))
+        self.assertEqual(self.cache.gets('a'), 2)
+        self.cache.set('a', 4)
+        self.assertFalse(self.cache.cas('a', 5))
+        self.assertEqual(self.cache.get('a'), 4)
+
+    def test_incr(self):
+        self.assertEqual(self.cache.incr('n'), None)
+        self.assertEqual(self.cache.incr('n', initial_value=0), 1)
+        self.assertEqual(self.cache.incr('n', 5), 6)
+        self.assertEqual(self.cache.incr('n', -10), 0)
+
+class TestVersionedCache(unittest.TestCase):
+    def setUp(self):
+        self.cache = VersionedCache('session', LocalCache())
+
+    def test_versions(self):
+        self.assertEqual(self.cache.get(1), None)
+        self.assertEqual(self.cache.getVersion(1), None)
+        self.assertTrue(self.cache.put(1, 2, 'two'))
+        self.assertEqual(self.cache.get(1), (2, 'two'))
+        self.assertFalse(self.cache.put(1, 1, 'one'))
+        self.assertEqual(self.cache.get(1), (2, 'two'))
+        self.assertEqual(self.cache.get(1, 3), None)
+        self.assertTrue(self.cache.put(1, 3, 'three'))
+        self.assertEqual(self.cache.getVersion(1), 3)
+        self.assertEqual(self.cache.get(2), None)
+        self.cache.delete(1)
+        self.assertEqual(self.cache.get(1), None)
+
+    def test_race(self):
+        backend = self.cache.backend
+        gets = backend.gets
+        def racing(key):
+            # Another writer stores a newer version between gets and cas.
+            item = gets(key)
+            backend.gets = gets
+            backend.set(key, (5, 'five'))
+            return item
+        self.cache.put(1, 3, 'three')
+        backend.gets = racing
+        self.assertFalse(self.cache.put(1, 4, 'four'))
+        self.assertEqual(self.cache.get(1), (5, 'five'))
+
+class TestCounters(unittest.TestCase):
+    def test_counter(self):
+        start = getCounter('test')
+        incrCounter('test')
+        incrCounter('test', 2)
+        self.assertEqual(getCounter('test'), start + 3)
+
+if __name__ == '__main__':
+    unittest.main()
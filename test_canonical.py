@@ -0,0 +1,48 @@
+import unittest
+import random
+from cards import ThousandCard
+from canonical import permuteMask, inversePermutation, permuteKind, canonicalize, canonicalPosition, canonicalHand
+
+def mask(codes):
+    return ThousandCard.mask([ThousandCard(x) for x in codes])
+
+class TestCanonical(unittest.TestCase):
+    def test_permuteMask(self):
+        perm = [1, 2, 3, 0]
+        self.assertEqual(permuteMask(mask(['SA', 'HK']), perm), mask(['CA', 'SK']))
+        self.assertEqual(inversePermutation(perm), [3, 0, 1, 2])
+        self.assertEqual(permuteMask(permuteMask(0xABCDEF, perm), inversePermutation(perm)), 0xABCDEF)
+        self.assertEqual(permuteKind('S', perm), 'C')
+        self.assertEqual(permuteKind(None, perm), None)
+
+    def test_freeKinds(self):
+        rng = random.Random(1)
+        deck = ThousandCard.generateDeck()
+        for i in range(200):
+            cards = rng.sample(deck, 14)
+            hands = (ThousandCard.mask(cards[:7]), ThousandCard.mask(cards[7:]))
+            key, perm = canonicalize(hands)
+            self.assertEqual(key, tuple([permuteMask(h, perm) for h in hands]))
+            shuffled = range(4)
+            rng.shuffle(shuffled)
+            other = tuple([permuteMask(h, shuffled) for h in hands])
+            self.assertEqual(canonicalize(other)[0], key)
+
+    def test_canonicalPosition(self):
+        hearts = (mask(['HK', 'HQ', 'SA']), mask(['DA', 'C10']), mask(['D9', 'CJ']))
+        spades = (mask(['SK', 'SQ', 'HA']), mask(['DA', 'C10']), mask(['D9', 'CJ']))
+        self.assertNotEqual(canonicalPosition(hearts)[0], canonicalPosition(spades)[0])
+        key, perm = canonicalPosition(hearts)
+        self.assertEqual(perm[ThousandCard.trump_index['H']], ThousandCard.trump_index['H'])
+        swapped = (mask(['HK', 'HQ', 'SA']), mask(['CA', 'D10']), mask(['C9', 'DJ']))
+        self.assertEqual(canonicalPosition(swapped)[0], key)
+        self.assertNotEqual(canonicalPosition(swapped, 'D')[0], canonicalPosition(hearts, 'D')[0])
+        self.assertEqual(canonicalPosition(swapped, 'H')[0], canonicalPosition(hearts, 'H')[0])
+
+    def test_canonicalHand(self):
+        self.assertEqual(canonicalHand(mask(['SA', 'S10', 'DA']))[0], canonicalHand(mask(['CA', 'C10', 'HA']))[0])
+        self.assertNotEqual(canonicalHand(mask(['SK', 'DA']))[0], canonicalHand(mask(['HK', 'DA']))[0])
+        self.assertEqual(canonicalHand(mask(['SK', 'DA']))[0], canonicalHand(mask(['SK', 'CA']))[0])
+
+if __name__ == '__main__':
+    unittest.main()
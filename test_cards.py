@@ -1,6 +1,6 @@
 import unittest
 from random import shuffle
-from cards import Card, ThousandCard
+from cards import Card, ThousandCard, resolveTrick
 
 class TestCard(unittest.TestCase):
     def setUp(self):
@@ -69,5 +69,91 @@ class TestThousandCard(TestCard):
             self.assertEqual(c.points(), self.points[c.value()])
         self.assertEqual(sum([c.points() for c in deck]), 120)
 
+    def test_ids(self):
+        deck = ThousandCard.generateDeck()
+        self.assertEqual(sorted([c.id for c in deck]), range(24))
+        for c in deck:
+            self.assertEqual(ThousandCard.codes[c.id], str(c))
+            self.assertEqual(ThousandCard.kind_order[ThousandCard.kind_table[c.id]], c.kind())
+            self.assertEqual(ThousandCard.value_order[c.rank()], c.value())
+
+    def test_thousandSorting(self):
+        deck = ThousandCard.generateDeck()
+        shuffle(deck)
+        deck = sorted(deck)
+        kinds = ThousandCard.kind_order
+        for i in range(0, 24-1):
+            if deck[i].kind() == deck[i+1].kind():
+                self.assertTrue(self.values.index(deck[i].value()) < self.values.index(deck[i+1].value()))
+            else:
+                self.assertTrue(kinds.index(deck[i].kind()) < kinds.index(deck[i+1].kind()))
+
+    def test_mask(self):
+        cards = [ThousandCard(x) for x in ('HQ', 'S9', 'DA', 'C10')]
+        mask = ThousandCard.mask(cards)
+        self.assertEqual(ThousandCard.fromMask(mask), sorted(cards))
+        self.assertEqual(ThousandCard.maskCount(mask), 4)
+        self.assertEqual(ThousandCard.maskPoints(mask), 24)
+        deck = ThousandCard.mask(ThousandCard.generateDeck())
+        self.assertEqual(deck, (1 << 24) - 1)
+        self.assertEqual(ThousandCard.maskPoints(deck), 120)
+        for kind in ThousandCard.kind_order:
+            kind_cards = ThousandCard.fromMask(ThousandCard.kind_masks[kind])
+            self.assertEqual([c.kind() for c in kind_cards], [kind] * 6)
+            pair = ThousandCard.fromMask(ThousandCard.pair_masks[kind])
+            self.assertEqual([str(c) for c in pair], [kind + 'Q', kind + 'K'])
+
+    def test_pack(self):
+        cards = [ThousandCard(x) for x in ('HQ', 'S9', 'DA', 'C10')]
+        data = ThousandCard.pack(cards)
+        self.assertEqual(len(data), 4)
+        self.assertEqual(ThousandCard.unpack(data), cards)
+        self.assertEqual(ThousandCard.unpack(''), [])
+        data = ThousandCard.packMask(cards)
+        self.assertEqual(len(data), 3)
+        self.assertEqual(ThousandCard.unpackMask(data), sorted(cards))
+        deck = ThousandCard.generateDeck()
+        self.assertEqual(ThousandCard.unpackMask(ThousandCard.packMask(deck)), deck)
+        self.assertEqual(ThousandCard.unpackMask(ThousandCard.packMask([])), [])
+
+    def test_interned(self):
+        card = ThousandCard('HQ')
+        self.assertTrue(card is ThousandCard('HQ'))
+        self.assertTrue(card in ThousandCard.generateDeck())
+        self.assertNotEqual(card, ThousandCard('HK'))
+        self.assertRaises(AttributeError, setattr, card, 'code', 'HK')
+        self.assertRaises(AttributeError, setattr, card, 'player', None)
+
+    def test_thousandInvalid(self):
+        self.assertRaises(ValueError, ThousandCard, 'H8')
+        self.assertRaises(ValueError, ThousandCard, 'PA')
+
+class TestResolveTrick(unittest.TestCase):
+    def trick(self, codes):
+        return [ThousandCard(x) for x in codes]
+
+    def test_noTrump(self):
+        self.assertEqual(resolveTrick(0, self.trick(('SA', 'S9', 'HA'))), 0)
+        self.assertEqual(resolveTrick(0, self.trick(('DJ', 'SJ', 'D10'))), 2)
+        self.assertEqual(resolveTrick(2, self.trick(('DJ', 'SJ', 'D10'))), 1)
+        self.assertEqual(resolveTrick(1, self.trick(('S9', 'HA', 'DA'))), 1)
+
+    def test_trump(self):
+        self.assertEqual(resolveTrick(0, self.trick(('SA', 'S9', 'H9')), 'H'), 2)
+        self.assertEqual(resolveTrick(0, self.trick(('H9', 'HJ', 'SA')), 'H'), 1)
+        self.assertEqual(resolveTrick(1, self.trick(('SA', 'S9', 'HA')), 'C'), 1)
+
+    def test_allTricks(self):
+        deck = ThousandCard.generateDeck()
+        for trump in (None, 'S', 'C', 'D', 'H'):
+            for i in range(200):
+                shuffle(deck)
+                cards = deck[:3]
+                strong = cards[0].kind()
+                if trump in [c.kind() for c in cards]:
+                    strong = trump
+                keys = [(c.kind() == strong, c.rank()) for c in cards]
+                self.assertEqual(resolveTrick(0, cards, trump), keys.index(max(keys)))
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,49 @@
+import unittest
+from cards import ThousandCard
+try:
+    import numpy
+    from deals import generateDeals, iterDeals, splitDeals, handFeatures
+except ImportError:
+    numpy = None
+
+@unittest.skipIf(numpy is None, 'NumPy is not installed')
+class TestDeals(unittest.TestCase):
+    def setUp(self):
+        self.deals = generateDeals(200, seed=1)
+
+    def test_generateDeals(self):
+        self.assertEqual(self.deals.shape, (200, 24))
+        self.assertEqual(self.deals.dtype, numpy.int8)
+        for deal in self.deals:
+            self.assertEqual(sorted(deal), range(24))
+        self.assertTrue((generateDeals(200, seed=1) == self.deals).all())
+
+    def test_iterDeals(self):
+        chunks = list(iterDeals(25, seed=2, chunk=10))
+        self.assertEqual([len(c) for c in chunks], [10, 10, 5])
+
+    def test_splitDeals(self):
+        hands, banks = splitDeals(self.deals)
+        self.assertEqual(hands.shape, (200, 3, 7))
+        self.assertEqual(banks.shape, (200, 3))
+        self.assertEqual(list(hands[5, 1]), list(self.deals[5, 7:14]))
+        self.assertEqual(list(banks[5]), list(self.deals[5, 21:]))
+
+    def test_handFeatures(self):
+        hands, banks = splitDeals(self.deals)
+        features = handFeatures(hands)
+        for i in range(len(hands)):
+            for seat in range(3):
+                cards = [ThousandCard.deck[c] for c in hands[i, seat]]
+                kinds = [c.kind() for c in cards]
+                self.assertEqual(list(features['lengths'][i, seat]),
+                                 [kinds.count(k) for k in ThousandCard.kind_order])
+                self.assertEqual(features['points'][i, seat], sum([c.points() for c in cards]))
+                self.assertEqual(features['aces'][i, seat], [c.value() for c in cards].count('A'))
+                self.assertEqual(features['tens'][i, seat], [c.value() for c in cards].count('10'))
+                pairs = [k for k in ThousandCard.kind_order
+                         if ThousandCard(k + 'K') in cards and ThousandCard(k + 'Q') in cards]
+                self.assertEqual(features['pairs'][i, seat], sum([ThousandCard.pairs[k] for k in pairs]))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,215 @@
+import unittest
+import random
+from engine import Game, GameError, packMove, unpackMoves, seededDeck
+from cards import ThousandCard
+from simulator import GreedyStrategy, playHand
+
+class TestGameBettings(unittest.TestCase):
+    def setUp(self):
+        self.game = Game(('tester1', 'tester2', 'tester3'))
+        self.game.deal(0)
+
+    def test_deal(self):
+        self.assertRaises(GameError, self.game.deal, 1)
+        for p in self.game.seats:
+            self.assertEqual(len(p.cards), 7)
+            self.assertEqual(p.calls, '')
+            self.assertEqual(p.blind, None)
+        self.assertEqual(len(self.game.bank), 3)
+        self.assertEqual(self.game.dealer, 1)
+        self.assertEqual(self.game.turn, 1)
+        self.assertEqual(self.game.bet, 90)
+        self.assertEqual(self.game.state, 'bettings')
+
+    def test_raiseBet(self):
+        self.assertRaises(GameError, self.game.raiseBet, 2, 100)
+        self.assertRaises(GameError, self.game.raiseBet, 1, 105)
+        self.game.raiseBet(1, 100)
+        self.assertEqual(self.game.info, 'tester2 raises up to 100')
+        self.assertEqual(self.game.turn, 2)
+        self.game.raiseBet(2, 300)
+        self.assertEqual(self.game.state, 'collect')
+        self.assertEqual(self.game.turn, 2)
+
+    def test_makePass(self):
+        self.assertRaises(GameError, self.game.makePass, 1)
+        self.game.raiseBet(1, 100)
+        self.game.makePass(2)
+        self.assertEqual(self.game.turn, 0)
+        self.game.makePass(0)
+        self.assertEqual(self.game.state, 'collect')
+        self.assertEqual(self.game.betsWinner(), 1)
+        self.assertEqual(self.game.turn, 1)
+
+    def test_collectAndStart(self):
+        self.game.raiseBet(1, 120)
+        self.game.makePass(2)
+        self.game.makePass(0)
+        self.assertRaises(GameError, self.game.collectBank, 0)
+        self.game.collectBank(1)
+        player = self.game.seats[1]
+        self.assertEqual(len(player.cards), 10)
+        self.assertRaises(GameError, self.game.start, 1, 120)
+        for i in range(3):
+            self.game.discardCard(1, player.cards[0])
+        self.assertRaises(GameError, self.game.start, 1, 110)
+        self.game.start(1, 130)
+        self.assertEqual(self.game.state, 'inGame')
+        self.assertEqual(self.game.info, 'tester2 plays 130')
+        self.assertEqual(len(player.tricks), 3)
+
+    def test_takePlus(self):
+        self.game.raiseBet(1, 120)
+        self.game.makePass(2)
+        self.game.makePass(0)
+        self.game.collectBank(1)
+        self.game.seats[2].points = 880
+        self.game.takePlus(1)
+        self.assertEqual(self.game.state, 'endGame')
+        self.assertEqual([p.points for p in self.game.seats], [60, 0, 880])
+        self.assertEqual(self.game.history, [(60, 0, 880)])
+        self.assertEqual(self.game.dealer, 0)
+
+
+class TestGamePlay(unittest.TestCase):
+    def setUp(self):
+        self.game = Game(('tester1', 'tester2', 'tester3'))
+        self.game.dealer = 0
+        self.game.turn = 0
+        p1, p2, p3 = self.game.seats
+        p1.bet = 130
+        p2.passed = p3.passed = True
+        p1.cards = [ThousandCard(x) for x in ('SA', 'S10', 'SK', 'SQ', 'D9', 'DJ', 'H10')]
+        p2.cards = [ThousandCard(x) for x in ('SJ', 'S9', 'CA', 'CK', 'CQ', 'CJ', 'C9')]
+        p3.cards = [ThousandCard(x) for x in ('C10', 'HA', 'HK', 'HJ', 'H9', 'DA', 'D10')]
+        p1.tricks = [ThousandCard(x) for x in ('DK', 'DQ', 'HQ')]
+        self.game.bet = 130
+        self.game.state = 'inGame'
+
+    def put(self, seat, code):
+        self.game.putCard(seat, ThousandCard(code))
+
+    def processGame(self):
+        for seat, code in ((0, 'SA'), (1, 'S9'), (2, 'HA'), (0, 'SQ'), (1, 'SJ'), (2, 'H9'),
+                           (0, 'DJ'), (1, 'C9'), (2, 'D10'), (2, 'DA'), (0, 'D9'), (1, 'CJ'),
+                           (2, 'C10'), (0, 'SK'), (1, 'CA'), (0, 'H10'), (1, 'CQ'), (2, 'HJ'),
+                           (0, 'S10'), (1, 'CK')):
+            self.put(seat, code)
+
+    def test_matchingKind(self):
+        self.put(0, 'SA')
+        self.assertRaises(GameError, self.put, 1, 'C9')
+        self.put(1, 'S9')
+        self.assertEqual(self.game.turn, 2)
+
+    def test_keptMasks(self):
+        player = self.game.seats[0]
+        self.assertEqual(player.cardsMask(), ThousandCard.mask(player.cards))
+        self.assertEqual(player.getGamePoints(), 10)
+        self.put(0, 'SA')
+        self.assertFalse(player.hasCard(ThousandCard('SA')))
+        self.assertEqual(player.cardsMask(), ThousandCard.mask(player.cards))
+        self.put(1, 'S9')
+        self.put(2, 'HA')
+        self.assertEqual(player.getGamePoints(), 32)
+        player.cards = [ThousandCard('D9')]
+        self.assertEqual(player.legalCards('S'), [ThousandCard('D9')])
+
+    def test_pairCall(self):
+        self.put(0, 'SQ')
+        self.assertEqual(self.game.trump, 'S')
+        self.assertEqual(self.game.seats[0].calls, 'S')
+        self.assertEqual(self.game.info, 'tester1 calls 40 (Spades)')
+
+    def test_gameFinishSuccess(self):
+        self.processGame()
+        self.put(2, 'HK')
+        self.assertEqual(self.game.state, 'endGame')
+        self.assertEqual([p.points for p in self.game.seats], [130, 0, 30])
+        self.assertEqual(self.game.info, 'tester1 succeeds playing 130')
+        self.assertEqual(self.game.history, [(130, 0, 30)])
+
+    def test_gameFinishBlindFail(self):
+        self.processGame()
+        self.game.bet = 150
+        self.game.blind = True
+        self.put(2, 'HK')
+        self.assertEqual([p.points for p in self.game.seats], [-300, 0, 50])
+
+    def test_over880times3(self):
+        self.processGame()
+        self.game.seats[2].points = 880
+        self.game.seats[2].barrel = 3
+        self.put(2, 'HK')
+        self.assertEqual(self.game.seats[2].points, 760)
+        self.assertEqual(self.game.seats[2].barrel, 0)
+
+    def test_sessionFinish(self):
+        self.processGame()
+        self.game.seats[0].points = 870
+        self.put(2, 'HK')
+        self.assertEqual(self.game.state, 'finish')
+        self.assertEqual(self.game.info, 'tester1 has won the game!')
+
+class TestGameMoves(unittest.TestCase):
+    def setUp(self):
+        rng = random.Random(1)
+        self.names = ('tester1', 'tester2', 'tester3')
+        self.game = Game(self.names, shuffle=rng.shuffle)
+        self.players = [GreedyStrategy(rng) for i in range(3)]
+
+    def test_replay(self):
+        for i in range(5):
+            self.game.deal(self.game.dealer)
+            playHand(self.game, self.players)
+        self.assertTrue(len(self.game.moves) > 5 * 25)
+        game = Game(self.names)
+        for move in self.game.moves:
+            game.apply(move)
+        self.assertEqual(game.snapshot(), self.game.snapshot())
+        self.assertEqual(game.history, self.game.history)
+
+    def test_snapshot(self):
+        self.game.deal(self.game.dealer)
+        self.game.raiseBet(self.game.turn, 100)
+        game = Game.fromSnapshot(self.game.snapshot())
+        self.assertEqual(game.snapshot(), self.game.snapshot())
+        self.assertEqual(game.seats[1].cards, self.game.seats[1].cards)
+        playHand(self.game, self.players)
+        for move in self.game.moves[2:]:
+            game.apply(move)
+        self.assertEqual(game.snapshot(), self.game.snapshot())
+
+    def test_seededDeal(self):
+        deck = seededDeck(12345, 0)
+        self.assertEqual(sorted(deck), ThousandCard.generateDeck())
+        self.assertEqual(seededDeck(12345, 0), deck)
+        self.assertNotEqual(seededDeck(12345, 1), deck)
+        self.assertNotEqual(seededDeck(54321, 0), deck)
+        game = Game(self.names)
+        game.seed = 12345
+        game.deal(game.dealer)
+        self.assertEqual(game.seats[0].cards, deck[:7])
+        self.assertEqual(game.bank, deck[21:])
+        self.assertEqual(game.deals, 1)
+        self.assertEqual(game.moves[-1], ('E', 0, 0))
+        playHand(game, self.players)
+        game.deal(game.dealer)
+        self.assertEqual(game.seats[0].cards, seededDeck(12345, 1)[:7])
+        replayed = Game(self.names)
+        replayed.seed = 12345
+        for move in game.moves:
+            replayed.apply(move)
+        self.assertEqual(replayed.snapshot(), game.snapshot())
+        data = ''.join([packMove(m) for m in game.moves])
+        self.assertEqual(unpackMoves(data), game.moves)
+
+    def test_pack(self):
+        self.game.deal(self.game.dealer)
+        playHand(self.game, self.players)
+        data = ''.join([packMove(m) for m in self.game.moves])
+        self.assertEqual(unpackMoves(data), self.game.moves)
+        self.assertEqual(len(packMove(('L', 2, 23))), 3)
+
+if __name__ == '__main__':
+    unittest.main()
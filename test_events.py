@@ -0,0 +1,28 @@
+import unittest
+from events import LocalPublisher, seatChannel, chatChannel, channelToken
+
+class TestEvents(unittest.TestCase):
+    def test_channels(self):
+        self.assertEqual(seatChannel(12, 2), 'seat:12:2')
+        self.assertEqual(chatChannel(12), 'chat:12')
+        token = channelToken(seatChannel(12, 2), 'secret')
+        self.assertEqual(token, channelToken(seatChannel(12, 2), 'secret'))
+        self.assertNotEqual(token, channelToken(seatChannel(12, 1), 'secret'))
+        self.assertNotEqual(token, channelToken(seatChannel(12, 2), 'other'))
+        self.assertRaises(ValueError, channelToken, seatChannel(12, 2), '')
+
+    def test_localPublisher(self):
+        publisher = LocalPublisher()
+        received = []
+        self.assertFalse(publisher.isSubscribed('chat:1'))
+        publisher.subscribe('chat:1', received.append)
+        self.assertTrue(publisher.isSubscribed('chat:1'))
+        publisher.publish([('chat:1', 'a'), ('chat:2', 'b'), ('chat:1', 'c')])
+        self.assertEqual(received, ['a', 'c'])
+        publisher.unsubscribe('chat:1', received.append)
+        self.assertFalse(publisher.isSubscribed('chat:1'))
+        publisher.publish([('chat:1', 'd')])
+        self.assertEqual(received, ['a', 'c'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,3 +1,4 @@
+from __future__ import with_statement
 import sys
 import os
 
@@ -24,7 +25,8 @@ import unittest
 import time
 from google.appengine.api.users import User
 from google.appengine.ext import db
-from models import Player, Session, GameError
+from models import Player, Session, History, ChatLog, CHAT_SIZE, CHAT_MESSAGE, GameError, UnitOfWork, ConcurrentModification, migrateCards, migrateHistory, SCORE_CHUNK, SessionIndex, reindexSessions, getOpenSessions, lobbyCache, LOBBY_KEY, \
+    matchCache, matchKey, enqueueMatch, pollMatch, Move, MATCH_GRACE
 from cards import ThousandCard
 
 import warnings
@@ -35,6 +37,7 @@ from google.appengine.api import datastore_file_stub
 from google.appengine.api import mail_stub 
 from google.appengine.api import urlfetch_stub 
 from google.appengine.api import user_service_stub 
+from google.appengine.api.memcache import memcache_stub
 
 def prepareEnviroment():
     os.environ['TZ'] = 'UTC' 
@@ -48,6 +51,7 @@ def prepareEnviroment():
     apiproxy_stub_map.apiproxy.RegisterStub('user', user_service_stub.UserServiceStub()) 
     apiproxy_stub_map.apiproxy.RegisterStub('urlfetch', urlfetch_stub.URLFetchServiceStub()) 
     apiproxy_stub_map.apiproxy.RegisterStub('mail', mail_stub.MailServiceStub())
+    apiproxy_stub_map.apiproxy.RegisterStub('memcache', memcache_stub.MemcacheServiceStub())
 
 class TestPlayer(unittest.TestCase):
     def setUp(self):
@@ -93,6 +97,71 @@ class TestPlayer(unittest.TestCase):
         self.assertEqual(self.player.getGamePoints(), 300)
 
 
+class TestCardProperties(unittest.TestCase):
+    def setUp(self):
+        prepareEnviroment()
+        self.user = User(email='tester@google.com')
+
+    def test_packed(self):
+        player = Player(user=self.user)
+        player.cards = [ThousandCard(x) for x in ('HQ', 'S10', 'DA')]
+        player.tricks = [ThousandCard(x) for x in ('HA', 'C9', 'DK')]
+        player.put()
+        player = Player.get(player.key())
+        self.assertEqual([str(c) for c in player.cards], ['HQ', 'S10', 'DA'])
+        self.assertEqual([str(c) for c in player.tricks], ['C9', 'DK', 'HA'])
+        self.assertEqual(player.bank, [])
+        self.assertEqual(player.getGamePoints(), 15)
+
+    def test_legacy(self):
+        from google.appengine.api import datastore
+        entity = datastore.Entity('Player')
+        entity['user'] = self.user
+        entity['cards'] = u'HQ S10 DA'
+        entity['tricks'] = u'HA C9'
+        entity['bank'] = u''
+        key = datastore.Put(entity)
+        player = Player.get(key)
+        self.assertEqual([str(c) for c in player.cards], ['HQ', 'S10', 'DA'])
+        self.assertEqual(player.bank, [])
+        session = Session(player_1=player, dealer=player, state='hosted')
+        session.put()
+        version = session.version
+        self.assertEqual(len(list(migrateCards())), 1)
+        self.assertEqual(Session.get(session.key()).version, version + 1)
+        entity = datastore.Get(key)
+        self.assertTrue(isinstance(entity['cards'], db.Blob))
+        self.assertEqual(len(entity['tricks']), 3)
+        player = Player.get(key)
+        self.assertEqual([str(c) for c in player.tricks], ['C9', 'HA'])
+
+
+class TestUnitOfWork(unittest.TestCase):
+    def setUp(self):
+        prepareEnviroment()
+        self.player = Player(user=User(email='tester@google.com'))
+        self.player.put()
+
+    def test_flush(self):
+        with UnitOfWork():
+            self.player.goBlind()
+            with UnitOfWork():
+                self.player.goOpen()
+            self.assertEqual(Player.get(self.player.key()).blind, None)
+        self.assertEqual(Player.get(self.player.key()).blind, False)
+        self.assertEqual(UnitOfWork.current(), None)
+
+    def test_failure(self):
+        try:
+            with UnitOfWork():
+                self.player.goOpen()
+                self.player.goBlind()
+        except GameError:
+            pass
+        self.assertEqual(Player.get(self.player.key()).blind, None)
+        self.assertEqual(UnitOfWork.current(), None)
+
+
 class TestSessionInitialization(unittest.TestCase):
     def setUp(self):
         prepareEnviroment()
@@ -123,6 +192,19 @@ class TestSessionInitialization(unittest.TestCase):
         self.assertEqual(session.state, 'ready')
         self.assertRaises(GameError, session.join, User(email='yet@another.com'))
     
+    def test_prefetch(self):
+        session = Session()
+        session.host(self.user_1)
+        session.join(self.user_2)
+        session.join(self.user_3)
+        session.deal(session.dealer)
+        session = Session.get(session.key())
+        session.prefetch()
+        self.assertTrue(session.turn is session.player_2)
+        self.assertTrue(session.dealer is session.player_2)
+        self.assertEqual(session.player_1.user, self.user_1)
+        self.assertEqual(session.player_3.user, self.user_3)
+
     def test_isFull(self):
         session = Session()
         self.assertFalse(session.isFull())
@@ -134,6 +216,179 @@ class TestSessionInitialization(unittest.TestCase):
         self.assertTrue(session.isFull())
 
 
+class TestEmbeddedSession(unittest.TestCase):
+    def setUp(self):
+        prepareEnviroment()
+        self.user_1 = User(email='tester1@google.com')
+        self.user_2 = User(email='tester2@google.com')
+        self.user_3 = User(email='tester3@google.com')
+        self.session = Session(embedded=True)
+
+    def test_join(self):
+        player = self.session.host(self.user_1)
+        self.assertEqual(player.user, self.user_1)
+        self.assertTrue(self.session.getDealer() is player)
+        self.assertFalse(self.session.isFull())
+        self.session.join(self.user_2)
+        self.session.join(self.user_3)
+        self.assertTrue(self.session.isFull())
+        self.assertEqual(self.session.state, 'ready')
+        self.assertRaises(GameError, self.session.join, User(email='yet@another.com'))
+        self.assertEqual(Player.all().count(), 0)
+        players = self.session.getPlayers()
+        self.assertTrue(self.session.getNextPlayer(players[2]) is players[0])
+        self.assertTrue(self.session.getPlayerByUser(self.user_2) is players[1])
+
+    def test_storage(self):
+        self.session.host(self.user_1)
+        self.session.join(self.user_2)
+        self.session.join(self.user_3)
+        self.session.deal(self.session.getDealer())
+        self.session.getPlayers()[1].goBlind()
+        session = Session.get(self.session.key())
+        self.assertEqual(session.state, 'bettings')
+        self.assertEqual(session.getTurn().user, self.user_2)
+        self.assertEqual(session.getDealer().user, self.user_2)
+        self.assertTrue(session.getPlayers()[1].blind)
+        for old, new in zip(self.session.getPlayers(), session.getPlayers()):
+            self.assertEqual(old.cards, new.cards)
+            self.assertEqual(new.points, 0)
+        session.raiseBet(session.getTurn(), 120)
+        self.assertEqual(Session.get(self.session.key()).bet, 120)
+
+    def test_index(self):
+        self.session.host(self.user_1)
+        entries = SessionIndex.all().filter('user =', self.user_1).fetch(10)
+        self.assertEqual(len(entries), 1)
+        self.assertEqual(entries[0].session_id, self.session.key().id())
+        self.assertEqual(entries[0].state, 'hosted')
+        self.session.join(self.user_2)
+        self.session.join(self.user_3)
+        self.session.deal(self.session.getDealer())
+        self.assertEqual(SessionIndex.all().count(), 3)
+        for user in (self.user_1, self.user_2, self.user_3):
+            entry = SessionIndex.all().filter('user =', user).get()
+            self.assertEqual(entry.state, 'bettings')
+            self.assertEqual(entry.hostedby, self.user_1.nickname())
+            self.assertEqual(entry.turn, self.session.getTurn().user.nickname())
+        SessionIndex.all().get().delete()
+        list(reindexSessions())
+        self.assertEqual(SessionIndex.all().count(), 3)
+
+    def test_lobby(self):
+        lobbyCache.delete(LOBBY_KEY)
+        self.assertEqual(getOpenSessions(), [])
+        self.session.host(self.user_1)
+        lines = getOpenSessions()
+        self.assertEqual(len(lines), 1)
+        self.assertEqual(lines[0]['id'], self.session.key().id())
+        self.assertEqual(lines[0]['free'], 2)
+        self.session.join(self.user_2)
+        self.assertEqual(getOpenSessions()[0]['free'], 1)
+        self.session.join(self.user_3)
+        self.assertEqual(getOpenSessions(), [])
+
+    def test_seatTwice(self):
+        self.assertRaises(GameError, self.session.seat, [self.user_1, self.user_2, self.user_1])
+
+    def test_match(self):
+        first = enqueueMatch(self.user_1, 'test')
+        self.assertEqual(first % 3, 1)
+        self.assertEqual(enqueueMatch(self.user_1, 'test'), first)
+        self.assertEqual(pollMatch(self.user_1, first, 'test'), (first, None))
+        self.assertRaises(GameError, pollMatch, self.user_2, first, 'test')
+        tickets = [enqueueMatch(user, 'test') for user in (self.user_2, self.user_3)]
+        self.assertEqual(tickets, [first + 1, first + 2])
+        ticket, id = pollMatch(self.user_1, first, 'test')
+        self.assertNotEqual(id, None)
+        self.assertEqual(pollMatch(self.user_3, first + 2, 'test'), (first + 2, id))
+        session = Session.get_by_id(id)
+        self.assertEqual(session.state, 'ready')
+        self.assertEqual(session.users, [self.user_1, self.user_2, self.user_3])
+        self.assertEqual(SessionIndex.all().ancestor(session).count(), 3)
+        self.assertEqual(enqueueMatch(self.user_1, 'test'), first + 3)
+        enqueueMatch(self.user_2, 'test')
+        enqueueMatch(User(email='leaving@google.com'), 'test')
+        matchCache.delete(matchKey('test', first + 5))
+        self.assertEqual(pollMatch(self.user_1, first + 3, 'test'), (first + 3, None))
+        matchCache.set(matchKey('test', 'gone:%d' % ((first + 2) // 3)), time.time() - MATCH_GRACE)
+        self.assertEqual(pollMatch(self.user_1, first + 3, 'test'), (first + 6, None))
+        self.assertRaises(GameError, pollMatch, self.user_1, first + 3, 'test')
+        matchCache.delete(matchKey('test', 'tail'))
+        self.assertNotEqual(enqueueMatch(self.user_3, 'test'), first + 7)
+
+    def test_replay(self):
+        self.session.host(self.user_1)
+        self.session.join(self.user_2)
+        self.session.join(self.user_3)
+        self.session.deal(self.session.getDealer())
+        for i in range(25):
+            turn = self.session.getTurn()
+            if self.session.isFirstMove():
+                self.session.raiseBet(turn, 100)
+            elif self.session.state == 'bettings':
+                self.session.makePass(turn)
+            elif self.session.state == 'collect':
+                self.session.collectBank(turn)
+            elif self.session.state == 'finalBet' and len(self.session.bank) < 3:
+                self.session.discardCard(turn, turn.cards[0])
+            elif self.session.state == 'finalBet':
+                self.session.start(turn, 100)
+            else:
+                kind = self.session.bank and self.session.bank[0].kind() or None
+                self.session.putCard(turn, turn.legalCards(kind)[0])
+        session = Session.get(self.session.key())
+        self.assertEqual(session.moves, 26)
+        self.assertTrue(Move.all().ancestor(session).count() <= 1)
+        self.assertEqual(session.replayGame().snapshot(), session.getGame().snapshot())
+        hands, bank = session.getDeal(0)
+        self.assertEqual(session.replayGame(1).seats[1].cards, hands[1])
+        self.assertEqual(session.replayGame(1).bank, bank)
+        self.assertEqual(session.replayGame(3).state, 'bettings')
+        self.assertEqual(session.replayGame(4).state, 'collect')
+
+    def test_concurrentModification(self):
+        self.session.host(self.user_1)
+        first = Session.get(self.session.key())
+        second = Session.get(self.session.key())
+        first.join(self.user_2)
+        self.assertRaises(ConcurrentModification, second.join, self.user_3)
+        session = Session.get(self.session.key())
+        self.assertEqual(len(session.users), 2)
+        session.join(self.user_3)
+        self.assertTrue(Session.get(self.session.key()).isFull())
+
+    def test_chat(self):
+        self.session.host(self.user_1)
+        self.assertEqual(ChatLog.read(self.session), (0, []))
+        self.assertEqual(ChatLog.post(self.session, self.user_1, 'hello'), 0)
+        seq, messages = ChatLog.read(self.session)
+        self.assertEqual(seq, 1)
+        self.assertEqual([m['message'] for m in messages], ['hello'])
+        self.assertEqual(messages[0]['player'], self.user_1.nickname())
+        self.assertEqual(ChatLog.read(self.session, 1), (1, []))
+        for i in range(CHAT_SIZE + 5):
+            ChatLog.post(self.session, self.user_1, str(i))
+        seq, messages = ChatLog.read(self.session)
+        self.assertEqual(seq, CHAT_SIZE + 6)
+        self.assertEqual(len(messages), CHAT_SIZE)
+        self.assertEqual(messages[-1]['message'], str(CHAT_SIZE + 4))
+        seq, messages = ChatLog.read(self.session, seq - 2)
+        self.assertEqual([m['message'] for m in messages], [str(CHAT_SIZE + 3), str(CHAT_SIZE + 4)])
+        number = ChatLog.post(self.session, self.user_1, 'x' * (CHAT_MESSAGE + 100))
+        seq, messages = ChatLog.read(self.session, number)
+        self.assertEqual(messages[0]['message'], 'x' * CHAT_MESSAGE)
+
+    def test_cache(self):
+        self.session.host(self.user_1)
+        version = self.session.version
+        self.session.join(self.user_2)
+        self.assertEqual(self.session.version, version + 1)
+        session = Session.load(self.session.key().id())
+        self.assertEqual(session.version, self.session.version)
+        self.assertEqual(session.getPlayers()[1].user, self.user_2)
+
+
 class TestSessionCardDealing(unittest.TestCase):
     def setUp(self):
         prepareEnviroment()
@@ -616,6 +871,54 @@ class TestSessionGameplay(unittest.TestCase):
         self.session.putCard(self.session.player_1, ThousandCard('S10'))
         self.session.putCard(self.session.player_2, ThousandCard('CK'))
 
+    def test_scores(self):
+        self.processGame()
+        self.session.putCard(self.session.player_3, ThousandCard('HK'))
+        session = Session.get(self.session.key())
+        self.assertEqual([list(c) for c in session.getScores()], [[130], [0], [30]])
+        self.assertEqual(History.all().count(), 0)
+        chunks = session.appendScores([(i, -i, 2 * i) for i in range(SCORE_CHUNK * 2)])
+        self.assertEqual(len(chunks), 2)
+        db.put(chunks)
+        columns = session.getScores()
+        self.assertEqual(len(columns[0]), SCORE_CHUNK * 2 + 1)
+        self.assertEqual(columns[1][-1], 1 - SCORE_CHUNK * 2)
+
+    def test_migrateHistory(self):
+        self.session.appendScores([(130, 0, 30)])
+        self.session.put()
+        for points in ((10, 20, 30), (40, 50, 60)):
+            History(session=self.session, player_1=points[0], player_2=points[1], player_3=points[2]).put()
+        self.assertEqual(len(list(migrateHistory())), 1)
+        self.assertEqual(History.all().count(), 0)
+        session = Session.get(self.session.key())
+        self.assertEqual([list(c) for c in session.getScores()], [[10, 40, 130], [20, 50, 0], [30, 60, 30]])
+
+    def test_migrateHistoryPages(self):
+        import datetime
+        import models
+        page = models.HISTORY_PAGE
+        models.HISTORY_PAGE = 2
+        try:
+            for i in range(5):
+                History(session=self.session, datetime=datetime.datetime(2010, 1, 1, 0, 0, i),
+                        player_1=i, player_2=0, player_3=0).put()
+            self.session.put()
+            list(migrateHistory())
+        finally:
+            models.HISTORY_PAGE = page
+        self.assertEqual(History.all().count(), 0)
+        self.assertEqual(list(Session.get(self.session.key()).getScores()[0]), range(5))
+
+    def test_migrateHistoryResumed(self):
+        self.session.appendScores([(10, 20, 30), (130, 0, 30)])
+        self.session.put()
+        History(session=self.session, player_1=10, player_2=20, player_3=30).put()
+        list(migrateHistory())
+        self.assertEqual(History.all().count(), 0)
+        session = Session.get(self.session.key())
+        self.assertEqual([list(c) for c in session.getScores()], [[10, 130], [20, 0], [30, 30]])
+
     def test_gameFinishSuccess(self):
         self.processGame()
         self.session.putCard(self.session.player_3, ThousandCard('HK'))
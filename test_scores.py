@@ -0,0 +1,18 @@
+import unittest
+from scores import TRIPLE, packScores, unpackColumns, unpackScores
+
+class TestScores(unittest.TestCase):
+    def test_pack(self):
+        points = [(0, 60, 60), (-120, 130, 60), (1000, 880, -990)]
+        data = packScores(points)
+        self.assertEqual(len(data), TRIPLE * 3)
+        self.assertEqual(data[:2], '\x00\x00')
+        self.assertEqual(data[2:4], '\x3c\x00')
+        self.assertEqual(unpackScores(data), points)
+        self.assertEqual(unpackScores(data[:TRIPLE] + packScores([(1, 2, 3)])), [(0, 60, 60), (1, 2, 3)])
+        columns = unpackColumns(data)
+        self.assertEqual([list(c) for c in columns], [[0, -120, 1000], [60, 130, 880], [60, 60, -990]])
+        self.assertEqual(unpackScores(''), [])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,27 @@
+import unittest
+import random
+from simulator import playGame, simulate, report
+
+class TestSimulator(unittest.TestCase):
+    def test_playGame(self):
+        game, hands = playGame(('greedy', 'random', 'greedy'), random.Random(1))
+        self.assertEqual(game.state, 'finish')
+        self.assertTrue(max([p.points for p in game.seats]) >= 1000)
+        self.assertEqual(len(game.history), hands)
+
+    def test_deterministic(self):
+        names = ('random', 'random', 'greedy')
+        first = simulate(names, 6, workers=1, seed=7)
+        second = simulate(names, 6, workers=1, seed=7)
+        self.assertEqual(first, second)
+        self.assertEqual(first['games'], 6)
+        self.assertEqual(len(first['points']), 6)
+
+    def test_report(self):
+        names = ('random', 'random', 'random')
+        text = report(names, simulate(names, 2, workers=1), 1.0)
+        self.assertTrue('2 games' in text)
+        self.assertTrue('games/s' in text)
+
+if __name__ == '__main__':
+    unittest.main()
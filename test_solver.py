@@ -0,0 +1,64 @@
+import unittest
+import random
+from cards import ThousandCard
+from engine import Game
+from solver import Solver, solveGame, NO_TRUMP
+
+class TestSolver(unittest.TestCase):
+    def minimax(self, solver, hands, leader, trick, trump, declarer):
+        if not trick and not (hands[0] | hands[1] | hands[2]):
+            return 0
+        seat = (leader + len(trick)) % 3
+        values = []
+        for card in solver.moves(hands[seat], trick, trump):
+            after = solver.play(hands, leader, trick, trump, seat, card)
+            values.append(after[4][declarer] + self.minimax(solver, after[0], after[1], after[2],
+                                                            after[3], declarer))
+        if seat == declarer:
+            return max(values)
+        return min(values)
+
+    def test_exact(self):
+        rng = random.Random(5)
+        for i in range(100):
+            n = rng.choice((2, 3))
+            deck = range(24)
+            rng.shuffle(deck)
+            hands = [ThousandCard.mask([ThousandCard.deck[c] for c in deck[s*n:(s+1)*n]]) for s in range(3)]
+            trump = rng.choice((None, 'S', 'C', 'D', 'H'))
+            declarer = rng.randrange(3)
+            solver = Solver(maxEntries=rng.choice((5, 1000)))
+            result = solver.solve(hands, 0, declarer, trump)
+            expected = self.minimax(solver, hands, 0, (), ThousandCard.trump_index.get(trump, NO_TRUMP), declarer)
+            self.assertEqual(result['value'], expected)
+            self.assertEqual(result['points'][declarer], expected)
+            self.assertEqual(len(result['moves']), 3 * n)
+
+    def test_tableBound(self):
+        solver = Solver(maxEntries=10)
+        deck = ThousandCard.generateDeck()
+        hands = [ThousandCard.mask(deck[s*5:(s+1)*5]) for s in range(3)]
+        solver.solve(hands, 0, 0)
+        self.assertTrue(len(solver.table) <= 10)
+
+    def test_solveGame(self):
+        game = Game(('tester1', 'tester2', 'tester3'))
+        game.dealer = game.turn = 0
+        p1, p2, p3 = game.seats
+        p1.bet = 130
+        p2.passed = p3.passed = True
+        p1.cards = [ThousandCard(x) for x in ('SA', 'S10', 'SK', 'SQ', 'D9', 'DJ', 'H10')]
+        p2.cards = [ThousandCard(x) for x in ('SJ', 'S9', 'CA', 'CK', 'CQ', 'CJ', 'C9')]
+        p3.cards = [ThousandCard(x) for x in ('C10', 'HA', 'HK', 'HJ', 'H9', 'DA', 'D10')]
+        p1.tricks = [ThousandCard(x) for x in ('DK', 'DQ', 'HQ')]
+        game.bet = 130
+        game.state = 'inGame'
+        result = solveGame(game)
+        self.assertEqual(result['value'], result['points'][0])
+        for card in result['moves']:
+            game.putCard(game.turn, card)
+        self.assertEqual(game.state, 'endGame')
+        self.assertEqual([p.getGamePoints() for p in game.seats], result['points'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+from test_models import prepareEnviroment
+
+import unittest
+from google.appengine.api.users import User
+from models import Session
+from cache import getCounter
+from events import getPublisher, seatChannel, chatChannel
+from views import Deal, Chat, runAction
+
+class Request(object):
+    def __init__(self, **params):
+        self.params = params
+
+    def get(self, name, default=''):
+        return self.params.get(name, default)
+
+class Response(object):
+    def __init__(self):
+        self.out = self
+        self.written = []
+
+    def write(self, data):
+        self.written.append(data)
+
+class TestPublish(unittest.TestCase):
+    def setUp(self):
+        prepareEnviroment()
+        self.user_1 = User(email='test@example.com')
+        self.session = Session()
+        self.session.host(self.user_1)
+        self.session.join(User(email='tester2@google.com'))
+        self.session.join(User(email='tester3@google.com'))
+        self.id = self.session.key().id()
+        self.received = []
+        self.subscriptions = [(seatChannel(self.id, 0), self.received.append),
+                              (chatChannel(self.id), self.received.append)]
+        for channel, callback in self.subscriptions:
+            getPublisher().subscribe(channel, callback)
+
+    def tearDown(self):
+        for channel, callback in self.subscriptions:
+            getPublisher().unsubscribe(channel, callback)
+
+    def handle(self, handler, **params):
+        handler.request = Request(id=str(self.id), **params)
+        handler.response = Response()
+        handler.post()
+
+    def test_action(self):
+        self.handle(Deal())
+        self.assertEqual(len(self.received), 1)
+        self.assertEqual(self.received[0]['version'], Session.load(self.id).version)
+        self.assertEqual(self.received[0]['state'], 'open_or_blind')
+
+    def test_chat(self):
+        self.handle(Chat(), message='hello')
+        self.assertEqual(len(self.received), 1)
+        self.assertEqual([m['message'] for m in self.received[0]['chat']], ['hello'])
+
+class TestRunAction(unittest.TestCase):
+    def setUp(self):
+        prepareEnviroment()
+        self.session = Session()
+        self.session.host(User(email='test@example.com'))
+        self.session.join(User(email='tester2@google.com'))
+        self.session.join(User(email='tester3@google.com'))
+        self.id = self.session.key().id()
+
+    def test_retry(self):
+        attempts = []
+        def deal(session, player):
+            if not attempts:
+                other = Session.get(session.key())
+                other.version += 1
+                other.put()
+            attempts.append(session.version)
+            session.deal(player)
+        handler = Deal()
+        handler.request = Request(id=str(self.id))
+        retries = getCounter('retries')
+        session = runAction(handler, deal)
+        self.assertEqual(len(attempts), 2)
+        self.assertEqual(attempts[1], attempts[0] + 1)
+        self.assertEqual(getCounter('retries'), retries + 1)
+        self.assertEqual(session.state, 'bettings')
+
+if __name__ == '__main__':
+    unittest.main()
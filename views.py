@@ -1,15 +1,18 @@
+from __future__ import with_statement
 from google.appengine.ext import webapp
 from google.appengine.ext.webapp import template
 from google.appengine.api import users
 from google.appengine.ext import db
-from models import Session, Player, History, GameError
+from models import Session, SessionIndex, reindexSessions, migrateCards, migrateHistory, getOpenSessions, enqueueMatch, pollMatch, ChatLog, GameError, UnitOfWork, ConcurrentModification, sessionCache, chatCache
+from cache import incrCounter, getCounter, createBackend
+from events import getPublisher, seatChannel, chatChannel, channelToken
+import events
 from cards import ThousandCard
 from pygooglechart import *
-import models
+import bids
 import simplejson as json
 import os
 import time
-import datetime
 
 def render(name, options):
     path = os.path.join(os.path.dirname(__file__), 'templates', name)
@@ -23,9 +26,76 @@ def options(current={}):
     opts.update(current)
     return opts
 
-def getSession(handler):
+def joinSession(session, player):
+    if player is None:
+        session.join(users.get_current_user())
+
+def runAction(handler, action, retries=3):
+    """
+    Runs action(session, player) of the current user in a unit of work.
+    If somebody else changed the session meanwhile, the action is retried
+    against fresh state (up to retries times). Retries are counted by the
+    'retries' counter. Returns the session after the action.
+    """
+
+    user = users.get_current_user()
+    for attempt in range(retries + 1):
+        session = getSession(handler)
+        version = session.version
+        try:
+            with UnitOfWork():
+                action(session, session.getPlayerByUser(user))
+            if session.version != version:
+                publishSession(session)
+            return session
+        except ConcurrentModification:
+            sessionCache.delete(session.key().id())
+            incrCounter('retries')
+            if attempt == retries:
+                raise
+
+watchCache = createBackend()
+
+WATCH_TIME = 120
+
+def watchKey(id, seat):
+    return 'watch:%d:%d' % (id, seat)
+
+def watchSeat(session, player):
+    """
+    Marks the seat of the player as watched through the push server for
+    WATCH_TIME seconds (the game page and its state loads refresh it).
+    """
+
+    if events.SSE_URL:
+        watchCache.set(watchKey(session.key().id(), session.getSeat(player)), True, time=WATCH_TIME)
+
+def publishSession(session):
+    """
+    Publishes the state of the session to the watched seats of its
+    players (see events): seats marked by watchSeat if the push server
+    is configured, seats with local subscribers otherwise.
+    """
+
+    id = session.key().id()
+    players = session.getPlayers()
+    channels = [seatChannel(id, seat) for seat in range(len(players))]
+    publisher = getPublisher()
+    if events.SSE_URL:
+        keys = [watchKey(id, seat) for seat in range(len(players))]
+        found = watchCache.get_multi(keys)
+        watched = [key in found for key in keys]
+    else:
+        watched = [publisher.isSubscribed(channel) for channel in channels]
+    states = []
+    for seat, player in enumerate(players):
+        if player is not None and watched[seat]:
+            states.append((channels[seat], buildState(session, player)))
+    publisher.publish(states)
+
+def getSession(handler, prefetch=True):
     try:
-        session = Session.get_by_id(int(handler.request.get('id')))
+        session = Session.load(int(handler.request.get('id')), prefetch)
         if not session:
             raise GameError('This session does not exist.')
         return session
@@ -55,34 +125,87 @@ class Logout(webapp.RequestHandler):
 class Sessions(webapp.RequestHandler):
     def get(self):
         user = users.get_current_user()
-        players = Player.all().filter('user =', user).fetch(100)
+        entries = SessionIndex.all().filter('user =', user).order('-started').fetch(100)
         result = []
-        for player in players:
-            s = None
-            for p in (player.sessions_as1, player.sessions_as2, player.sessions_as3):
-                if p.count() > 0:
-                    s = p[0]
-                    break
-            if not s:
-                continue
+        for e in entries:
             line = {}
-            line['id'] = s.key().id()
-            line['hostedby'] = s.player_1.user.nickname()
-            line['started'] = s.started
-            line['lastmove'] = s.modified
-            if s.state in ('hosted', 'ready'):
-                line['turn'] = s.dealer.user.nickname()
-            else:
-                line['turn'] = s.turn.user.nickname()
-            line['state'] = s.state
+            line['id'] = e.session_id
+            line['hostedby'] = e.hostedby
+            line['started'] = e.started
+            line['lastmove'] = e.modified
+            line['turn'] = e.turn
+            line['state'] = e.state
             result.append(line)
         domain = self.request.headers.get('host', 'no host')
         self.response.out.write(render('sessions.html', options({'sessions': result, 'domain': domain})))
 
+class Migrate(webapp.RequestHandler):
+    """
+    Runs one batch of a data migration per request (admins only) and
+    continues with the next batch from the query cursor until the job is
+    done, e.g. /admin/migrate?job=index.
+    """
+
+    jobs = {'index': reindexSessions, 'cards': migrateCards, 'history': migrateHistory}
+
+    def get(self):
+        name = self.request.get('job')
+        if not name in self.jobs:
+            return self.response.out.write(render('error.html', options({'error': 'Unknown migration.'})))
+        try:
+            cursor = self.jobs[name](cursor=self.request.get('cursor') or None).next()
+        except StopIteration:
+            cursor = None
+        self.response.out.write(render('migrate.html', options({'job': name, 'cursor': cursor})))
+
+class Counters(webapp.RequestHandler):
+    """
+    Shows the metric counters (admins only), e.g. how many actions were
+    retried because the session was changed meanwhile (see runAction).
+    """
+
+    names = ('retries',)
+
+    def get(self):
+        counters = [(name, getCounter(name)) for name in self.names]
+        self.response.out.write(render('counters.html', options({'counters': counters})))
+
+class Lobby(webapp.RequestHandler):
+    def get(self):
+        domain = self.request.headers.get('host', 'no host')
+        self.response.out.write(render('lobby.html', options({'sessions': getOpenSessions(), 'domain': domain})))
+
+class Match(webapp.RequestHandler):
+    """
+    Matchmaking: POST puts the user to the queue and shows the waiting
+    page, which polls GET with the ticket until the session is created.
+    """
+
+    def getBucket(self):
+        return self.request.get('bucket')[:16] or 'any'
+
+    def post(self):
+        ticket = enqueueMatch(users.get_current_user(), self.getBucket())
+        self.response.out.write(render('match.html', options({'ticket': ticket, 'bucket': self.getBucket()})))
+
+    def get(self):
+        try:
+            ticket = int(self.request.get('ticket'))
+        except ValueError:
+            return self.redirect('/lobby')
+        try:
+            ticket, id = pollMatch(users.get_current_user(), ticket, self.getBucket())
+            out = json.dumps({'ticket': ticket, 'session': id})
+        except GameError, error:
+            self.response.set_status(403)
+            out = json.dumps({'error': str(error)})
+        self.response.headers['Content-Type'] = 'application/json'
+        self.response.out.write(out)
+
 class Host(webapp.RequestHandler):
     def post(self):
         user = users.get_current_user()
-        session = Session()
+        session = Session(embedded=True)
         session.host(user)
         domain = self.request.headers.get('host', 'no host')
         self.response.out.write(render('host.html', options({'id': session.key().id(), 'domain': domain})))
@@ -92,11 +215,10 @@ class Stats(webapp.RequestHandler):
         user = users.get_current_user()
         try:
             session = getSession(self)
-            query = db.GqlQuery("SELECT * FROM History " + "WHERE session = :1 ORDER BY datetime", session)
-            results = query.fetch(1000)
-            points = [[p for p in (r.player_1, r.player_2, r.player_3)] for r in results]
+            columns = session.getScores()
+            points = zip(*columns)
             players = []
-            for p in (session.player_1, session.player_2, session.player_3):
+            for p in session.getPlayers():
                 if p and p.user:
                     name = p.user.nickname()
                     if p.plus:
@@ -105,9 +227,9 @@ class Stats(webapp.RequestHandler):
                 else:
                     players.append('[Not connected]')
             colors = ['FFBF00', '85AC1E', 'FF7100']
-            data1 = [0] + [p[0] for p in points]
-            data2 = [0] + [p[1] for p in points]
-            data3 = [0] + [p[2] for p in points]
+            data1 = [0] + list(columns[0])
+            data2 = [0] + list(columns[1])
+            data3 = [0] + list(columns[2])
             data = data1 + data2 + data3
             minimum = min(0, round(min(data1 + data2 + data3)-100, -2))
             chart = SimpleLineChart(680, 300, 'Progress of the game', players, colors, y_range=(minimum, 1000))
@@ -130,65 +252,57 @@ class Play(webapp.RequestHandler):
     def get(self):
         user = users.get_current_user()
         try:
-            session = getSession(self)
-            player = session.getPlayerByUser(user)
-            if player is None:
-                player = session.join(user)
-            return self.response.out.write(render('game.html', {'ingame': True, 'session': session.key().id()}))
+            session = runAction(self, joinSession)
+            id = session.key().id()
+            sse = ''
+            if events.SSE_URL:
+                watchSeat(session, session.getPlayerByUser(user))
+                seat = session.getSeat(session.getPlayerByUser(user))
+                token = channelToken(seatChannel(id, seat))
+                sse = '%s/events?session=%d&seat=%d&token=%s' % (events.SSE_URL, id, seat, token)
+            return self.response.out.write(render('game.html', {'ingame': True, 'session': id, 'sse': sse}))
         except GameError, error:
             return self.response.out.write(render('error.html', {'error': error}))
 
-class Deal(webapp.RequestHandler):
+class ActionHandler(webapp.RequestHandler):
+    """
+    Base of the handlers which change the session. Subclasses implement
+    action(session, player); it is run by runAction.
+    """
+
     def post(self):
-        user = users.get_current_user()
-        session = getSession(self)
-        player = session.getPlayerByUser(user)
+        runAction(self, self.action)
+
+class Deal(ActionHandler):
+    def action(self, session, player):
         session.deal(player)
 
-class GoOpen(webapp.RequestHandler):
-    def post(self):
-        user = users.get_current_user()
-        session = getSession(self)
-        player = session.getPlayerByUser(user)
-        player.goOpen()
+class GoOpen(ActionHandler):
+    def action(self, session, player):
+        session.goOpen(player)
 
-class GoBlind(webapp.RequestHandler):
-    def post(self):
-        user = users.get_current_user()
-        session = getSession(self)
-        player = session.getPlayerByUser(user)
-        player.goBlind()
+class GoBlind(ActionHandler):
+    def action(self, session, player):
+        session.goBlind(player)
 
-class RaiseBet(webapp.RequestHandler):
-    def post(self):
-        user = users.get_current_user()
-        session = getSession(self)
-        player = session.getPlayerByUser(user)
+class RaiseBet(ActionHandler):
+    def action(self, session, player):
         upto = int(self.request.get('upto'))
         if session.state == 'bettings':
             session.raiseBet(player, upto)
         elif session.state == 'finalBet':
             session.start(player, upto)
 
-class MakePass(webapp.RequestHandler):
-    def post(self):
-        user = users.get_current_user()
-        session = getSession(self)
-        player = session.getPlayerByUser(user)
+class MakePass(ActionHandler):
+    def action(self, session, player):
         session.makePass(player)
 
-class CollectBank(webapp.RequestHandler):
-    def post(self):
-        user = users.get_current_user()
-        session = getSession(self)
-        player = session.getPlayerByUser(user)
+class CollectBank(ActionHandler):
+    def action(self, session, player):
         session.collectBank(player)
 
-class PutCard(webapp.RequestHandler):
-    def post(self):
-        user = users.get_current_user()
-        session = getSession(self)
-        player = session.getPlayerByUser(user)
+class PutCard(ActionHandler):
+    def action(self, session, player):
         card = self.request.get('card')
         card = ThousandCard(card)
         if session.state == 'finalBet':
@@ -196,213 +310,254 @@ class PutCard(webapp.RequestHandler):
         else:
             session.putCard(player, card)
 
-class RetrieveCard(webapp.RequestHandler):
-    def post(self):
-        user = users.get_current_user()
-        session = getSession(self)
-        player = session.getPlayerByUser(user)
+class RetrieveCard(ActionHandler):
+    def action(self, session, player):
         card = self.request.get('card')
         card = ThousandCard(card)
         session.retrieveCard(player, card)
 
-class TakePlus(webapp.RequestHandler):
-    def post(self):
-        user = users.get_current_user()
-        session = getSession(self)
-        player = session.getPlayerByUser(user)
+class TakePlus(ActionHandler):
+    def action(self, session, player):
         session.takePlus(player)
 
+# Holding polls needs a runtime serving concurrent requests (threadsafe);
+# on the single-threaded runtime every held poll would take an instance,
+# so /update only checks the versions once and the client polls again
+# after POLL_DELAY milliseconds.
+LONG_POLL = False
+POLL_TIMEOUT = 20
+POLL_INTERVAL = 0.5
+POLL_DELAY = 3000
+
+def buildState(session, player):
+    """
+    Returns the state of the session as seen by given player: names,
+    points and infos of all players, the player's cards, visible bank
+    and the controls to show.
+    """
+
+    response = {}
+    response['version'] = session.version
+
+    players = session.getPlayers()
+    seat = session.getSeat(player)
+    opponent1, opponent2 = players[(seat + 1) % 3], players[(seat + 2) % 3]
+
+    for p in ('player', 'opponent1', 'opponent2'):
+        pl = eval(p)
+        response[p + '_turn'] = ''
+        response[p + '_info'] = ''
+        if pl:
+            response[p + '_username'] = pl.user.nickname()
+            response[p + '_points'] = str(pl.points) + ' points'
+            response[p + '_plus'] = pl.plus
+            response[p + '_barrel'] = pl.barrel
+        else:
+            response[p + '_username'] = '[Not connected]'
+            response[p + '_points'] = ''
+            response[p + '_plus'] = False
+            response[p + '_barrel'] = 0
+
+    response['info_header'] = ''
+
+    if session.isFull():
+        turn = session.getTurn()
+        if player.blind is True:
+            response['state'] = 'go_blind'
+            response['cards'] = ['BACK'] * 7
+        elif player.blind is False:
+            response['state'] = 'go_open'
+            response['cards'] = [str(c) for c in sorted(player.cards)]
+        else:
+            response['state'] = 'open_or_blind'
+            response['cards'] = ['BACK'] * 7
+        if session.state == 'ready':
+            turn = session.getDealer()
+            response['state'] = 'ready'
+        elif session.state == 'bettings':
+            response['info_header'] = session.info
+            response['bank'] = ['BACK'] * 3
+            response['passed'] = player.passed
+            response['first'] = session.isFirstMove()
+            if not player.passed:
+                response['bettings'] = []
+                for bet in range(session.bet + 10, 301, 10):
+                    response['bettings'].append(bet)
+                if player.blind is False:
+                    response['hint'] = bids.table.suggestBet(player.cards)
+            for p in ('player', 'opponent1', 'opponent2'):
+                pl = eval(p)
+                if pl.passed:
+                    response[p + '_info'] = 'Pass'
+                elif pl.bet:
+                    response[p + '_info'] = 'Bet %d' % pl.bet
+                    if (pl.blind):
+                        response[p + '_info'] += ' (Blind)'
+                else:
+                    response[p + '_info'] = ''
+        elif session.state == 'collect':
+            winner = session.betsWinner()
+            response['info_header'] = '%s takes the bank' % winner.user.nickname()
+            response['state'] = 'collect'
+            response['cards'] = [str(c) for c in sorted(player.cards)]
+            if player == winner:
+                response['bank'] = [str(c) for c in session.bank]
+            else:
+                if session.blind:
+                    response['bank'] = ['BACK'] * 3
+                else:
+                    response['bank'] = [str(c) for c in session.bank]
+        elif session.state == 'finalBet':
+            response['state'] = 'finalBet'
+            response['cards'] = [str(c) for c in sorted(player.cards)]
+            if turn == player:
+                response['info_header'] = 'Discard 3 card and make final bet'
+                response['bank'] = [str(c) for c in session.bank]
+                if session.blind:
+                    response['bettings'] = [session.bet]
+                    for bet in range(session.bet*2, 301, 10):
+                        response['bettings'].append(bet)
+                else:
+                    response['bettings'] = []
+                    for bet in range(session.bet, 301, 10):
+                        response['bettings'].append(bet)
+                hand = [c for c in player.cards + session.bank if not c in session.memo]
+                response['hint'] = bids.table.suggestBet(hand)
+            else:
+                response['info_header'] = 'Waiting for final bet'
+                response['bank'] = ['BACK'] * len(session.bank)
+        elif session.state == 'inGame':
+            response['state'] = 'inGame'
+            opponent1 = session.getNextPlayer(player)
+            opponent2 = session.getNextPlayer(opponent1)
+            offset = max(len(player.thrown), len(opponent1.thrown), len(opponent2.thrown))
+            response['bank'] = []
+            response['memo'] = []
+            response['taken'] = 'Taken: ' + str(player.getGamePoints())
+            winner = session.betsWinner()
+            for pl in ('player', 'opponent1', 'opponent2'):
+                p = eval(pl)
+                if p == winner:
+                    response[pl + '_info'] = 'Plays %d' % session.bet
+                    if session.blind:
+                        response[pl + '_info'] += ' (Blind)'
+                if offset > 0 and len(p.thrown) == offset:
+                    response['bank'].append(str(p.thrown[offset-1]))
+                else:
+                    response['bank'].append(None)
+                if offset > 1 and len(p.thrown) >= offset-1:
+                    response['memo'].append(str(p.thrown[offset-2]))
+                else:
+                    response['memo'].append(None)
+            if len(player.thrown) == 0:
+                if session.blind:
+                    response['memo'] = ['BACK'] * 3
+                else:
+                    response['memo'] = [str(c) for c in session.memo]
+            response['cards'] = [str(c) for c in sorted(player.cards)]
+            if session.trump:
+                response['trump'] = 'Trump: ' + ThousandCard.kinds[session.trump]
+            else:
+                response['trump'] = ''
+            if session.info:
+                response['info_header'] = session.info
+        elif session.state == 'endGame':
+            turn = session.getDealer()
+            response['state'] = 'ready'
+            response['info_header'] = session.info
+            opponent1 = session.getNextPlayer(player)
+            opponent2 = session.getNextPlayer(opponent1)
+            response['player_info'] = 'Took: %d' % player.bet
+            response['opponent1_info'] = 'Took: %d' % opponent1.bet
+            response['opponent2_info'] = 'Took: %d' % opponent2.bet
+            response['cards'] = []
+            response['bank'] = [(len(p.thrown) > 0 and str(p.thrown[-1])) or None for p in (player, opponent1, opponent2)]
+        elif session.state == 'finish':
+            response['state'] = 'finish'
+            response['info_header'] = session.info
+            response['player_info'] = 'Took: %d' % player.bet
+            response['opponent1_info'] = 'Took: %d' % opponent1.bet
+            response['opponent2_info'] = 'Took: %d' % opponent2.bet
+            response['cards'] = []
+            response['bank'] = [str(p.thrown[-1]) for p in (player, opponent1, opponent2)]
+
+        if turn == player: response['player_turn'] = True
+        elif turn == opponent1: response['opponent1_turn'] = True
+        elif turn == opponent2: response['opponent2_turn'] = True
+
+    else:
+        response['info_header'] = 'Waiting for players'
+        response['state'] = 'hosted'
+    return response
+
 class Update(webapp.RequestHandler):
+    """
+    Returns the state of the session to the client. With wait parameter
+    the versions of the session and chat are compared with the ones the
+    client sent first (and with LONG_POLL the request is held up to
+    POLL_TIMEOUT seconds until they change); if nothing changed, only
+    {"unchanged": true} is returned. The answer tells the client when to
+    poll again.
+    """
+
     def get(self):
         try:
-            state = self.getState(self)
+            if self.request.get('wait') and self.waitForChange():
+                state = {'unchanged': True}
+            else:
+                state = self.getState(self)
+            state['poll'] = LONG_POLL and 100 or POLL_DELAY
             out = json.dumps(state, separators=(',',':'))
             self.response.headers['Content-Type'] = 'application/json'
             return self.response.out.write(out)
         except GameError, error:
             return self.response.out.write(render('error.html', {'error': error}))
-    
+
+    def waitForChange(self):
+        """
+        Polls the cached versions of the session and its chat. Returns True
+        if they still match the client ones (after POLL_TIMEOUT with
+        LONG_POLL).
+        """
+
+        try:
+            id = int(self.request.get('id'))
+            version = int(self.request.get('version'))
+            since = int(self.request.get('chat_seq') or 0)
+        except ValueError:
+            return False
+        deadline = time.time() + (LONG_POLL and POLL_TIMEOUT or 0)
+        while sessionCache.getVersion(id) == version and chatCache.getVersion(id) == since:
+            if time.time() >= deadline:
+                return True
+            time.sleep(POLL_INTERVAL)
+        return False
+
     def getState(self, handler):
-        response = {}
         user = users.get_current_user()
-        id = self.request.get('id')
-        last = self.request.get('last')
-        response['last'] = repr(time.time())
         session = getSession(handler)
-        lastChat = self.request.get('last_chat')
-        if lastChat:
-            stamp = datetime.datetime.fromtimestamp(float(lastChat)+1)
-            query = db.GqlQuery("SELECT * FROM Chat " + "WHERE session = :1 AND datetime > :2 ORDER BY datetime", session, stamp)
-        else:
-            query = db.GqlQuery("SELECT * FROM Chat " + "WHERE session = :1 ORDER BY datetime", session)
-        results = query.fetch(100)
-        if results:
-            response['last_chat'] = repr(time.mktime(results[-1].datetime.timetuple()))
-        response['chat'] = [{'datetime': r.datetime.strftime('%Y.%m.%d %H:%M:%S'), 
-                             'player': r.player.user.nickname(), 
-                             'message': r.message} for r in results]
-        
+        try:
+            since = int(self.request.get('chat_seq') or 0)
+        except ValueError:
+            since = 0
+        chat_seq, chat = ChatLog.read(session, since)
+
         player = session.getPlayerByUser(user)
         if player is None:
-            player = session.join(user)
-
-        if session.player_1 == player:
-            opponent1, opponent2 = session.player_2, session.player_3
-        elif session.player_2 == player:
-            opponent1, opponent2 = session.player_3, session.player_1
-        elif session.player_3 == player:
-            opponent1, opponent2 = session.player_1, session.player_2
-
-        for p in ('player', 'opponent1', 'opponent2'):
-            pl = eval(p)
-            response[p + '_turn'] = ''
-            response[p + '_info'] = ''
-            if pl:
-                response[p + '_username'] = pl.user.nickname()
-                response[p + '_points'] = str(pl.points) + ' points'
-                response[p + '_plus'] = pl.plus
-                response[p + '_barrel'] = pl.barrel
-            else:
-                response[p + '_username'] = '[Not connected]'
-                response[p + '_points'] = ''
-                response[p + '_plus'] = False
-                response[p + '_barrel'] = 0
-
-        response['info_header'] = ''
-
-        if session.isFull():
-            turn = session.turn
-            if player.blind is True:
-                response['state'] = 'go_blind'
-                response['cards'] = ['BACK'] * 7
-            elif player.blind is False:
-                response['state'] = 'go_open'
-                response['cards'] = [str(c) for c in sorted(player.cards)]
-            else:
-                response['state'] = 'open_or_blind'
-                response['cards'] = ['BACK'] * 7
-            if session.state == 'ready':
-                turn = session.dealer
-                response['state'] = 'ready'
-            elif session.state == 'bettings':
-                response['info_header'] = session.info
-                response['bank'] = ['BACK'] * 3
-                response['passed'] = player.passed
-                response['first'] = session.isFirstMove()
-                if not player.passed:
-                    response['bettings'] = []
-                    for bet in range(session.bet + 10, 301, 10):
-                        response['bettings'].append(bet)
-                for p in ('player', 'opponent1', 'opponent2'):
-                    pl = eval(p)
-                    if pl.passed:
-                        response[p + '_info'] = 'Pass'
-                    elif pl.bet:
-                        response[p + '_info'] = 'Bet %d' % pl.bet
-                        if (pl.blind):
-                            response[p + '_info'] += ' (Blind)'
-                    else:
-                        response[p + '_info'] = ''
-            elif session.state == 'collect':
-                winner = session.betsWinner()
-                response['info_header'] = '%s takes the bank' % session.betsWinner().user.nickname()
-                response['state'] = 'collect'
-                response['cards'] = [str(c) for c in sorted(player.cards)]
-                if player == winner:
-                    response['bank'] = [str(c) for c in session.bank]
-                else:
-                    if session.blind:
-                        response['bank'] = ['BACK'] * 3
-                    else:
-                        response['bank'] = [str(c) for c in session.bank]
-            elif session.state == 'finalBet':
-                response['state'] = 'finalBet'
-                response['cards'] = [str(c) for c in sorted(player.cards)]
-                if turn == player:
-                    response['info_header'] = 'Discard 3 card and make final bet'
-                    response['bank'] = [str(c) for c in session.bank]
-                    if session.blind:
-                        response['bettings'] = [session.bet]
-                        for bet in range(session.bet*2, 301, 10):
-                            response['bettings'].append(bet)
-                    else:
-                        response['bettings'] = []
-                        for bet in range(session.bet, 301, 10):
-                            response['bettings'].append(bet)
-                else:
-                    response['info_header'] = 'Waiting for final bet'
-                    response['bank'] = ['BACK'] * len(session.bank)
-            elif session.state == 'inGame':
-                response['state'] = 'inGame'
-                opponent1 = session.getNextPlayer(player)
-                opponent2 = session.getNextPlayer(opponent1)
-                offset = max(len(player.thrown), len(opponent1.thrown), len(opponent2.thrown))
-                response['bank'] = []
-                response['memo'] = []
-                response['taken'] = 'Taken: ' + str(player.getGamePoints())
-                for pl in ('player', 'opponent1', 'opponent2'):
-                    p = eval(pl)
-                    if p == session.betsWinner():
-                        response[pl + '_info'] = 'Plays %d' % session.bet
-                        if session.blind:
-                            response[pl + '_info'] += ' (Blind)'
-                    if offset > 0 and len(p.thrown) == offset:
-                        response['bank'].append(str(p.thrown[offset-1]))
-                    else:
-                        response['bank'].append(None)
-                    if offset > 1 and len(p.thrown) >= offset-1:
-                        response['memo'].append(str(p.thrown[offset-2]))
-                    else:
-                        response['memo'].append(None)
-                if len(player.thrown) == 0:
-                    if session.blind:
-                        response['memo'] = ['BACK'] * 3
-                    else:
-                        response['memo'] = [str(c) for c in session.memo]
-                response['cards'] = [str(c) for c in sorted(player.cards)]
-                if session.trump:
-                    response['trump'] = 'Trump: ' + ThousandCard.kinds[session.trump]
-                else:
-                    response['trump'] = ''
-                if session.info:
-                    response['info_header'] = session.info
-            elif session.state == 'endGame':
-                turn = session.dealer
-                response['state'] = 'ready'
-                response['info_header'] = session.info
-                opponent1 = session.getNextPlayer(player)
-                opponent2 = session.getNextPlayer(opponent1)
-                response['player_info'] = 'Took: %d' % player.bet
-                response['opponent1_info'] = 'Took: %d' % opponent1.bet
-                response['opponent2_info'] = 'Took: %d' % opponent2.bet
-                response['cards'] = []
-                response['bank'] = [(len(p.thrown) > 0 and str(p.thrown[-1])) or None for p in (player, opponent1, opponent2)]
-            elif session.state == 'finish':
-                response['state'] = 'finish'
-                response['info_header'] = session.info
-                response['player_info'] = 'Took: %d' % player.bet
-                response['opponent1_info'] = 'Took: %d' % opponent1.bet
-                response['opponent2_info'] = 'Took: %d' % opponent2.bet
-                response['cards'] = []
-                response['bank'] = [str(p.thrown[-1]) for p in (player, opponent1, opponent2)]
-
-            if turn == player: response['player_turn'] = True
-            elif turn == opponent1: response['opponent1_turn'] = True
-            elif turn == opponent2: response['opponent2_turn'] = True
+            session = runAction(handler, joinSession)
+            player = session.getPlayerByUser(user)
 
-        else:
-            response['info_header'] = 'Waiting for players'
-            response['state'] = 'hosted'
+        watchSeat(session, player)
+        response = buildState(session, player)
+        response['last'] = repr(time.time())
+        response['chat_seq'], response['chat'] = chat_seq, chat
         return response
 
 class Chat(webapp.RequestHandler):
     def post(self):
         user = users.get_current_user()
         session = getSession(self)
-        player = session.getPlayerByUser(user)
         message = self.request.get('message')
-        chat = models.Chat()
-        chat.session = session
-        chat.player = player
-        chat.message = message
-        chat.put()
\ No newline at end of file
+        number = ChatLog.post(session, user, message)
+        seq, chat = ChatLog.read(session, number)
+        getPublisher().publish([(chatChannel(session.key().id()), {'chat_seq': seq, 'chat': chat})])